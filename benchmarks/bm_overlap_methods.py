@@ -19,6 +19,9 @@ elif sys.version[0] == '3':
 import numpy as np
 import chronostar._overlap as overlap
 
+# Kernels used by get_lnoverlaps, see overlap.set_lnoverlap_kernel
+KERNELS = {'gsl':0, 'cholesky':1}
+
 def compute_overlap(A,a,A_det,B,b,B_det):
     """Compute the overlap integral between a star and group mean + covariance matrix
     in six dimensions, including some temporary variables for speed and to match the 
@@ -100,6 +103,20 @@ def correctness(group_icov, group_mean, group_icov_det, star_icovs,
         assert np.isclose(numpy_ols, swig_np_ols, rtol=1e-8)
         assert np.isclose(numpy_ols, np.exp(swig_np_ms_lnols[i]), rtol=1e-8)
 
+    # Compare the two kernels available to get_lnoverlaps
+    orig_kernel = overlap.get_lnoverlap_kernel()
+    kernel_lnols = {}
+    try:
+        for name, kernel_ix in KERNELS.items():
+            overlap.set_lnoverlap_kernel(kernel_ix)
+            kernel_lnols[name] = overlap.get_lnoverlaps(
+                group_cov, group_mean, star_covs, star_means, nstars
+            )
+    finally:
+        overlap.set_lnoverlap_kernel(orig_kernel)
+    assert np.allclose(kernel_lnols['gsl'], kernel_lnols['cholesky'],
+                       rtol=1e-8)
+
     print("All implementations return same result to 8 sigfigs")
 
 def timings(group_icov, group_mean, group_icov_det,
@@ -171,6 +188,27 @@ def timings(group_icov, group_mean, group_icov_det,
                 numpy_time / (end - newswignpmultistart)
         ))
 
+    orig_kernel = overlap.get_lnoverlap_kernel()
+    kernel_times = {}
+    try:
+        for name, kernel_ix in KERNELS.items():
+            overlap.set_lnoverlap_kernel(kernel_ix)
+            kernelstart = timer()
+            for i in range(int(noverlaps/batch_size)):
+                result = overlap.get_lnoverlaps(group_cov, group_mean,
+                                                star_covs, star_means,
+                                                batch_size)
+            kernel_times[name] = timer() - kernelstart
+            print("Swigging numpy multi logged, {} kernel: {} s".format(
+                    name, kernel_times[name]))
+            print("  -> {} microsec per overlap".\
+                    format(kernel_times[name]/noverlaps*1e6))
+    finally:
+        overlap.set_lnoverlap_kernel(orig_kernel)
+    print('Speed up of cholesky kernel over gsl kernel is {}'.format(
+            kernel_times['gsl'] / kernel_times['cholesky']
+    ))
+
 # ------------- MAIN PROGRAM -----------------------
 if __name__ == '__main__':
 
@@ -0,0 +1,431 @@
+"""
+bgoverlap.py
+
+Fast calculation of the overlaps of stars with the background, i.e. with
+a kernel density estimate of the phase-space distribution of some large
+reference set (e.g. every Gaia star with a radial velocity).
+
+The background density is a sum of Gaussian kernels, one centred on
+each reference star, which all share the same (bandwidth) covariance
+matrix B. The log overlap of a star (mean x, covariance S) with the
+background is then
+
+    ln sum_j N(m_j; x, S + B)
+
+Evaluated naively this is an O(N*M) loop of 6x6 matrix operations for N
+stars and M reference stars. Here the reference stars are instead whitened
+by B once (such that B becomes the identity), and split into the leaves
+of a KD-tree, each with a bounding box. Since S + B is at least as broad
+as B in every direction, the Mahalanobis distance of a star to a
+reference star lies between the whitened distance divided by the square
+root of lambda (the largest eigenvalue of the whitened S + B) and the
+whitened distance itself. The distances from a star to each box then
+bound the contribution of every leaf. Leaves are summed exactly in order
+of their upper bound, until the bound on the remaining leaves is within
+a relative `rtol` of the sum so far.
+
+Overlaps can also be kept in a BackgroundOverlapStore, a directory of
+.npz shards, such that re-preparing a region (or extending it) only
+computes the overlaps of stars not seen before with this reference set.
+
+Usage
+-----
+>>> engine = BackgroundOverlapEngine(background_means)
+>>> bg_lnols = engine.get_lnols(star_means, star_covs, nprocesses=4,
+...                             store_dir='bg_ols_store')
+"""
+from __future__ import print_function, division
+
+import hashlib
+import logging
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+import uuid
+from scipy.special import logsumexp
+
+
+def get_bandwidth(nstars, dim=6):
+    """The kernel bandwidth factor for `nstars` samples by Scott's rule"""
+    return nstars**(-1.0 / (dim + 4.0))
+
+
+def get_reference_key(background_means, bandwidth):
+    """
+    Identifies a background density, by a hash of the reference stars'
+    means along with the kernel bandwidth
+    """
+    background_means = np.ascontiguousarray(background_means,
+                                            dtype=np.float64)
+    sha1 = hashlib.sha1(background_means.tobytes())
+    sha1.update(repr(float(bandwidth)).encode())
+    return sha1.hexdigest()[:16]
+
+
+def get_star_keys(star_means, star_covs, star_ids=None):
+    """
+    Identifies each star by a hash of its mean and covariance matrix (and
+    id, e.g. Gaia source_id, if given)
+
+    Returns
+    -------
+    star_keys: [nstars] 'S16' array
+    """
+    star_means = np.ascontiguousarray(star_means, dtype=np.float64)
+    star_covs = np.ascontiguousarray(star_covs, dtype=np.float64)
+    if star_ids is None:
+        star_ids = [''] * len(star_means)
+    star_keys = np.zeros(len(star_means), dtype='S16')
+    for i, (star_id, mean, cov) in enumerate(zip(star_ids, star_means,
+                                                 star_covs)):
+        sha1 = hashlib.sha1(str(star_id).encode())
+        sha1.update(mean.tobytes())
+        sha1.update(cov.tobytes())
+        star_keys[i] = sha1.digest()[:16]
+    return star_keys
+
+
+def build_kd_leaves(points, leafsize=256):
+    """
+    Split points into the leaves of a KD-tree, by repeatedly halving each
+    set at the median of its widest dimension.
+
+    Parameters
+    ----------
+    points: [npoints,dim] float array
+    leafsize: int {256}
+        Sets are split until they hold no more than this many points
+
+    Returns
+    -------
+    order: [npoints] int array
+        Indices of `points` such that each leaf is contiguous
+    leaf_starts: [nleaves+1] int array
+        Leaf i is order[leaf_starts[i]:leaf_starts[i+1]]
+    """
+    order = np.arange(len(points))
+    leaf_starts = [0]
+    # Stack of (start, stop) ranges of `order` still to be split
+    ranges = [(0, len(points))]
+    while ranges:
+        start, stop = ranges.pop()
+        if stop - start <= leafsize:
+            leaf_starts.append(stop)
+            continue
+        ixs = order[start:stop]
+        split_dim = np.argmax(np.ptp(points[ixs], axis=0))
+        mid = (stop - start) // 2
+        part = np.argpartition(points[ixs, split_dim], mid)
+        order[start:stop] = ixs[part]
+        # Upper half pushed first, such that leaves are found in order
+        ranges.append((start + mid, stop))
+        ranges.append((start, start + mid))
+    return order, np.array(leaf_starts)
+
+
+class BackgroundOverlapEngine(object):
+    """
+    Calculates the log overlaps of stars with a kernel density estimate of
+    the background built from `background_means`.
+
+    Parameters
+    ----------
+    background_means: [nbgstars,6] float array_like
+        Phase-space positions of some star set that greatly envelops the
+        stars in question. Typically contents of gaia_xyzuvw.npy.
+    bandwidth: float {None}
+        The kernel covariance matrix is the covariance of
+        `background_means` scaled by `bandwidth`**2. Defaults to Scott's
+        rule, as in expectmax.get_background_overlaps_with_covariances.
+    leafsize: int {256}
+        Maximum number of background stars in each leaf, see
+        `build_kd_leaves`
+    """
+    def __init__(self, background_means, bandwidth=None, leafsize=256):
+        background_means = np.asarray(background_means, dtype=np.float64)
+        self.nbgstars, self.dim = background_means.shape
+        if bandwidth is None:
+            bandwidth = get_bandwidth(self.nbgstars, self.dim)
+        self.bandwidth = bandwidth
+        self.ref_key = get_reference_key(background_means, bandwidth)
+        self.background_cov = np.cov(background_means.T) * bandwidth**2
+
+        # Whiten, such that each kernel has the identity as covariance
+        self._bg_chol = np.linalg.cholesky(self.background_cov)
+        self._bg_chol_inv = np.linalg.inv(self._bg_chol)
+        self._ln_det_bg = 2 * np.sum(np.log(np.diag(self._bg_chol)))
+        whitened_means = np.dot(background_means, self._bg_chol_inv.T)
+
+        # Store the whitened means leaf by leaf
+        order, self.leaf_starts = build_kd_leaves(whitened_means, leafsize)
+        self.whitened_means = whitened_means[order]
+        self.leaf_lo = np.minimum.reduceat(self.whitened_means,
+                                           self.leaf_starts[:-1])
+        self.leaf_hi = np.maximum.reduceat(self.whitened_means,
+                                           self.leaf_starts[:-1])
+        self.ln_leaf_counts = np.log(np.diff(self.leaf_starts))
+
+    def get_star_lnol(self, star_mean, star_cov, rtol=1e-6):
+        """
+        The log overlap of a single star with the background.
+
+        Parameters
+        ----------
+        star_mean: [6] float array_like
+        star_cov: [6,6] float array_like
+        rtol: float {1e-6}
+            The maximum relative error of the overlap (so roughly the
+            absolute error of the log overlap) caused by ignoring distant
+            background stars. With 0, every background star is summed.
+
+        Returns
+        -------
+        bg_lnol: float
+            -np.inf if the star's mean or covariance matrix are invalid
+        """
+        # Whitened star, combined covariance matrix is identity + star's
+        mean = np.dot(self._bg_chol_inv, star_mean)
+        cov = np.identity(self.dim) \
+              + np.dot(self._bg_chol_inv, np.dot(star_cov, self._bg_chol_inv.T))
+        if not (np.all(np.isfinite(mean)) and np.all(np.isfinite(cov))):
+            return -np.inf
+        try:
+            chol = np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            return -np.inf
+        chol_inv = np.linalg.inv(chol)
+        max_eigval = np.linalg.eigvalsh(cov)[-1]
+        ln_norm = -0.5 * (self.dim * np.log(2*np.pi) + self._ln_det_bg
+                          + 2 * np.sum(np.log(np.diag(chol))))
+
+        if rtol <= 0:
+            return ln_norm + self._sum_kernels(mean, chol_inv,
+                                               np.arange(len(self.leaf_lo)))
+
+        # Bound each leaf's (log) contribution by the nearest point of its box
+        below = np.maximum(self.leaf_lo - mean, 0.)
+        above = np.maximum(mean - self.leaf_hi, 0.)
+        min_dist_sq = np.sum((below + above)**2, axis=1)
+        ln_upper = self.ln_leaf_counts - 0.5 * min_dist_sq / max_eigval
+
+        leaf_order = np.argsort(-ln_upper)
+        ln_upper = ln_upper[leaf_order]
+        # ln_tails[k] bounds the leaves after the first k+1
+        ln_tails = np.append(
+            np.logaddexp.accumulate(ln_upper[::-1])[::-1][1:], -np.inf
+        )
+
+        # First guess assumes each included leaf gives its upper bound
+        nincluded = 1 + np.argmax(
+            ln_tails <= np.log(rtol) + np.logaddexp.accumulate(ln_upper)
+        )
+        ln_included = self._sum_kernels(mean, chol_inv,
+                                        leaf_order[:nincluded])
+        if ln_tails[nincluded-1] > np.log(rtol) + ln_included:
+            # Include enough leaves that the remainder is within `rtol` of
+            # the sum so far, which can only grow
+            nextra = 1 + np.argmax(ln_tails <= np.log(rtol) + ln_included)
+            ln_included = np.logaddexp(
+                ln_included,
+                self._sum_kernels(mean, chol_inv,
+                                  leaf_order[nincluded:nextra])
+            )
+        return ln_norm + ln_included
+
+    def _sum_kernels(self, mean, chol_inv, leaf_ixs):
+        """
+        ln of the sum of exp(-0.5 * Mahalanobis distance^2) between the
+        whitened star and the background stars in leaves `leaf_ixs`
+        """
+        if len(leaf_ixs) == 0:
+            return -np.inf
+        diffs = np.concatenate([
+            self.whitened_means[self.leaf_starts[i]:self.leaf_starts[i+1]]
+            for i in leaf_ixs
+        ]) - mean
+        ys = np.dot(diffs, chol_inv.T)
+        return logsumexp(-0.5 * np.einsum('ij,ij->i', ys, ys))
+
+    def get_lnols(self, star_means, star_covs, rtol=1e-6, nprocesses=1,
+                  chunk_size=1000, store_dir=None, star_ids=None):
+        """
+        The log overlaps of many stars with the background.
+
+        If `store_dir` is given, overlaps already in the
+        BackgroundOverlapStore there (for this reference set, and
+        calculated with a `rtol` no larger) are reused, and only the rest
+        calculated then added to it.
+
+        Parameters
+        ----------
+        star_means: [nstars,6] float array_like
+        star_covs: [nstars,6,6] float array_like
+        rtol: float {1e-6}
+            See `get_star_lnol`
+        nprocesses: int {1}
+            If more than 1, the stars are split into chunks of
+            `chunk_size` and shared between this many worker processes,
+            each holding a copy of the engine
+        chunk_size: int {1000}
+        store_dir: string {None}
+            Directory of a BackgroundOverlapStore
+        star_ids: [nstars] array_like {None}
+            Identifiers of the stars (e.g. Gaia source_id) to include in
+            their keys in the store
+
+        Returns
+        -------
+        bg_lnols: [nstars] float array
+        """
+        star_means = np.asarray(star_means, dtype=np.float64)
+        star_covs = np.asarray(star_covs, dtype=np.float64)
+        if store_dir is not None:
+            store = BackgroundOverlapStore(store_dir, self.ref_key)
+            star_keys = get_star_keys(star_means, star_covs, star_ids)
+            bg_lnols, found = store.lookup(star_keys, rtol)
+            logging.info('{} of {} background overlaps found in {}'.format(
+                    np.sum(found), len(found), store.shard_dir))
+            if not np.all(found):
+                missing = np.where(~found)[0]
+                bg_lnols[missing] = self.get_lnols(
+                        star_means[missing], star_covs[missing], rtol=rtol,
+                        nprocesses=nprocesses, chunk_size=chunk_size,
+                )
+                store.insert(star_keys[missing], bg_lnols[missing], rtol)
+            return bg_lnols
+
+        if nprocesses is None or nprocesses <= 1 \
+                or len(star_means) <= chunk_size:
+            return _get_chunk_lnols((star_means, star_covs, rtol),
+                                    engine=self)
+
+        tasks = [(star_means[start:start+chunk_size],
+                  star_covs[start:start+chunk_size], rtol)
+                 for start in range(0, len(star_means), chunk_size)]
+        pool = multiprocessing.Pool(processes=nprocesses,
+                                    initializer=_init_worker,
+                                    initargs=(self,))
+        try:
+            bg_lnols = pool.map(_get_chunk_lnols, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        return np.hstack(bg_lnols)
+
+
+# The engine held by a worker process, set once by `_init_worker`
+_worker_engine = {}
+
+
+def _init_worker(engine):
+    """Pool initializer, stores the engine in the worker's module globals"""
+    _worker_engine['engine'] = engine
+
+
+def _get_chunk_lnols(task, engine=None):
+    """
+    Background log overlaps of a chunk of stars, `task` being
+    (star_means, star_covs, rtol). Uses the worker's engine if `engine`
+    isn't given.
+    """
+    if engine is None:
+        engine = _worker_engine['engine']
+    star_means, star_covs, rtol = task
+    bg_lnols = np.zeros(len(star_means))
+    for i, (star_mean, star_cov) in enumerate(zip(star_means, star_covs)):
+        bg_lnols[i] = engine.get_star_lnol(star_mean, star_cov, rtol=rtol)
+        if bg_lnols[i] == -np.inf:
+            logging.warning('Background overlap of star {} failed, setting '
+                            'it to -inf'.format(i))
+    return bg_lnols
+
+
+class BackgroundOverlapStore(object):
+    """
+    A directory of previously calculated background log overlaps, keyed
+    by star (see `get_star_keys`).
+
+    Each reference set (see `get_reference_key`) has its own
+    subdirectory of shards, each an .npz of the 'keys', 'lnols' and
+    'rtols' added together. Shards are only ever added (whole, by a
+    rename), so many processes may share a store.
+
+    Parameters
+    ----------
+    store_dir: string
+        Created if it doesn't exist
+    ref_key: string
+        Key of the reference set, e.g. BackgroundOverlapEngine.ref_key
+    """
+    def __init__(self, store_dir, ref_key):
+        self.shard_dir = os.path.join(store_dir, ref_key)
+
+    def load(self):
+        """
+        Returns
+        -------
+        keys: [nentries] 'S16' array
+        lnols: [nentries] float array
+        rtols: [nentries] float array
+            The `rtol` with which each overlap was calculated
+        """
+        keys, lnols, rtols = [np.zeros(0, dtype='S16')], [np.zeros(0)], \
+                             [np.zeros(0)]
+        if os.path.isdir(self.shard_dir):
+            for filename in sorted(os.listdir(self.shard_dir)):
+                if not filename.endswith('.npz'):
+                    continue
+                with np.load(os.path.join(self.shard_dir, filename)) as shard:
+                    keys.append(shard['keys'])
+                    lnols.append(shard['lnols'])
+                    rtols.append(shard['rtols'])
+        return np.hstack(keys), np.hstack(lnols), np.hstack(rtols)
+
+    def lookup(self, star_keys, rtol=1e-6):
+        """
+        Find the stored overlaps of `star_keys` calculated with a `rtol`
+        no larger than `rtol`.
+
+        Returns
+        -------
+        bg_lnols: [nstars] float array
+            nan where not found
+        found: [nstars] bool array
+        """
+        keys, lnols, rtols = self.load()
+        usable = rtols <= max(rtol, 0.)
+        keys, lnols = keys[usable], lnols[usable]
+
+        if len(keys) == 0:
+            return np.full(len(star_keys), np.nan), \
+                   np.zeros(len(star_keys), dtype=bool)
+
+        order = np.argsort(keys)
+        keys, lnols = keys[order], lnols[order]
+        ixs = np.minimum(np.searchsorted(keys, star_keys), len(keys) - 1)
+        found = keys[ixs] == star_keys
+        return np.where(found, lnols[ixs], np.nan), found
+
+    def insert(self, star_keys, bg_lnols, rtol=1e-6):
+        """
+        Add overlaps calculated with `rtol` as a new shard. Failing to
+        (e.g. for a read only directory) is not an error.
+        """
+        if len(star_keys) == 0:
+            return
+        try:
+            if not os.path.isdir(self.shard_dir):
+                os.makedirs(self.shard_dir)
+            fd, tmp_file = tempfile.mkstemp(dir=self.shard_dir,
+                                            suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(fp, keys=np.asarray(star_keys, dtype='S16'),
+                         lnols=np.asarray(bg_lnols, dtype=np.float64),
+                         rtols=np.full(len(star_keys), max(rtol, 0.)))
+            os.rename(tmp_file, os.path.join(
+                    self.shard_dir, 'shard_{}.npz'.format(uuid.uuid4().hex)
+            ))
+        except (IOError, OSError) as err:
+            logging.warning('Could not store background overlaps in '
+                            '{}: {}'.format(self.shard_dir, err))
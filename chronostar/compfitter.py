@@ -16,12 +16,16 @@ import numpy as np
 
 # from astropy.table import Table
 import emcee
+import hashlib
 import logging
 import os
+import pickle
+import shutil
 import multiprocessing
 import scipy.optimize
 import itertools
 
+from . import datapool
 from . import likelihood
 from . import tabletool
 from . import component
@@ -162,6 +166,141 @@ def burnin_convergence(lnprob, tol=0.25, slice_size=100, cutoff=0, debug=False):
     return stable
 
 
+def calc_autocorr_time(chain, c=5.):
+    """
+    Estimate the integrated autocorrelation time of each parameter
+    of an emcee chain, i.e. the number of steps between effectively
+    independent samples.
+
+    The autocorrelation function of each walker is found by FFT, then
+    averaged over walkers. It is summed up to the smallest window M for
+    which M >= c*tau (Sokal's automatic windowing, as in emcee's
+    autocorr.integrated_time).
+
+    Parameters
+    ----------
+    chain: [nwalkers, nsteps, npars] float array
+    c: float {5.}
+        Window size in units of tau
+
+    Returns
+    -------
+    tau: [npars] float array
+        inf for parameters which haven't moved
+    """
+    chain = np.asarray(chain, dtype=np.float64)
+    nsteps = chain.shape[1]
+    nfft = 2**int(np.ceil(np.log2(2*nsteps)))
+    diffs = chain - np.mean(chain, axis=1, keepdims=True)
+    fft = np.fft.rfft(diffs, n=nfft, axis=1)
+    acf = np.fft.irfft(fft * np.conjugate(fft), n=nfft, axis=1)[:, :nsteps]
+    acf = np.mean(acf, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        acf /= acf[0]
+        taus = 2. * np.cumsum(acf, axis=0) - 1.
+    tau = np.full(chain.shape[2], np.inf)
+    for i in range(chain.shape[2]):
+        if not np.all(np.isfinite(taus[:, i])):
+            continue
+        window = np.where(np.arange(nsteps) >= c * taus[:, i])[0]
+        tau[i] = taus[window[0] if len(window) else -1, i]
+    return tau
+
+
+def calc_gelman_rubin(chain):
+    """
+    The Gelman-Rubin statistic (potential scale reduction factor) of each
+    parameter, treating each walker as a separate chain. Values near
+    1 indicate the walkers have mixed, i.e. each explores the same
+    distribution.
+
+    Parameters
+    ----------
+    chain: [nwalkers, nsteps, npars] float array
+
+    Returns
+    -------
+    rhat: [npars] float array
+    """
+    chain = np.asarray(chain, dtype=np.float64)
+    nsteps = chain.shape[1]
+    within_var = np.mean(np.var(chain, axis=1, ddof=1), axis=0)
+    between_var = np.var(np.mean(chain, axis=1), axis=0, ddof=1)
+    pooled_var = (nsteps - 1.) / nsteps * within_var + between_var
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(pooled_var / within_var)
+
+
+def autocorr_convergence(chain, lnprob, tau_factor=20., rhat_tol=1.1):
+    """
+    Checks a burnin chain for convergence by its autocorrelation time
+    and Gelman-Rubin statistic, both measured over the whole chain.
+
+    Parameters
+    ----------
+    chain: [nwalkers, nsteps, npars] float array
+    lnprob: [nwalkers, nsteps] float array
+    tau_factor: float {20.}
+        The chain must be this many autocorrelation times long
+    rhat_tol: float {1.1}
+        The Gelman-Rubin statistic of every parameter must be below this
+
+    Returns
+    -------
+    converged: bool
+        True iff both criteria are met and no walkers are stuck
+    tau: float
+        The largest autocorrelation time of any parameter
+    """
+    nsteps = chain.shape[1]
+    if nsteps < 4:
+        return False, np.inf
+    tau = np.max(calc_autocorr_time(chain))
+    rhat = np.max(calc_gelman_rubin(chain))
+    no_stuck, _ = no_stuck_walkers(lnprob)
+    converged = bool(nsteps >= tau_factor * tau and rhat < rhat_tol
+                     and no_stuck)
+    logging.info("After {} steps, tau: {:.1f}, R-hat: {:.3f}, converged: "
+                 "{}".format(chain.shape[1], tau, rhat, converged))
+    return converged, tau
+
+
+def shift_poor_walkers(pos, lnprob, stuck_walker_checks):
+    """
+    Help out struggling walkers between burnins by shifting stuck walkers,
+    and those in the worst third by lnprob, to the best walker's position
+
+    Parameters
+    ----------
+    pos: [nwalkers, npars] float array
+        The walkers' final positions, modified in place
+    lnprob: [nwalkers] float array
+        The walkers' final lnprob
+    stuck_walker_checks: [nwalkers] bool array_like
+        False for stuck walkers, see no_stuck_walkers
+    """
+    lnprob_not_stuck = lnprob[stuck_walker_checks]
+    best_ix = np.argmax(lnprob_not_stuck)
+
+    # Walkers with poor lnprob
+    poor_ixs = np.where(lnprob_not_stuck < np.percentile(lnprob_not_stuck, 33))
+    poor_ixs = list(poor_ixs)
+
+    # Add stuck walkers
+    ixs = np.where(~np.array(stuck_walker_checks))
+    ixs = list(ixs)
+    poor_ixs.extend(ixs)
+
+    # Add walkers with NaNs
+    #poor_ixs.extend(np.argwhere(np.isnan(     AAAAAA      )).flatten())
+
+    poor_ixs = list(itertools.chain(*poor_ixs))
+    print(poor_ixs)
+
+    for ix in set(poor_ixs):
+        pos[ix] = pos[best_ix]
+
+
 def get_init_emcee_pos(data, memb_probs=None, nwalkers=None,
                        init_pars=None, Component=SphereComponent):
     """
@@ -210,7 +349,7 @@ def get_init_emcee_pos(data, memb_probs=None, nwalkers=None,
 
     # In the case of Neelesh ellipcompnent, force dx > dy and du > dv
     if Component == EllipComponent \
-            or (Component.COMPONENT_NAME == 'EllipticalComponent'):
+            or (getattr(Component, 'COMPONENT_NAME', None) == 'EllipticalComponent'):
         import pdb; pdb.set_trace()
         for emcee_pars in init_pos:
             ext_pars = Component.externalise(emcee_pars)
@@ -259,12 +398,241 @@ def get_best_component(chain, lnprob, Component=SphereComponent):
     return best_component
 
 
+def run_mcmc_segment(sampler, pos, nsteps, lnprob=None, random_state=None):
+    """
+    Run `sampler` for `nsteps` from `pos`, continuing an earlier run
+    exactly if its final `lnprob` and `random_state` are given (rather
+    than evaluating lnprob of `pos` again and drawing new random numbers).
+
+    Returns
+    -------
+    pos, lnprob, random_state
+        The final state of the walkers
+    """
+    if hasattr(emcee, 'State'):
+        # emcee >= 3
+        initial_state = emcee.State(pos, log_prob=lnprob,
+                                    random_state=random_state)
+        result = sampler.run_mcmc(initial_state, nsteps)
+    else:
+        result = sampler.run_mcmc(pos, nsteps, lnprob0=lnprob,
+                                  rstate0=random_state)
+    pos, lnprob, random_state = tuple(result)[:3]
+    return pos, lnprob, random_state
+
+
+class ChainCheckpoint(object):
+    """
+    On disk store of emcee chains, written every `every` steps, such that
+    a killed fit can resume from its last checkpoint and the sampler
+    never holds more than `every` steps in memory.
+
+    A fit runs through stages (each burnin, then sampling). Each is run
+    in segments, each segment's chain and lnprob saved as .npy shards,
+    followed by the walkers' state (positions, lnprob and random state).
+
+    Parameters
+    ----------
+    checkpoint_dir: str
+        Created if it doesn't exist
+    every: int {100}
+        Steps between checkpoints. A checkpoint saved every other number
+        of steps isn't resumed
+    """
+    STATE_FILE = 'state.pkl'
+
+    def __init__(self, checkpoint_dir, every=100):
+        self.checkpoint_dir = checkpoint_dir
+        self.every = every
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+    @staticmethod
+    def get_inputs_key(data, memb_probs, init_pos=None, **fit_pars):
+        """
+        Identifies the fit a checkpoint belongs to, by its data (star
+        means and covariances), memberships, initial walker positions and
+        any other settings that change the chain.
+
+        Parameters
+        ----------
+        data: dict
+            As in `fit_comp`
+        memb_probs: [nstars] float array
+        init_pos: [nwalkers, npars] float array {None}
+            Walkers' initial positions, if set by the caller. Those drawn
+            by `fit_comp` are left out, as they depend on the global
+            random state, which a resumed fit needn't share
+        fit_pars:
+            Any other settings (e.g. nwalkers, burnin_steps,
+            trace_orbit_func, Component). Functions and classes are
+            identified by their qualified names
+        """
+        sha1 = hashlib.sha1()
+        arrays = [data[key] for key in ('means', 'covs', 'packed_covs')
+                  if data.get(key) is not None]
+        arrays.append(memb_probs)
+        if init_pos is not None:
+            arrays.append(init_pos)
+        for array in arrays:
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            sha1.update(str(array.shape).encode())
+            sha1.update(array.tobytes())
+        for name in sorted(fit_pars):
+            val = fit_pars[name]
+            if callable(val):
+                val = '{}.{}'.format(
+                        getattr(val, '__module__', None),
+                        getattr(val, '__qualname__', type(val).__qualname__),
+                )
+            elif isinstance(val, np.ndarray):
+                val = val.tolist()
+            sha1.update('{}={!r};'.format(name, val).encode())
+        return sha1.hexdigest()
+
+    def load_state(self, inputs_key=None):
+        """
+        The last saved state, or None if there is none (or it was saved by
+        a fit with other inputs, or checkpointed every other number of
+        steps)
+
+        Returns
+        -------
+        state: dict
+            'stage', 'cnt' (the burnin count), 'nsteps_done' (in this
+            stage), 'pos', 'lnprob', 'random_state', 'inputs_key' and
+            'every'
+        """
+        try:
+            with open(os.path.join(self.checkpoint_dir, self.STATE_FILE),
+                      'rb') as fp:
+                state = pickle.load(fp)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        if inputs_key is not None and state['inputs_key'] != inputs_key:
+            logging.info('Ignoring chain checkpoint in {} from a fit with '
+                         'other inputs'.format(self.checkpoint_dir))
+            return None
+        # Shards are named by (and loaded at) multiples of `every`
+        if state.get('every') != self.every:
+            logging.info('Ignoring chain checkpoint in {} saved every {} '
+                         'steps, not {}'.format(self.checkpoint_dir,
+                                                state.get('every'),
+                                                self.every))
+            return None
+        return state
+
+    def save_state(self, **state):
+        """Atomically replace the saved state with `state`"""
+        state['every'] = self.every
+        state_file = os.path.join(self.checkpoint_dir, self.STATE_FILE)
+        with open(state_file + '.tmp', 'wb') as fp:
+            pickle.dump(state, fp)
+        os.rename(state_file + '.tmp', state_file)
+
+    def _shard_file(self, stage, kind, start):
+        return os.path.join(self.checkpoint_dir,
+                            '{}_{}_{:09}.npy'.format(stage, kind, start))
+
+    def run(self, sampler, stage, pos, nsteps, cnt=0, inputs_key=None):
+        """
+        Run `sampler` through `stage` (of `nsteps`) from `pos`, a segment
+        at a time, resuming the stage if it was checkpointed part way.
+
+        Returns
+        -------
+        pos, lnprob, random_state
+            The final state of the walkers
+        """
+        state = self.load_state(inputs_key)
+        if state is not None and state['stage'] == stage:
+            nsteps_done = state['nsteps_done']
+            pos, lnprob = state['pos'], state['lnprob']
+            random_state = state['random_state']
+            logging.info('Resuming {} from step {}'.format(stage,
+                                                            nsteps_done))
+        else:
+            nsteps_done, lnprob = 0, None
+            random_state = sampler.random_state
+            self.save_state(stage=stage, cnt=cnt, nsteps_done=0, pos=pos,
+                            lnprob=None, random_state=random_state,
+                            inputs_key=inputs_key)
+
+        while nsteps_done < nsteps:
+            nsegment = min(self.every, nsteps - nsteps_done)
+            sampler.reset()
+            pos, lnprob, random_state = run_mcmc_segment(
+                    sampler, pos, nsegment, lnprob=lnprob,
+                    random_state=random_state,
+            )
+            np.save(self._shard_file(stage, 'chain', nsteps_done),
+                    sampler.chain)
+            np.save(self._shard_file(stage, 'lnprob', nsteps_done),
+                    sampler.lnprobability)
+            nsteps_done += nsegment
+            self.save_state(stage=stage, cnt=cnt, nsteps_done=nsteps_done,
+                            pos=pos, lnprob=lnprob, random_state=random_state,
+                            inputs_key=inputs_key)
+        return pos, lnprob, random_state
+
+    def load(self, stage, nsteps):
+        """
+        The chain and lnprob of a completed `stage` of `nsteps`
+
+        Returns
+        -------
+        chain: [nwalkers, nsteps, npars] float array
+        lnprob: [nwalkers, nsteps] float array
+        """
+        starts = range(0, nsteps, self.every)
+        chain = np.concatenate([np.load(self._shard_file(stage, 'chain', i))
+                                for i in starts], axis=1)
+        lnprob = np.concatenate([np.load(self._shard_file(stage, 'lnprob', i))
+                                 for i in starts], axis=1)
+        return chain, lnprob
+
+    def write(self, stage, nsteps, chain_file, lnprob_file):
+        """
+        Write the chain and lnprob of a completed `stage` of `nsteps` to
+        .npy files a shard at a time, such that they are never entirely
+        in memory.
+
+        Returns
+        -------
+        chain, lnprob: memory mapped arrays
+            As in `load`
+        """
+        starts = range(0, nsteps, self.every)
+        for kind, filename in [('chain', chain_file),
+                               ('lnprob', lnprob_file)]:
+            first = np.load(self._shard_file(stage, kind, 0), mmap_mode='r')
+            shape = (first.shape[0], nsteps) + first.shape[2:]
+            out = np.lib.format.open_memmap(filename, mode='w+',
+                                            dtype=first.dtype, shape=shape)
+            for start in starts:
+                shard = np.load(self._shard_file(stage, kind, start),
+                                mmap_mode='r')
+                out[:, start:start+shard.shape[1]] = shard
+            out.flush()
+            del out
+        return (np.load(chain_file, mmap_mode='r'),
+                np.load(lnprob_file, mmap_mode='r'))
+
+    def remove(self):
+        """Delete the checkpoint, once its fit is complete"""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+
 def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
              burnin_steps=1000, Component=SphereComponent, plot_it=False,
              pool=None, convergence_tol=0.25, plot_dir='', save_dir='',
              sampling_steps=None, max_iter=None, trace_orbit_func=None,
              store_burnin_chains=False, nthreads=1,
-             optimisation_method='emcee', nprocess_ncomp=False):
+             optimisation_method='emcee', nprocess_ncomp=False,
+             vectorise_lnprob=False, checkpoint_dir=None,
+             checkpoint_every=100, adaptive_burnin=False,
+             monitor_every=100, tau_factor=20., rhat_tol=1.1,
+             sampling_tau_factor=10.):
     """Fits a single 6D gaussian to a weighted set (by membership
     probabilities) of stellar phase-space positions.
     Stores the final sampling chain and lnprob in `save_dir`, but also
@@ -309,7 +677,9 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
     plot_it: bool {False}
         Whether to generate plots of the lnprob in 'plot_dir'
     pool: MPIPool object {None}
-        pool of threads to execute walker steps concurrently
+        pool of threads to execute walker steps concurrently. If a
+        datapool.DataPool holding `data`, its workers use their resident
+        copy of the data rather than being sent it with every walker.
     convergence_tol: float {0.25}
         How many standard deviations an lnprob chain is allowed to vary
         from its mean over the course of a burnin stage and still be
@@ -345,6 +715,38 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
         many times with different initial positions. The result is the
         one with the best likelihood. These optimisations are computed
         in parallel if nprocess_ncomp equals True.
+    vectorise_lnprob: bool {False}
+        Only relevant for emcee. If True, all walkers are evaluated in a
+        single call to likelihood.lnprob_func_vectorised (using emcee's
+        `vectorize` option) instead of one lnprob_func call per walker.
+        `pool` and `nthreads` are then ignored.
+    checkpoint_dir: str {None}
+        Only relevant for emcee. If set, the chain is written to a
+        ChainCheckpoint in this directory every `checkpoint_every` steps,
+        and a fit killed part way resumes from its last checkpoint, if
+        rerun with the same data, memberships and settings. The sampler then holds no more than
+        `checkpoint_every` steps in memory, and the returned chain and
+        lnprob are memory mapped from `save_dir`. The checkpoint is
+        removed once the fit completes.
+    checkpoint_every: int {100}
+        Steps between checkpoints
+    adaptive_burnin: bool {False}
+        Only relevant for emcee. Rather than burning in whole blocks of
+        `burnin_steps` until `burnin_convergence` is met, check the
+        burnin every `monitor_every` steps with `autocorr_convergence`,
+        and stop as soon as it is converged. As without, poor and stuck
+        walkers are shifted every `burnin_steps` steps while not
+        converged, after which the burnin is checked from there on.
+        Unless `sampling_steps` is set, a converged burnin is followed
+        by a sampling stage of `sampling_tau_factor` autocorrelation
+        times. An unconverged one is its own sample, as without.
+        `max_iter` caps the burnin at `max_iter`*`burnin_steps` steps.
+    monitor_every: int {100}
+        See `adaptive_burnin`
+    tau_factor, rhat_tol: float {20., 1.1}
+        See `autocorr_convergence`
+    sampling_tau_factor: float {10.}
+        See `adaptive_burnin`
 
     Returns
     -------
@@ -374,6 +776,7 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
     if optimisation_method=='emcee':
 
         # Initialise the emcee sampler
+        user_init_pos = init_pos
         if init_pos is None:
             init_pos = get_init_emcee_pos(data=data, memb_probs=memb_probs,
                                           init_pars=init_pars, Component=Component,
@@ -385,33 +788,166 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
         # on mash. Maybe MZ will have better luck :P
         # os.system("taskset -p 0xff %d >> /dev/null" % os.getpid())
 
+        lnprob_args = [data, memb_probs, trace_orbit_func, optimisation_method, Component]
+
+        # A vectorised lnprob evaluates every walker in one call, so there
+        # is nothing for a pool to parallelise
+        if vectorise_lnprob:
+            sampler_kwargs = {'vectorize':True}
+            lnprob_func = likelihood.lnprob_func_vectorised
+        # Workers of a DataPool already hold the data, so only update
+        # memberships, and send nothing but walker parameters
+        elif isinstance(pool, datapool.DataPool) and pool.holds(data):
+            pool.set_memb_probs(memb_probs)
+            sampler_kwargs = {'pool':pool}
+            lnprob_func = datapool.pooled_lnprob_func
+            lnprob_args = [trace_orbit_func, optimisation_method, Component]
+        else:
+            sampler_kwargs = {'pool':pool, 'threads':nthreads}
+            lnprob_func = likelihood.lnprob_func
+
         sampler = emcee.EnsembleSampler(
-                nwalkers, npars, likelihood.lnprob_func,
-                args=[data, memb_probs, trace_orbit_func, optimisation_method, Component],
-                pool=pool,
-                threads=nthreads,
+                nwalkers, npars, lnprob_func,
+                args=lnprob_args,
+                **sampler_kwargs
         )
 
+        # Optionally checkpoint the chain, resuming from an earlier
+        # checkpoint of this fit
+        checkpoint = None
+        inputs_key = None
+        resume_state = None
+        if checkpoint_dir is not None:
+            checkpoint = ChainCheckpoint(checkpoint_dir, every=checkpoint_every)
+            inputs_key = ChainCheckpoint.get_inputs_key(
+                    data, memb_probs, init_pos=user_init_pos,
+                    init_pars=init_pars, nwalkers=nwalkers, npars=npars,
+                    burnin_steps=burnin_steps, sampling_steps=sampling_steps,
+                    max_iter=max_iter, convergence_tol=convergence_tol,
+                    adaptive_burnin=adaptive_burnin,
+                    monitor_every=monitor_every, tau_factor=tau_factor,
+                    rhat_tol=rhat_tol, sampling_tau_factor=sampling_tau_factor,
+                    trace_orbit_func=trace_orbit_func, Component=Component,
+            )
+            resume_state = checkpoint.load_state(inputs_key)
+
+        def run_stage(stage, pos, nsteps, cnt=0):
+            """Returns final pos and lnprob, and the stage's chain and lnprob"""
+            if checkpoint is None:
+                sampler.reset()
+                pos, lnprob, _ = sampler.run_mcmc(pos, nsteps)
+                return pos, lnprob, sampler.chain, sampler.lnprobability
+            pos, lnprob, _ = checkpoint.run(sampler, stage, pos, nsteps,
+                                            cnt=cnt, inputs_key=inputs_key)
+            if stage == 'sampling':
+                chain, lnprobability = checkpoint.write(
+                        stage, nsteps, save_dir+"final_chain.npy",
+                        save_dir+"final_lnprob.npy",
+                )
+            else:
+                chain, lnprobability = checkpoint.load(stage, nsteps)
+            return pos, lnprob, chain, lnprobability
+
         # PERFORM BURN IN
-        state = None
         converged = False
         cnt = 0
         logging.info("Beginning burnin loop")
         burnin_lnprob_res = np.zeros((nwalkers,0))
 
-        # burn in until converged or the (optional) max_iter is reached
-        while (not converged) and cnt != max_iter:
+        # An adaptive burnin is run (and checkpointed) in blocks of
+        # `monitor_every` steps. Those since walkers were last shifted
+        # (every `burnin_steps`) are checked for convergence
+        block_steps = monitor_every if adaptive_burnin else burnin_steps
+        blocks_per_shift = max(1, burnin_steps // monitor_every)
+        window_chain = np.zeros((nwalkers, 0, npars))
+        window_lnprob = np.zeros((nwalkers, 0))
+        burnin_chain_res = np.zeros((nwalkers, 0, npars))
+        tau = np.inf
+
+        if resume_state is not None:
+            # Earlier burnins (`cnt` of them) are complete, and walkers
+            # already moved on from them, as saved at the start of the
+            # current stage
+            cnt = resume_state['cnt']
+            converged = resume_state['stage'] == 'sampling'
+            # Walkers were last shifted after a whole number of burnins,
+            # unless burnin stopped there
+            window_start = (cnt // blocks_per_shift) * blocks_per_shift
+            if converged and cnt > 0:
+                window_start = ((cnt - 1) // blocks_per_shift) \
+                               * blocks_per_shift
+            for prev_cnt in range(cnt):
+                prev_chain, prev_lnprob = checkpoint.load(
+                        'burnin{:02}'.format(prev_cnt), block_steps
+                )
+                burnin_lnprob_res = np.hstack((burnin_lnprob_res,
+                                               prev_lnprob))
+                if adaptive_burnin:
+                    burnin_chain_res = np.concatenate(
+                            (burnin_chain_res, prev_chain), axis=1
+                    )
+                if adaptive_burnin and prev_cnt >= window_start:
+                    window_chain = np.concatenate((window_chain, prev_chain),
+                                                  axis=1)
+                    window_lnprob = np.hstack((window_lnprob, prev_lnprob))
+            if adaptive_burnin and converged:
+                tau = np.max(calc_autocorr_time(window_chain))
+            logging.info("Resuming from checkpoint in {} at {}".format(
+                    checkpoint_dir, resume_state['stage']))
+
+        # burn in until converged, or the (optional) cap on steps is reached
+        max_blocks = max_iter
+        if adaptive_burnin and max_iter is not None:
+            max_blocks = int(np.ceil(max_iter * burnin_steps / monitor_every))
+        while adaptive_burnin and (not converged) and cnt != max_blocks:
+            init_pos, lnprob, block_chain, block_lnprob = run_stage(
+                    'burnin{:02}'.format(cnt), init_pos, monitor_every,
+                    cnt=cnt,
+            )
+            burnin_chain_res = np.concatenate((burnin_chain_res, block_chain),
+                                              axis=1)
+            burnin_lnprob_res = np.hstack((burnin_lnprob_res, block_lnprob))
+            window_chain = np.concatenate((window_chain, block_chain), axis=1)
+            window_lnprob = np.hstack((window_lnprob, block_lnprob))
+            cnt += 1
+            converged, tau = autocorr_convergence(
+                    window_chain, window_lnprob,
+                    tau_factor=tau_factor, rhat_tol=rhat_tol,
+            )
+
+            # As with fixed burnins, if about to burn in for another
+            # `burnin_steps`, help out the struggling walkers
+            if not converged and cnt % blocks_per_shift == 0 \
+                    and cnt != max_blocks:
+                _, stuck_walker_checks = no_stuck_walkers(window_lnprob)
+                shift_poor_walkers(init_pos, lnprob, stuck_walker_checks)
+                window_chain = np.zeros((nwalkers, 0, npars))
+                window_lnprob = np.zeros((nwalkers, 0))
+
+        if adaptive_burnin:
+            np.save(plot_dir+'lnprob_last.npy', burnin_lnprob_res)
+            if store_burnin_chains:
+                np.save(plot_dir+'burnin_lnprob.npy', burnin_lnprob_res)
+                np.save(plot_dir+'burnin_chain.npy', burnin_chain_res)
+            burnin_chain, burnin_lnprob = window_chain, window_lnprob
+            # Sample for long enough to get `sampling_tau_factor`
+            # independent samples per walker
+            if converged and not sampling_steps:
+                sampling_steps = int(np.ceil(sampling_tau_factor * tau))
+
+        while (not adaptive_burnin) and (not converged) and cnt != max_iter:
             logging.info("Burning in cnt: {}".format(cnt))
-            sampler.reset()
-            init_pos, lnprob, state = sampler.run_mcmc(init_pos, burnin_steps)
-            np.save(plot_dir+'lnprob_last.npy', sampler.lnprobability)
-            stable = burnin_convergence(sampler.lnprobability, tol=convergence_tol)
-            no_stuck, stuck_walker_checks = no_stuck_walkers(sampler.lnprobability)
+            init_pos, lnprob, burnin_chain, burnin_lnprob = run_stage(
+                    'burnin{:02}'.format(cnt), init_pos, burnin_steps, cnt=cnt,
+            )
+            np.save(plot_dir+'lnprob_last.npy', burnin_lnprob)
+            stable = burnin_convergence(burnin_lnprob, tol=convergence_tol)
+            no_stuck, stuck_walker_checks = no_stuck_walkers(burnin_lnprob)
 
             # For debugging cases where walkers have stabilised but apparently some are stuck
             if (stable and not no_stuck) or store_burnin_chains:
-                np.save(plot_dir+'burnin_lnprob{:02}.npy'.format(cnt), sampler.lnprobability)
-                np.save(plot_dir+'burnin_chain{:02}.npy'.format(cnt), sampler.chain)
+                np.save(plot_dir+'burnin_lnprob{:02}.npy'.format(cnt), burnin_lnprob)
+                np.save(plot_dir+'burnin_chain{:02}.npy'.format(cnt), burnin_chain)
                 logging.info('Lnprob and chain saved')
             print("Not stuck and stable")
             print(no_stuck)
@@ -421,35 +957,16 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
 
             if plot_it and plt_avail:
                 plt.clf()
-                plt.plot(sampler.lnprobability.T)
+                plt.plot(burnin_lnprob.T)
                 plt.savefig(plot_dir+"burnin_lnprobT{:02}.png".format(cnt))
 
             # If about to burnin again, help out the struggling walkers by shifting
             # them to the best walker's position
             if not converged:
-                lnprob_not_stuck = lnprob[stuck_walker_checks]
-                best_ix = np.argmax(lnprob_not_stuck)
-
-                # Walkers with poor lnprob
-                poor_ixs = np.where(lnprob_not_stuck < np.percentile(lnprob_not_stuck, 33))
-                poor_ixs = list(poor_ixs)
-
-                # Add stuck walkers
-                ixs = np.where(~np.array(stuck_walker_checks))
-                ixs = list(ixs)
-                poor_ixs.extend(ixs)
-
-                # Add walkers with NaNs
-                #poor_ixs.extend(np.argwhere(np.isnan(     AAAAAA      )).flatten())
-
-                poor_ixs = list(itertools.chain(*poor_ixs))
-                print(poor_ixs)
-
-                for ix in set(poor_ixs):
-                    init_pos[ix] = init_pos[best_ix]
+                shift_poor_walkers(init_pos, lnprob, stuck_walker_checks)
 
             burnin_lnprob_res = np.hstack((
-                burnin_lnprob_res, sampler.lnprobability
+                burnin_lnprob_res, burnin_lnprob
             ))
             cnt += 1
 
@@ -463,35 +980,40 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
         if not sampling_steps:
             logging.info("Taking final burnin segment as sampling stage"\
                          .format(converged))
+            chain, lnprobability = burnin_chain, burnin_lnprob
         else:
             logging.info("Entering sampling stage for {} steps".format(
                 sampling_steps
             ))
-            sampler.reset()
-            # Don't need to keep track of any outputs
-            #~ sampler.run_mcmc(init_pos, sampling_steps, state)
-            sampler.run_mcmc(init_pos, sampling_steps)
+            _, _, chain, lnprobability = run_stage('sampling', init_pos,
+                                                   sampling_steps, cnt=cnt)
             logging.info("Sampling done")
 
-        # save the chain for later inspection
-        np.save(save_dir+"final_chain.npy", sampler.chain)
-        np.save(save_dir+"final_lnprob.npy", sampler.lnprobability)
+        # save the chain for later inspection (already written there
+        # by a checkpointed sampling stage)
+        if checkpoint is None or not sampling_steps:
+            np.save(save_dir+"final_chain.npy", chain)
+            np.save(save_dir+"final_lnprob.npy", lnprobability)
+        if checkpoint is not None:
+            checkpoint.remove()
 
         if plot_it and plt_avail:
             logging.info("Plotting final lnprob")
             plt.clf()
-            plt.plot(sampler.lnprobability.T)
+            plt.plot(lnprobability.T)
             plt.savefig(plot_dir+"lnprobT.png")
             logging.info("Plotting done")
 
         # Identify the best component
-        best_component = get_best_component(sampler.chain, sampler.lnprobability, Component=Component)
+        best_component = get_best_component(chain, lnprobability, Component=Component)
 
         # Determining the median and span of each parameter
-        med_and_span = calc_med_and_span(sampler.chain, Component=Component)
+        med_and_span = calc_med_and_span(chain, Component=Component)
         logging.info("Results:\n{}".format(med_and_span))
+        logging.info("Projection cache (this process): {}".format(
+                component.PROJECTION_CACHE.get_stats()))
 
-        return best_component, sampler.chain, sampler.lnprobability
+        return best_component, chain, lnprobability
 
 
     #########################################
@@ -556,5 +1078,7 @@ def fit_comp(data, memb_probs=None, init_pos=None, init_pars=None,
 
         # Identify and create the best component (with best lnprob)
         best_component = Component(emcee_pars=best_result.x)
+        logging.info("Projection cache (this process): {}".format(
+                component.PROJECTION_CACHE.get_stats()))
 
         return best_component, best_result.x, -best_result.fun
\ No newline at end of file
@@ -51,12 +51,19 @@ from astropy import units as u
 import string
 
 from . import transform
+from . import traceorbit
 from . import quaternion_rotation as quat
 from .traceorbit import trace_cartesian_orbit
 from .transform import transform_covmatrix
 #~ from chronostar.compfitter import approx_currentday_distribution
 #~ from . import compfitter
 
+# Current day means and Jacobians of projections, keyed on
+# (trace_orbit_func, mean, age). Shared by every Component in this process.
+# See transform.JacobianCache for how to inspect hit rates or resize.
+PROJECTION_CACHE = transform.JacobianCache(maxsize=4096)
+
+
 # Including plotting capabilities
 
 class AbstractComponent(object):
@@ -159,7 +166,7 @@ class AbstractComponent(object):
     }
 
     def __init__(self, pars=None, emcee_pars=None, attributes=None,
-                 trace_orbit_func=None):
+                 trace_orbit_func=None, trace_jacobian_func=None):
         """
         An abstraction for the parametrisation of a moving group
         component origin. As a 6D Gaussian, a Component has three key
@@ -218,6 +225,19 @@ class AbstractComponent(object):
             basically: tracing a point forward by age, then back by age
             should get to the same place
 
+            May instead be a combined "trace with Jacobian" function
+            flagged with a `returns_jacobian` attribute (e.g.
+            traceorbit.trace_cartesian_orbit_tangent), which is then used
+            as `trace_jacobian_func`.
+        trace_jacobian_func: function {None}
+            Function that traces an orbit as `trace_orbit_func` does, but
+            returns a tuple of the final position and the Jacobian of the
+            projection:
+            def func(xyzuvw_start, times) -> (xyzuvw_now, jac)
+
+            If provided, the current day mean and covariance matrix are
+            calculated with it, rather than with finite differences.
+
         Returns
         -------
         res: Component object
@@ -229,10 +249,14 @@ class AbstractComponent(object):
 
 
         # Set cartesian orbit tracing function
+        if getattr(trace_orbit_func, 'returns_jacobian', False):
+            trace_jacobian_func = trace_orbit_func
+            trace_orbit_func = traceorbit.MeanOnlyTrace(trace_jacobian_func)
         if trace_orbit_func is None:
             self.trace_orbit_func = trace_cartesian_orbit
         else:
             self.trace_orbit_func = trace_orbit_func
+        self.trace_jacobian_func = trace_jacobian_func
 
         # If parameters are provided in internal form (the form used by emcee),
         # then externalise before setting of various other attributes.
@@ -493,13 +517,151 @@ class AbstractComponent(object):
         self._sphere_dx = None
         self._sphere_dv = None
 
+    def _get_registered_func(self, registry, attr_name):
+        """
+        Look up a helper of `trace_orbit_func`, attached to it as attribute
+        `attr_name` (see traceorbit.trace_orbit_builder), or otherwise in
+        one of traceorbit's registries
+        """
+        func = getattr(self.trace_orbit_func, attr_name, None)
+        if func is not None:
+            return func
+        try:
+            return registry.get(self.trace_orbit_func)
+        except TypeError:   # unhashable trace_orbit_func
+            return None
+
+    def _get_jacobian_func(self):
+        """The function giving the projection with its exact Jacobian, if any"""
+        if self.trace_jacobian_func is not None:
+            return self.trace_jacobian_func
+        return self._get_registered_func(traceorbit.JACOBIAN_FUNCS,
+                                         'jacobian_func')
+
+    def _get_projection_key(self):
+        """This component's key in PROJECTION_CACHE"""
+        if self.trace_jacobian_func is not None:
+            return PROJECTION_CACHE.make_key(self.trace_jacobian_func,
+                                             self._mean, self._age)
+        return PROJECTION_CACHE.make_key(self.trace_orbit_func,
+                                         self._mean, self._age)
+
+    def _project_to_now(self, mean_only=False):
+        """
+        Calculate the current day mean, and (unless `mean_only`) the current
+        day covariance matrix.
+
+        The current day mean and the Jacobian of the projection depend only
+        on the initial mean, the age and `trace_orbit_func`, and so are
+        looked up in (and added to) PROJECTION_CACHE. If not cached,
+        they are calculated in a single call with `trace_jacobian_func`, or
+        where `trace_orbit_func` has an analytic Jacobian (see
+        traceorbit.JACOBIAN_FUNCS) or a batched version (see
+        traceorbit.BATCHED_TRACE_FUNCS), otherwise with finite differences.
+
+        Parameters
+        ----------
+        mean_only: bool {False}
+            If the projection is not cached and the Jacobian would have
+            to be found with finite differences, only trace the mean
+        """
+        key = self._get_projection_key()
+        cached = PROJECTION_CACHE.get(key)
+        if cached is not None:
+            mean_now, jac = cached
+        else:
+            jac_func = self._get_jacobian_func()
+            batch_func = self._get_registered_func(
+                    traceorbit.BATCHED_TRACE_FUNCS, 'batch_func')
+            if jac_func is not None:
+                mean_now, jac = jac_func(self._mean, self._age)
+            elif batch_func is not None:
+                mean_now, jac = transform.calc_jacobian_batch(
+                        batch_func, self._mean, args=(self._age,),
+                )
+            elif mean_only:
+                self._mean_now =\
+                    self.trace_orbit_func(self._mean, times=self._age)
+                return
+            else:
+                mean_now = self.trace_orbit_func(self._mean, times=self._age)
+                jac = transform.calc_jacobian(self.trace_orbit_func,
+                                              self._mean, args=(self._age,))
+            PROJECTION_CACHE.put(key, mean_now, jac)
+
+        self._mean_now = np.array(mean_now)
+        self._covmatrix_now = np.dot(jac, np.dot(self._covmatrix, jac.T))
+
+    @staticmethod
+    def project_many_to_now(comps):
+        """
+        Calculate the current day mean and covariance matrix of many
+        components at once, e.g. every emcee walker of a fit.
+
+        Components whose projection isn't in PROJECTION_CACHE and whose
+        `trace_orbit_func` has a batched version (see
+        traceorbit.BATCHED_TRACE_FUNCS) are projected together, all their
+        means and Jacobians from a single multi-orbit integration (see
+        transform.calc_jacobians_batch). The rest are projected one by
+        one, as by `get_covmatrix_now`. Covariance matrices are then
+        transformed in a single batched product.
+
+        Parameters
+        ----------
+        comps: [ncomps] list of Component objects
+        """
+        projected_ixs = []
+        means_now = []
+        jacs = []
+        # Uncached components to trace together, by batched trace function
+        batches = {}
+        for i, comp in enumerate(comps):
+            if comp._covmatrix_now is not None:
+                continue
+            key = comp._get_projection_key()
+            cached = PROJECTION_CACHE.get(key)
+            if cached is not None:
+                projected_ixs.append(i)
+                means_now.append(cached[0])
+                jacs.append(cached[1])
+                continue
+            batch_func = None
+            if comp._get_jacobian_func() is None:
+                batch_func = comp._get_registered_func(
+                        traceorbit.BATCHED_TRACE_FUNCS, 'batch_func')
+            if batch_func is None:
+                comp._project_to_now()
+            else:
+                batches.setdefault(batch_func, []).append((i, key))
+
+        for batch_func, batch in batches.items():
+            batch_comps = [comps[i] for i, _ in batch]
+            batch_means_now, batch_jacs = transform.calc_jacobians_batch(
+                    batch_func, [comp._mean for comp in batch_comps],
+                    args=([comp._age for comp in batch_comps],),
+            )
+            for (i, key), mean_now, jac in zip(batch, batch_means_now,
+                                               batch_jacs):
+                PROJECTION_CACHE.put(key, mean_now, jac)
+                projected_ixs.append(i)
+                means_now.append(mean_now)
+                jacs.append(jac)
+
+        if not projected_ixs:
+            return
+        jacs = np.array(jacs)
+        covs = np.array([comps[i]._covmatrix for i in projected_ixs])
+        covs_now = np.einsum('nij,njk,nlk->nil', jacs, covs, jacs)
+        for i, mean_now, cov_now in zip(projected_ixs, means_now, covs_now):
+            comps[i]._mean_now = np.array(mean_now)
+            comps[i]._covmatrix_now = cov_now
+
     def get_mean_now(self):
         """
         Calculates the mean of the component when projected to the current-day
         """
         if self._mean_now is None:
-            self._mean_now =\
-                self.trace_orbit_func(self._mean, times=self._age)
+            self._project_to_now(mean_only=True)
         return self._mean_now
 
     def get_covmatrix_now(self):
@@ -509,13 +671,12 @@ class AbstractComponent(object):
         Calculated as a first-order Taylor approximation of the coordinate
         transformation that takes the initial mean to the current day mean.
         This is the most expensive aspect of Chronostar, so we first make
-        sure the covariance matrix hasn't already been projected.
+        sure the covariance matrix hasn't already been projected, and reuse
+        the Jacobian of any component with the same mean and age (see
+        PROJECTION_CACHE).
         """
         if self._covmatrix_now is None:
-            self._covmatrix_now = transform.transform_covmatrix(
-                    self._covmatrix, trans_func=self.trace_orbit_func,
-                    loc=self._mean, args=(self._age,),
-            )
+            self._project_to_now()
         return self._covmatrix_now
 
 
@@ -129,7 +129,6 @@ def calc_eq2gc_matrix(a_deg=192.8595, d_deg=27.1283, th_deg=122.9319):
     -------
     res : [3x3] array
     """
-    assert isinstance(a_deg, (int, float, np.float32, np.float64))
     a_rad = a_deg*np.pi/180
     d_rad = d_deg*np.pi/180
     th_rad = th_deg*np.pi/180
@@ -180,11 +179,13 @@ def convert_angles2cartesian(theta_deg, phi_deg, radius=1.0):
     theta   : angle (as astropy degrees) about the north pole (longitude, RA)
     phi : angle (as astropy degrees) from the plane (lattitude, dec))
 
+    All inputs may be floats or (broadcastable) arrays, in which case the
+    result is a [3, npoints] array.
+
     Tested
     """
-    assert isinstance(theta_deg, (int, float, np.float32, np.float64))
-    theta_rad = theta_deg*np.pi/180.
-    phi_rad = phi_deg*np.pi/180
+    theta_rad = np.asarray(theta_deg)*np.pi/180.
+    phi_rad = np.asarray(phi_deg)*np.pi/180
     x = radius * np.cos(phi_rad)*np.cos(theta_rad)
     y = radius * np.cos(phi_rad)*np.sin(theta_rad)
     z = radius * np.sin(phi_rad)
@@ -194,13 +195,14 @@ def convert_angles2cartesian(theta_deg, phi_deg, radius=1.0):
 def convert_cartesian2angles(x, y, z, return_dist=False):
     """Tested
 
-    TODO: This takes up 10% of a run
-    Uses astropy angles which slows everything down
+    All inputs may be floats or (broadcastable) arrays, in which case the
+    result is a [2 (or 3), npoints] array.
     """
+    x, y, z = np.broadcast_arrays(x, y, z)
+    dist = np.sqrt(x**2 + y**2 + z**2)
+    #HACK allowing sun (who has dist=0) to be inserted
+    z = np.where(dist == 0.0, z + 1e-10, z)
     dist = np.sqrt(x**2 + y**2 + z**2)
-    if dist == 0.0:
-        z += 1e-10 #HACK allowing sun (who has dist=0) to be inserted
-        dist = np.sqrt(x**2 + y**2 + z**2)
     phi_deg = np.arcsin(z/dist)*180./np.pi
     theta_deg = np.mod((np.arctan2(y/dist,x/dist))*180./np.pi, 360.)
     if return_dist:
@@ -215,22 +217,17 @@ def convert_equatorial2galactic(theta_deg, phi_deg):
 
     Parameters
     ----------
-    theta: (float) right ascension in degrees
-    phi:   (float) declination in degrees
-    value: (bool) {True} Set flag if output desired as raw float (as opposed
-                         to an astropy unit object)
+    theta: (float or [npoints] array) right ascension in degrees
+    phi:   (float or [npoints] array) declination in degrees
 
     Output
     ------
     pos_gc: (float, float) Galactic coordinates l and b, in degrees
+        ([2, npoints] array if given arrays)
     """
-    # logging.debug("Converting eq ({}, {}) to gc: ".format(theta_deg, phi_deg))
-    assert isinstance(theta_deg, (int, float, np.float32, np.float64))
     cart_eq = convert_angles2cartesian(theta_deg, phi_deg)
-    # logging.debug("Cartesian eq coords: {}".format(cart_eq))
     eq_to_gc = calc_eq2gc_matrix()
-    cart_gc = np.dot(eq_to_gc, cart_eq)
-    # logging.debug("Cartesian gc coords: {}".format(cart_gc))
+    cart_gc = np.tensordot(eq_to_gc, cart_eq, axes=1)
     pos_gc_deg = convert_cartesian2angles(*cart_gc)
     return pos_gc_deg
 
@@ -241,26 +238,19 @@ def convert_galactic2equatorial(theta_deg, phi_deg, value=True):
 
     Parameters
     ----------
-    theta: (float) galactic l in degrees
-    phi:   (float) galactic b in degrees
+    theta: (float or [npoints] array) galactic l in degrees
+    phi:   (float or [npoints] array) galactic b in degrees
     value: (bool) {True} Set flag if output desired as raw float (as opposed
                          to an astropy unit object)
 
     Output
     ------
     pos_gc: (float, float) Equatorial coordinates RA and DEC, in degrees
+        ([2, npoints] array if given arrays)
     """
-    # logging.debug("Converting gc ({}, {}) to eq:".format(theta_deg, phi_deg))
-    try:
-        assert isinstance(theta_deg, (int, float, np.float32, np.float64))
-    except AssertionError:
-        print(type(theta_deg))
-        AssertionError
     cart_gc = convert_angles2cartesian(theta_deg, phi_deg)
-    # logging.debug("Cartesian eq coords: {}".format(cart_gc))
     gc_to_eq = calc_gc2eq_matrix()
-    cart_eq = np.dot(gc_to_eq, cart_gc)
-    # logging.debug("Cartesian gc coords: {}".format(cart_eq))
+    cart_eq = np.tensordot(gc_to_eq, cart_gc, axes=1)
     pos_eq_deg = convert_cartesian2angles(*cart_eq)
     return pos_eq_deg
 
@@ -270,27 +260,37 @@ def calc_pm_coord_matrix(a_deg, d_deg):
     Generate a coordinate matrix for calculating proper motions
 
     This is matrix `A` in Johnson & Soderblom (1987)
+
+    If `a_deg` and `d_deg` are arrays, returns a [npoints, 3, 3] stack
+    of matrices.
     """
-    a_rad = a_deg*np.pi/180.
-    d_rad = d_deg*np.pi/180.
+    a_rad, d_rad = np.broadcast_arrays(np.asarray(a_deg)*np.pi/180.,
+                                       np.asarray(d_deg)*np.pi/180.)
+    zeros = np.zeros(a_rad.shape)
+    ones = np.ones(a_rad.shape)
 
     first_t = np.array([
-        [ np.cos(d_rad),  0, -np.sin(d_rad)],
-        [         0, -1,          0],
-        [-np.sin(d_rad),  0, -np.cos(d_rad)]
+        [ np.cos(d_rad),  zeros, -np.sin(d_rad)],
+        [         zeros, -ones,           zeros],
+        [-np.sin(d_rad),  zeros, -np.cos(d_rad)]
     ])
     second_t = np.array([
-        [np.cos(a_rad),  np.sin(a_rad), 0],
-        [np.sin(a_rad), -np.cos(a_rad), 0],
-        [        0,         0, -1],
+        [np.cos(a_rad),  np.sin(a_rad), zeros],
+        [np.sin(a_rad), -np.cos(a_rad), zeros],
+        [        zeros,          zeros, -ones],
     ])
-    return np.dot(second_t, first_t)
+    # Built as [3, 3, npoints], move the matrix axes last
+    first_t = np.moveaxis(first_t, (0, 1), (-2, -1))
+    second_t = np.moveaxis(second_t, (0, 1), (-2, -1))
+    return np.matmul(second_t, first_t)
 
 
 def convert_pm2heliospacevelocity(a_deg, d_deg, pi, mu_a, mu_d, rv):
     """
     Convert proper motions to space velocities
 
+    All inputs may be floats or [npoints] arrays.
+
     Paramters
     ---------
     a_deg : (deg) right ascension in equatorial coordinates
@@ -302,27 +302,27 @@ def convert_pm2heliospacevelocity(a_deg, d_deg, pi, mu_a, mu_d, rv):
 
     Returns
     -------
-    UVW : [3] array
+    UVW : [3] array ([3, npoints] array if given arrays)
     """
-    assert isinstance(a_deg, (int, float, np.float32, np.float64))
-
-    B = np.dot(
+    B = np.matmul(
         calc_eq2gc_matrix(),
         calc_pm_coord_matrix(a_deg, d_deg),
     )
     K = 4.74057 #(km/s) / (1AU/yr)
-    astr_vels = np.array([
+    astr_vels = np.array(np.broadcast_arrays(
         rv,
-        K * mu_a / pi,
-        K * mu_d / pi,
-    ])
-    space_vels = np.dot(B, astr_vels)
+        K * np.asarray(mu_a) / pi,
+        K * np.asarray(mu_d) / pi,
+    ))
+    space_vels = np.einsum('...ij,j...->i...', B, astr_vels)
     return space_vels
 
 
 def convert_heliospacevelocity2pm(a_deg, d_deg, pi, u, v, w):
     """Take the position and space velocities, return proper motions and rv
 
+    All inputs may be floats or [npoints] arrays.
+
     Paramters
     ---------
     a_deg : (deg) right ascension
@@ -337,19 +337,17 @@ def convert_heliospacevelocity2pm(a_deg, d_deg, pi, u, v, w):
     mu_a : (as/yr) proper motion in right ascension
     mu_d : (as/yr) proper motion in declination
     rv : (km/s) line of sight velocity
+        ([3, npoints] array if given arrays)
     """
-    assert isinstance(a_deg, (int, float, np.float32, np.float64))
-    # logging.debug("Parallax is {} as which is a distance of {} pc".format(
-    #     pi, 1./pi
-    # ))
+    space_vels = np.array(np.broadcast_arrays(u, v, w))
 
-    space_vels = np.array([u,v,w])
-
-    B_inv = np.linalg.inv(np.dot(
+    B = np.matmul(
         calc_eq2gc_matrix(),
         calc_pm_coord_matrix(a_deg, d_deg)
-    ))
-    sky_vels = np.dot(B_inv, space_vels) # now in km/s
+    )
+    # B is a product of rotations (and reflections), so its inverse is
+    # its transpose
+    sky_vels = np.einsum('...ji,j...->i...', B, space_vels) # now in km/s
     K = 4.74057 #(km/s) / (AU/yr)
     rv = sky_vels[0]
     mu_a = pi * sky_vels[1] / K
@@ -363,12 +361,13 @@ def convert_helioxyzuvw2astrometry(xyzuvw_helio):
 
     Parameters
     ----------
-    xyzuvw_helio : (pc, pc, pc, km/s, km/s, km/s) array
+    xyzuvw_helio : (pc, pc, pc, km/s, km/s, km/s) [6] or [npoints, 6] array
         The position and velocity of a star in a right handed cartesian system
         centred on the sun
 
     Returns
     -------
+    [6] (or [npoints, 6]) array of
     a_deg : (deg) right ascention
     d_deg : (deg) declination
     pi : (as) parallax
@@ -376,19 +375,21 @@ def convert_helioxyzuvw2astrometry(xyzuvw_helio):
     mu_d : (as/yr) proper motion in declination
     rv : (km/s) line of sight velocity
     """
-    x, y, z, u, v, w = xyzuvw_helio
+    x, y, z, u, v, w = np.asarray(xyzuvw_helio).T
     l_deg, b_deg, dist = convert_cartesian2angles(x, y, z, return_dist=True)
-    # logging.debug("l,b,Distance is {}, {}, {} pc".format(l_deg, b_deg, dist))
     a_deg, d_deg = convert_galactic2equatorial(l_deg, b_deg)
     pi = 1./dist
     mu_a, mu_d, rv = convert_heliospacevelocity2pm(a_deg, d_deg, pi, u, v, w)
-    return np.array([a_deg, d_deg, pi, mu_a, mu_d, rv])
+    return np.array([a_deg, d_deg, pi, mu_a, mu_d, rv]).T
 
 
 def convert_astrometry2helioxyzuvw(a_deg, d_deg, pi, mu_a, mu_d, rv):
     """
     Converts astrometry to heliocentric XYZUVW values
 
+    All inputs may be floats or [npoints] arrays, in which case the
+    result is a [npoints, 6] array.
+
     Parameters
     ----------
     a_deg : (deg) right ascention
@@ -398,14 +399,11 @@ def convert_astrometry2helioxyzuvw(a_deg, d_deg, pi, mu_a, mu_d, rv):
     mu_d : (as/yr) proper motion in declination
     rv : (km/s) line of sight velocity
     """
-    # logging.debug("Input:\nra {}\ndec {}\nparallax {}\nmu_ra {}\nmu_de {}\n"
-    #               "rv {}".format(a_deg, d_deg, pi, mu_a, mu_d, rv))
-    dist = 1/pi #pc
+    dist = 1/np.asarray(pi) #pc
     l_deg, b_deg = convert_equatorial2galactic(a_deg, d_deg)
     x, y, z = convert_angles2cartesian(l_deg, b_deg, radius=dist)
     u, v, w = convert_pm2heliospacevelocity(a_deg, d_deg, pi, mu_a, mu_d, rv)
-    xyzuvw_helio = np.array([x,y,z,u,v,w])
-    # logging.debug("XYZUVW heliocentric is : {}".format(xyzuvw_helio))
+    xyzuvw_helio = np.array([x,y,z,u,v,w]).T
     return xyzuvw_helio
 
 
@@ -477,58 +475,166 @@ def convert_astrometry2lsrxyzuvw(astro, mas=True):
 
     Parameters
     ----------
-    a : (deg) right ascention
-    d : (deg) declination
-    pi : (mas) parallax
-    mu_a : (mas/yr) proper motion in right ascension
-    mu_d : (mas/yr) proper motion in declination
-    rv : (km/s) line of sight velocity
+    astro : [6] (or [nstars, 6]) float array
+        a : (deg) right ascention
+        d : (deg) declination
+        pi : (mas) parallax
+        mu_a : (mas/yr) proper motion in right ascension
+        mu_d : (mas/yr) proper motion in declination
+        rv : (km/s) line of sight velocity
 
     mas : Boolean {True}
         set if input parallax and proper motions are in mas
 
     Returns
     -------
-    XYZUVW : (pc, pc, pc, km/s, km/s, km/s)
+    XYZUVW : (pc, pc, pc, km/s, km/s, km/s) [6] (or [nstars, 6]) array
     """
-    astro = np.copy(astro)
+    astro = np.array(astro, dtype=np.float64)
     # convert to as for internal use
     if mas:
-        astro[2:5] *= 1e-3
+        astro[..., 2:5] *= 1e-3
     # logging.debug("Input (after conversion) is: {}".format(astro))
-    xyzuvw_helio = convert_astrometry2helioxyzuvw(*astro)
+    xyzuvw_helio = convert_astrometry2helioxyzuvw(*astro.T)
     # logging.debug("Heliocentric XYZUVW is : {}".format(xyzuvw_helio))
     xyzuvw_lsr = convert_helio2lsr(xyzuvw_helio)
 
     # logging.debug("LSR XYZUVW (pc) is : {}".format(xyzuvw_lsr))
     return xyzuvw_lsr
 
+def calc_astrometry2lsrxyzuvw_jacobian(astro, mas=True):
+    """
+    The analytic Jacobian of `convert_astrometry2lsrxyzuvw`, for one or
+    many stars at once.
+
+    Positions are dist * G.n(a,d), and velocities G.A(a,d).s where G is
+    the equatorial to galactic matrix, n the unit vector towards the star,
+    A the proper motion coordinate matrix and s = (rv, K*mu_a/pi,
+    K*mu_d/pi), so each derivative follows directly.
+
+    Parameters
+    ----------
+    astro : [6] (or [nstars, 6]) float array
+        ra [deg], dec [deg], parallax, pmra, pmdec, rv [km/s], as for
+        `convert_astrometry2lsrxyzuvw`
+    mas : Boolean {True}
+        set if input parallax and proper motions are in mas (the Jacobian
+        is then with respect to these units)
+
+    Returns
+    -------
+    jac : [6,6] (or [nstars,6,6]) float array
+        jac[..., i, j] is the derivative of XYZUVW[i] with respect to
+        astro[j]
+    """
+    astro = np.array(astro, dtype=np.float64)
+    a_deg, d_deg, pi, mu_a, mu_d, rv = np.moveaxis(astro, -1, 0)
+    if mas:
+        pi = pi * 1e-3
+        mu_a = mu_a * 1e-3
+        mu_d = mu_d * 1e-3
+    a_rad = a_deg*np.pi/180.
+    d_rad = d_deg*np.pi/180.
+    deg = np.pi/180.    # derivatives are with respect to degrees
+    zeros = np.zeros(a_rad.shape)
+
+    eq_to_gc = calc_eq2gc_matrix()
+    K = 4.74057 #(km/s) / (1AU/yr)
+    dist = 1./pi
+
+    jac = np.zeros(a_rad.shape + (6,6))
+
+    # Positions, with dist in pc when parallax is in as
+    unit_vec = np.array([np.cos(d_rad)*np.cos(a_rad),
+                         np.cos(d_rad)*np.sin(a_rad),
+                         np.sin(d_rad)])
+    dunit_da = np.array([-np.cos(d_rad)*np.sin(a_rad),
+                         np.cos(d_rad)*np.cos(a_rad),
+                         zeros])
+    dunit_dd = np.array([-np.sin(d_rad)*np.cos(a_rad),
+                         -np.sin(d_rad)*np.sin(a_rad),
+                         np.cos(d_rad)])
+    jac[..., :3, 0] = np.moveaxis(
+            np.tensordot(eq_to_gc, dist * dunit_da * deg, axes=1), 0, -1)
+    jac[..., :3, 1] = np.moveaxis(
+            np.tensordot(eq_to_gc, dist * dunit_dd * deg, axes=1), 0, -1)
+    jac[..., :3, 2] = np.moveaxis(
+            np.tensordot(eq_to_gc, -dist / pi * unit_vec, axes=1), 0, -1)
+
+    # Velocities
+    sky_vels = np.array([rv, K * mu_a / pi, K * mu_d / pi])
+    # The derivatives of the two factors of calc_pm_coord_matrix
+    first_t = np.array([
+        [ np.cos(d_rad),  zeros, -np.sin(d_rad)],
+        [         zeros, zeros-1,         zeros],
+        [-np.sin(d_rad),  zeros, -np.cos(d_rad)]
+    ])
+    dfirst_dd = np.array([
+        [-np.sin(d_rad),  zeros, -np.cos(d_rad)],
+        [         zeros,  zeros,          zeros],
+        [-np.cos(d_rad),  zeros,  np.sin(d_rad)]
+    ])
+    second_t = np.array([
+        [np.cos(a_rad),  np.sin(a_rad), zeros],
+        [np.sin(a_rad), -np.cos(a_rad), zeros],
+        [        zeros,          zeros, zeros-1],
+    ])
+    dsecond_da = np.array([
+        [-np.sin(a_rad),  np.cos(a_rad), zeros],
+        [ np.cos(a_rad),  np.sin(a_rad), zeros],
+        [         zeros,          zeros, zeros],
+    ])
+    # Move matrix axes last, giving [..., 3, 3] stacks
+    first_t, dfirst_dd, second_t, dsecond_da = [
+        np.moveaxis(m, (0, 1), (-2, -1))
+        for m in (first_t, dfirst_dd, second_t, dsecond_da)
+    ]
+    B = np.matmul(eq_to_gc, np.matmul(second_t, first_t))
+    dB_da = np.matmul(eq_to_gc, np.matmul(dsecond_da, first_t)) * deg
+    dB_dd = np.matmul(eq_to_gc, np.matmul(second_t, dfirst_dd)) * deg
+    sky_vels = np.moveaxis(sky_vels, 0, -1)[..., None]
+
+    jac[..., 3:, 0] = np.matmul(dB_da, sky_vels)[..., 0]
+    jac[..., 3:, 1] = np.matmul(dB_dd, sky_vels)[..., 0]
+    jac[..., 3:, 2] = -B[..., 1] * (K * mu_a / pi**2)[..., None]\
+                      - B[..., 2] * (K * mu_d / pi**2)[..., None]
+    jac[..., 3:, 3] = B[..., 1] * (K / pi)[..., None]
+    jac[..., 3:, 4] = B[..., 2] * (K / pi)[..., None]
+    jac[..., 3:, 5] = B[..., 0]
+
+    if mas:
+        jac[..., 2:5] *= 1e-3
+    return jac
+
+
 def convert_many_astrometry2lsrxyzuvw(astr_arr, mas=True):
     """
-    Take a point straight from a catalogue, return it as XYZUVW
+    Take many points straight from a catalogue, return them as XYZUVW
 
     This function takes astrometry in conventional units, and converts them
-    into internal units for convenience.
+    into internal units for convenience. All stars are converted at once,
+    with array operations.
 
     Parameters
     ----------
-    a : (deg) right ascention
-    d : (deg) declination
-    pi : (mas) parallax
-    mu_a : (mas/yr) proper motion in right ascension
-    mu_d : (mas/yr) proper motion in declination
-    rv : (km/s) line of sight velocity
+    astr_arr : [nstars, 6] float array
+        a : (deg) right ascention
+        d : (deg) declination
+        pi : (mas) parallax
+        mu_a : (mas/yr) proper motion in right ascension
+        mu_d : (mas/yr) proper motion in declination
+        rv : (km/s) line of sight velocity
 
     mas : Boolean {True}
         set if input parallax and proper motions are in mas
+
+    Returns
+    -------
+    XYZUVW : [nstars, 6] array (pc, pc, pc, km/s, km/s, km/s)
     """
     logging.info("converting to LSRXYZUVW")
-    xyzuvws = np.zeros(astr_arr.shape)
-    for i, astr in enumerate(astr_arr):
-        if (i % 1000 == 0):
-            logging.info("{} of {} done".format(i, xyzuvws.shape[0]))
-        xyzuvws[i] = convert_astrometry2lsrxyzuvw(astr, mas=mas)
-    return xyzuvws
+    astr_arr = np.array(astr_arr, dtype=np.float64).reshape(-1, 6)
+    return convert_astrometry2lsrxyzuvw(astr_arr, mas=mas)
 
 
 def convert_lsrxyzuvw2astrometry(xyzuvw_lsr):
@@ -537,12 +643,13 @@ def convert_lsrxyzuvw2astrometry(xyzuvw_lsr):
 
     Parameters
     ----------
-    xyzuvw_lsr : (pc, pc, pc, km/s, km/s, km/s) array
+    xyzuvw_lsr : (pc, pc, pc, km/s, km/s, km/s) [6] (or [nstars, 6]) array
         The position and velocity of a star in a right handed cartesian system
         corotating with and centred on the local standard of rest
 
     Returns
     -------
+    [6] (or [nstars, 6]) array of
     a : (deg) right ascention
     d : (deg) declination
     pi : (mas) parallax
@@ -550,13 +657,13 @@ def convert_lsrxyzuvw2astrometry(xyzuvw_lsr):
     mu_d : (mas/yr) proper motion in declination
     rv : (km/s) line of sight velocity
     """
-    xyzuvw_lsr = np.copy(xyzuvw_lsr)
+    xyzuvw_lsr = np.array(xyzuvw_lsr, dtype=np.float64)
 
     xyzuvw_helio = convert_lsr2helio(xyzuvw_lsr)
     astr = np.array(convert_helioxyzuvw2astrometry(xyzuvw_helio))
 
     # Finally converts angles to mas for external use
-    astr[2:5] *= 1e3
+    astr[..., 2:5] *= 1e3
     return astr
 
 
@@ -566,12 +673,13 @@ def convert_many_lsrxyzuvw2astrometry(xyzuvw_lsrs):
 
     Parameters
     ----------
-    xyzuvw_lsr : (pc, pc, pc, km/s, km/s, km/s) array
+    xyzuvw_lsrs : (pc, pc, pc, km/s, km/s, km/s) [nstars, 6] array
         The position and velocity of a star in a right handed cartesian system
         corotating with and centred on the local standard of rest
 
     Returns
     -------
+    [nstars, 6] array of
     a : (deg) right ascention
     d : (deg) declination
     pi : (mas) parallax
@@ -579,7 +687,5 @@ def convert_many_lsrxyzuvw2astrometry(xyzuvw_lsrs):
     mu_d : (mas/yr) proper motion in declination
     rv : (km/s) line of sight velocity
     """
-    astros = np.zeros(xyzuvw_lsrs.shape)
-    for i, xyzuvw_lsr in enumerate(xyzuvw_lsrs):
-        astros[i] = convert_lsrxyzuvw2astrometry(xyzuvw_lsr)
-    return astros
+    xyzuvw_lsrs = np.array(xyzuvw_lsrs, dtype=np.float64).reshape(-1, 6)
+    return convert_lsrxyzuvw2astrometry(xyzuvw_lsrs)
@@ -0,0 +1,332 @@
+"""
+datapool.py
+
+Tools to share the star data between processes without copying it.
+
+SharedDataDict places the arrays of a data dict in shared memory (or
+file-backed memmaps), such that any number of processes can read them
+while only one copy exists on the node.
+
+A DataPool is a process pool whose workers hold the star data for the
+duration of a fit.
+
+Passing a plain multiprocessing.Pool to emcee means the `args` of the
+lnprob function, including the full data dict ([nstars,6,6] covariance
+matrices) and the membership array, are pickled and shipped to a worker
+with every walker evaluation. A DataPool instead hands the data dict to
+each worker once, through the pool initializer, and keeps the membership
+probabilities in a shared array that can be cheaply updated between
+fits. Per call payloads are then just the walker parameters.
+
+Usage
+-----
+>>> pool = DataPool(data, nprocesses=4)
+>>> compfitter.fit_comp(data, memb_probs, pool=pool)    # or expectmax etc.
+>>> pool.close()
+
+`compfitter.fit_comp` recognises a DataPool (holding the same data dict it
+is fitting to) and evaluates walkers with `pooled_lnprob_func`. Giving a
+DataPool a SharedDataDict means spawned workers attach to the existing
+arrays rather than receiving a copy.
+"""
+from __future__ import print_function, division
+
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # python < 3.8, only memmaps are available
+    shared_memory = None
+
+from . import likelihood
+
+
+def _attach_shared_memory(name):
+    """
+    Attach to an existing shared memory block, without this process
+    taking responsibility for unlinking it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:   # python < 3.13
+        shm = shared_memory.SharedMemory(name=name)
+        # Processes started by multiprocessing share their parent's
+        # resource tracker. Any other process (e.g. an MPI rank) has its
+        # own, which would unlink the block when that process exits.
+        if multiprocessing.parent_process() is None:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _release_shared_arrays(blocks, unlink):
+    """
+    Detach from (and if `unlink` free) the blocks backing a SharedDataDict.
+    Either SharedMemory objects, or a directory of memmapped .npy files.
+    """
+    for block in blocks:
+        if isinstance(block, str):
+            if unlink:
+                shutil.rmtree(block, ignore_errors=True)
+            continue
+        try:
+            block.close()
+        except BufferError:
+            # Arrays viewing the block are still referenced somewhere, the
+            # mapping will be dropped when they are
+            pass
+        if unlink:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedDataDict(dict):
+    """
+    A data dict whose arrays live in memory shared between processes.
+
+    Behaves as the (read only) dict built by
+    tabletool.build_data_dict_from_table, so can be passed anywhere a data
+    dict is expected. When pickled, e.g. to a spawned process or an MPI
+    rank, only the names of the arrays are sent and the receiving process
+    attaches to the same memory.
+
+    The process that creates a SharedDataDict owns the memory, which is
+    freed when `release` is called, when the dict is garbage collected
+    or when the interpreter exits, whichever is first.
+
+    Parameters
+    ----------
+    data: dict
+        'means': [nstars,6] float array_like
+        'covs': [nstars,6,6] float array_like
+        'bg_lnols': [nstars] float array_like (opt.)
+        Any other array entries are shared too, non-array entries are
+        copied as is.
+    backend: str {'shm'}
+        'shm' to use multiprocessing.shared_memory (python >= 3.8), or
+        'memmap' to use .npy files memory mapped from `memmap_dir`. The
+        latter also works across nodes with a shared filesystem.
+    memmap_dir: str {None}
+        Directory in which to create the memmap files, defaults to a new
+        temporary directory
+    """
+    BACKENDS = ('shm', 'memmap')
+
+    def __init__(self, data, backend='shm', memmap_dir=None):
+        super(SharedDataDict, self).__init__()
+        if backend not in self.BACKENDS:
+            raise UserWarning('Unknown SharedDataDict backend {}, must be '
+                              'one of {}'.format(backend, self.BACKENDS))
+        if backend == 'shm' and shared_memory is None:
+            raise UserWarning("multiprocessing.shared_memory requires "
+                              "python >= 3.8, use backend='memmap'")
+        self.backend = backend
+        self._specs = {}
+        self._blocks = []
+        self._is_owner = True
+
+        if backend == 'memmap':
+            memmap_dir = tempfile.mkdtemp(prefix='chronostar_data_',
+                                          dir=memmap_dir)
+            self._blocks.append(memmap_dir)
+
+        for key, value in data.items():
+            if not isinstance(value, np.ndarray):
+                dict.__setitem__(self, key, value)
+                continue
+            value = np.ascontiguousarray(value)
+            if backend == 'shm':
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(value.nbytes, 1))
+                self._blocks.append(shm)
+                location = shm.name
+                shared = np.ndarray(value.shape, dtype=value.dtype,
+                                    buffer=shm.buf)
+                shared[...] = value
+            else:
+                location = os.path.join(memmap_dir, '{}.npy'.format(key))
+                np.save(location, value)
+                shared = np.load(location, mmap_mode='r')
+            self._specs[key] = (location, value.shape, value.dtype.str)
+            shared.flags.writeable = False
+            dict.__setitem__(self, key, shared)
+
+        self._finalizer = weakref.finalize(self, _release_shared_arrays,
+                                           self._blocks, True)
+
+    @classmethod
+    def _attach(cls, backend, specs, extras):
+        """Rebuild a SharedDataDict in a new process, see __reduce__"""
+        self = cls.__new__(cls)
+        dict.__init__(self, extras)
+        self.backend = backend
+        self._specs = specs
+        self._blocks = []
+        self._is_owner = False
+        for key, (location, shape, dtype) in specs.items():
+            if backend == 'shm':
+                shm = _attach_shared_memory(location)
+                self._blocks.append(shm)
+                shared = np.ndarray(shape, dtype=np.dtype(dtype),
+                                    buffer=shm.buf)
+            else:
+                shared = np.load(location, mmap_mode='r')
+            shared.flags.writeable = False
+            dict.__setitem__(self, key, shared)
+        self._finalizer = weakref.finalize(self, _release_shared_arrays,
+                                           self._blocks, False)
+        return self
+
+    def __reduce__(self):
+        extras = dict((k, v) for k, v in self.items() if k not in self._specs)
+        return (SharedDataDict._attach, (self.backend, self._specs, extras))
+
+    def __setitem__(self, key, value):
+        raise TypeError('SharedDataDict is read only')
+
+    def __delitem__(self, key):
+        raise TypeError('SharedDataDict is read only')
+
+    def get_names(self):
+        """
+        The shared memory block names (or memmap file paths) of each array,
+        by which other processes can find them
+        """
+        return dict((k, spec[0]) for k, spec in self._specs.items())
+
+    def release(self):
+        """
+        Detach this process from the shared arrays. If this process created
+        them, the memory is freed, and every process's arrays are invalid.
+        """
+        self._finalizer.detach()
+        _release_shared_arrays(self._blocks, unlink=self._is_owner)
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+# The data dict and membership probabilities as seen by a worker process.
+# Populated once per worker by `_init_worker`
+_worker_data = {}
+
+
+def _init_worker(data, shared_memb_probs):
+    """
+    Pool initializer, stores the data dict and a view on the shared
+    membership probabilities in the worker's module globals.
+    """
+    _worker_data['data'] = data
+    _worker_data['memb_probs'] = np.frombuffer(shared_memb_probs,
+                                               dtype=np.float64)
+
+
+def pooled_lnprob_func(pars, trace_orbit_func=None,
+                       optimisation_method='emcee',
+                       Component=likelihood.SphereComponent, **kwargs):
+    """
+    Computes the log-probability for a fit to a group, using the data
+    and membership probabilities held by this worker.
+
+    Signature matches likelihood.lnprob_func, with `data` and
+    `memb_probs` removed. Only meaningful inside a DataPool worker.
+    """
+    return likelihood.lnprob_func(pars, _worker_data['data'],
+                                  _worker_data['memb_probs'],
+                                  trace_orbit_func=trace_orbit_func,
+                                  optimisation_method=optimisation_method,
+                                  Component=Component, **kwargs)
+
+
+class DataPool(object):
+    """
+    A pool of worker processes which each hold the star data dict.
+
+    Exposes `map`, so can be given to emcee in place of a
+    multiprocessing.Pool or MPIPool.
+
+    Parameters
+    ----------
+    data: dict
+        'means': [nstars,6] float array_like
+            the central estimates of star phase-space properties
+        'covs': [nstars,6,6] float array_like
+            the phase-space covariance matrices of stars
+        'bg_lnols': [nstars] float array_like (opt.)
+            the log overlaps of stars with the background
+    nprocesses: int {None}
+        Number of worker processes, if None uses multiprocessing's
+        default (cpu count)
+    memb_probs: [nstars] float array_like {None}
+        Initial membership probabilities, defaults to all ones
+    """
+    def __init__(self, data, nprocesses=None, memb_probs=None):
+        self.data = data
+        self.nstars = len(data['means'])
+
+        # Lives in shared memory, and is handed to workers on creation,
+        # so updates made by this process are seen by every worker
+        self._shared_memb_probs = multiprocessing.RawArray('d', self.nstars)
+        self.memb_probs = np.frombuffer(self._shared_memb_probs,
+                                        dtype=np.float64)
+        if memb_probs is None:
+            memb_probs = np.ones(self.nstars)
+        self.set_memb_probs(memb_probs)
+
+        self._pool = multiprocessing.Pool(
+                processes=nprocesses, initializer=_init_worker,
+                initargs=(self.data, self._shared_memb_probs),
+        )
+
+    def holds(self, data):
+        """Check whether the workers hold `data`"""
+        return data is self.data
+
+    def set_memb_probs(self, memb_probs):
+        """
+        Update the membership probabilities seen by every worker.
+
+        Must not be called while a `map` is in progress.
+
+        Parameters
+        ----------
+        memb_probs: [nstars] float array_like
+            Membership probability (from 0.0 to 1.0) for each star to
+            the component being fitted
+        """
+        memb_probs = np.asarray(memb_probs, dtype=np.float64)
+        if memb_probs.shape != (self.nstars,):
+            raise UserWarning('memb_probs has shape {}, but pool holds {} '
+                              'stars'.format(memb_probs.shape, self.nstars))
+        self.memb_probs[:] = memb_probs
+
+    def map(self, func, iterable):
+        return self._pool.map(func, iterable)
+
+    def close(self):
+        """Shut down the worker processes"""
+        logging.info('Closing DataPool')
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.terminate()
@@ -4,15 +4,18 @@ input into Chronostar
 """
 from __future__ import print_function, division, unicode_literals
 
+from astropy.io import fits
 from astropy.table import Table
 from datetime import datetime
 import logging
 import numpy as np
 import os.path
+import shutil
 
 from . import tabletool
 from . import readparam
 from . import expectmax
+from . import bgoverlap
 
 DEFAULT_PARS = {
     'input_file':'',
@@ -40,14 +43,29 @@ DEFAULT_PARS = {
     'bg_ref_table':'',
     'bg_main_colnames':None,
     'bg_col_name':'background_log_overlap',
+    'bg_ols_rtol':1e-6,
+    'bg_ols_nprocesses':1,
+    'bg_ols_store_dir':None,
+    'bg_ols_id_colname':'source_id',
     'par_log_file':'data_pars.log',
 
     'overwrite_datafile':False,
     'output_file':None,
 
     'return_data_table':True,
+
+    'chunk_size':None,
+    'checkpoint_dir':None,
+    'keep_checkpoints':False,
 }
 
+# Parameters which don't affect the content of prepared chunks, and so
+# may change between runs that share checkpoints
+CHECKPOINT_INDEPENDENT_PARS = (
+    'overwrite_datafile', 'return_data_table', 'par_log_file',
+    'keep_checkpoints', 'bg_ols_nprocesses', 'bg_ols_store_dir',
+)
+
 def get_region(ref_table, assoc_name=None,
                pos_margin=30., vel_margin=5.,
                scale_margin=None, mg_colname=None):
@@ -154,6 +172,240 @@ def get_region(ref_table, assoc_name=None,
     return box_lower_bound, box_upper_bound
 
 
+def prepare_table(data_table, data_pars, bounds=None, bg_star_means=None):
+    """
+    Apply the conversion, cuts and background overlap calculation set
+    in `data_pars` to a table (or a chunk of one).
+
+    Parameters
+    ----------
+    data_table: astropy.Table object
+        The data
+    data_pars: dict
+        Parameters of `prepare_data`, already combined with defaults
+    bounds: ([6] float array, [6] float array) {None}
+        The lower and upper bounds of the cartesian cut, required if
+        `apply_cart_cuts` is set
+    bg_star_means: [nbgstars,6] float array -or- BackgroundOverlapEngine {None}
+        The cartesian means of the background reference stars (or an
+        engine built from them), required if `calc_overlaps` is set
+
+    Returns
+    -------
+    data_table: astropy.Table object
+    """
+    if data_pars['convert_astrometry']:
+        # --------------------------------------------------
+        # --  CONVERT ASTROMETRY INTO CARTESIAN  -----------
+        # --------------------------------------------------
+        data_table = tabletool.convert_table_astro2cart(
+                table=data_table,
+                astr_main_colnames=data_pars['astr_main_colnames'],
+                astr_error_colnames=data_pars['astr_error_colnames'],
+                astr_corr_colnames=data_pars['astr_corr_colnames'],
+                cart_main_colnames=data_pars['cart_main_colnames'],
+                cart_error_colnames=data_pars['cart_error_colnames'],
+                cart_corr_colnames=data_pars['cart_corr_colnames'],
+                return_table=True,
+        )
+
+
+    if data_pars['apply_cart_cuts']:
+        # --------------------------------------------------
+        # --  APPLY DATA CUTS IN CARTESIAN SPACE  ----------
+        # --------------------------------------------------
+        if bounds is None:
+            raise UserWarning('If setting `apply_cart_cuts` to True, then'
+                              ' either `cut_on_region` or `cut_on_bounds`'
+                              ' must also be set.')
+        bounds_min, bounds_max = bounds
+
+        input_means = tabletool.build_data_dict_from_table(
+                table=data_table,
+                main_colnames=data_pars['cart_main_colnames'],
+                only_means=True,
+        )
+        cart_cut_mask = np.where(
+                np.all(input_means > bounds_min, axis=1)
+                & np.all(input_means < bounds_max, axis=1)
+        )
+        data_table = data_table[cart_cut_mask]
+
+
+    if data_pars['calc_overlaps']:
+        # --------------------------------------------------
+        # --  CALCULATE BACKGROUND OVERLAPS  ---------------
+        # --------------------------------------------------
+        if len(data_table) == 0:
+            # e.g. a chunk with every star cut, still needs the column
+            ln_bg_ols = np.zeros(0)
+        else:
+            input_data_dict = tabletool.build_data_dict_from_table(
+                    table=data_table,
+                    main_colnames=data_pars['cart_main_colnames'],
+                    error_colnames=data_pars['cart_error_colnames'],
+                    corr_colnames=data_pars['cart_corr_colnames'],
+            )
+            star_ids = None
+            if data_pars['bg_ols_id_colname'] in data_table.colnames:
+                star_ids = data_table[data_pars['bg_ols_id_colname']]
+            ln_bg_ols = expectmax.get_background_overlaps_with_covariances(
+                    background_means=bg_star_means,
+                    star_means=input_data_dict['means'],
+                    star_covs=input_data_dict['covs'],
+                    rtol=data_pars['bg_ols_rtol'],
+                    nprocesses=data_pars['bg_ols_nprocesses'],
+                    store_dir=data_pars['bg_ols_store_dir'],
+                    star_ids=star_ids,
+            )
+
+        logging.info('Calculated {} background overlaps'.format(
+                len(ln_bg_ols)))
+        tabletool.insert_column(table=data_table,
+                                col_data=ln_bg_ols,
+                                col_name=data_pars['bg_col_name'],
+                                )
+
+    return data_table
+
+
+def _check_checkpoint_pars(checkpoint_dir, data_pars):
+    """
+    Record the parameters used to prepare the chunks in `checkpoint_dir`,
+    or if a record exists, check they match.
+    """
+    pars_log = os.path.join(checkpoint_dir, 'chunk_pars.log')
+    new_pars_log = os.path.join(checkpoint_dir, 'chunk_pars.log.new')
+    chunk_pars = dict((k, v) for k, v in data_pars.items()
+                      if k not in CHECKPOINT_INDEPENDENT_PARS)
+    chunk_pars['par_log_file'] = new_pars_log
+    readparam.log_used_pars(chunk_pars, default_pars=DEFAULT_PARS)
+
+    if not os.path.isfile(pars_log):
+        os.rename(new_pars_log, pars_log)
+        return
+    with open(pars_log) as fp:
+        old_record = fp.read()
+    with open(new_pars_log) as fp:
+        new_record = fp.read()
+    os.remove(new_pars_log)
+    if old_record != new_record:
+        raise UserWarning('Checkpoints in {} were made with different '
+                          'parameters. Remove them, or choose another '
+                          '`checkpoint_dir`.'.format(checkpoint_dir))
+
+
+def _combine_fits_tables(filenames, output_file, overwrite=False):
+    """
+    Concatenate fits tables with identical columns into `output_file`.
+
+    The rows of each table are copied as raw bytes, one file at a time,
+    so the combined table is never held in memory.
+    """
+    if os.path.isfile(output_file):
+        if not overwrite:
+            raise UserWarning('Output file {} already exists'.format(
+                    output_file))
+        os.remove(output_file)
+
+    header = fits.getheader(filenames[0], 1).copy()
+    header['NAXIS2'] = sum(fits.getheader(filename, 1)['NAXIS2']
+                           for filename in filenames)
+
+    stream = fits.StreamingHDU(output_file, header)
+    try:
+        for filename in filenames:
+            with fits.open(filename, memmap=True) as hdul:
+                chunk_header = hdul[1].header
+                if (chunk_header['NAXIS1'] != header['NAXIS1']
+                        or chunk_header['PCOUNT'] != 0):
+                    raise UserWarning('Table in {} has different columns to '
+                                      '{}'.format(filename, filenames[0]))
+                data_offset = hdul[1].fileinfo()['datLoc']
+            if chunk_header['NAXIS2'] == 0:
+                continue
+            raw_rows = np.fromfile(
+                    filename, dtype=np.uint8, offset=data_offset,
+                    count=chunk_header['NAXIS1']*chunk_header['NAXIS2'],
+            )
+            stream.write(raw_rows)
+    finally:
+        stream.close()
+
+
+def prepare_data_in_chunks(data_pars, bounds=None, bg_star_means=None):
+    """
+    Prepare the data in chunks of `data_pars['chunk_size']` rows, such
+    that catalogues larger than memory can be prepared.
+
+    Rows are read from `input_file` (which must be a fits file) a chunk at
+    a time, prepared with `prepare_table`, then saved to
+    `checkpoint_dir`. Chunks already saved there, e.g. by a run that was
+    interrupted, are not prepared again. Finally all chunks are
+    appended to `output_file`.
+
+    Parameters
+    ----------
+    data_pars: dict
+        Parameters of `prepare_data`, already combined with defaults
+    bounds, bg_star_means:
+        See `prepare_table`
+
+    Returns
+    -------
+    data_table [opt.]: astropy.Table object
+        The prepared table, memory mapped from `output_file`
+    """
+    output_file = data_pars['output_file']
+    checkpoint_dir = data_pars['checkpoint_dir']
+    if checkpoint_dir is None:
+        checkpoint_dir = os.path.splitext(output_file)[0] + '_chunks'
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    _check_checkpoint_pars(checkpoint_dir, data_pars)
+
+    chunk_size = int(data_pars['chunk_size'])
+    chunk_filenames = []
+    with fits.open(data_pars['input_file'], memmap=True) as hdul:
+        input_hdu = hdul[1]
+        nrows = input_hdu.header['NAXIS2']
+        if nrows == 0:
+            raise UserWarning('Input table {} is empty'.format(
+                    data_pars['input_file']))
+        for start in range(0, nrows, chunk_size):
+            stop = min(start + chunk_size, nrows)
+            chunk_filename = os.path.join(
+                    checkpoint_dir, 'chunk_{:012d}_{:012d}.fits'.format(
+                            start, stop))
+            chunk_filenames.append(chunk_filename)
+            if os.path.isfile(chunk_filename):
+                logging.info('Rows {} to {} already prepared'.format(
+                        start, stop))
+                continue
+
+            logging.info('Preparing rows {} to {} of {}'.format(
+                    start, stop, nrows))
+            # Only these rows are read from disk
+            chunk_table = Table.read(fits.BinTableHDU(
+                    data=input_hdu.data[start:stop], header=input_hdu.header,
+            ))
+            chunk_table = prepare_table(chunk_table, data_pars, bounds=bounds,
+                                        bg_star_means=bg_star_means)
+
+            # Write then rename, so a chunk file only exists once complete
+            chunk_table.write(chunk_filename + '.tmp', format='fits',
+                              overwrite=True)
+            os.rename(chunk_filename + '.tmp', chunk_filename)
+
+    _combine_fits_tables(chunk_filenames, output_file,
+                         overwrite=data_pars['overwrite_datafile'])
+    if not data_pars['keep_checkpoints']:
+        shutil.rmtree(checkpoint_dir)
+
+    if data_pars['return_data_table']:
+        return Table.read(output_file, memmap=True)
+
+
 def prepare_data(custom_pars):
     """
     Entry point for complete data preparation.
@@ -183,12 +435,14 @@ def prepare_data(custom_pars):
 
     Notes
     -----
-    TODO: update background overlaps to allow for multiprocessing
     TODO: test functionality of overlap calculations
     TODO: Implement initialising synethetic datasets?
     TODO: Implement various input checks
-    TODO: Allow for checkpoint saves after each stage
     TODO: Add a logging.log output
+
+    If `chunk_size` is set, the input is prepared a chunk of rows at a
+    time, with each chunk checkpointed to disk, see
+    `prepare_data_in_chunks`.
     """
     if type(custom_pars) is str:
         custom_pars = readparam.readParam(custom_pars, default_pars=DEFAULT_PARS)
@@ -216,6 +470,12 @@ def prepare_data(custom_pars):
         raise UserWarning('Output file exists, yet you have not set'
                           ' `overwrite_data = True` in the input parameters.')
 
+    # Chunks are appended to the output file, rather than held in memory
+    if (data_pars['chunk_size'] is not None and
+            not data_pars['output_file']):
+        raise UserWarning('Preparing data in chunks (`chunk_size` is set) '
+                          'requires an `output_file`.')
+
     # Prevent users from overwriting an input file if data cuts are
     # being applied. Note: if future cuts are implemented, extend this
     # condition
@@ -271,89 +531,42 @@ def prepare_data(custom_pars):
                               ' an issue with the provided table '
                               ' bg_ref_table`.')
 
-    # Establish what column names are
-    data_table = Table.read(data_pars['input_file'])
-
-    if data_pars['convert_astrometry']:
-        # --------------------------------------------------
-        # --  CONVERT ASTROMETRY INTO CARTESIAN  -----------
-        # --------------------------------------------------
-        data_table = tabletool.convert_table_astro2cart(
-                table=data_table,
-                astr_main_colnames=data_pars['astr_main_colnames'],
-                astr_error_colnames=data_pars['astr_error_colnames'],
-                astr_corr_colnames=data_pars['astr_corr_colnames'],
-                cart_main_colnames=data_pars['cart_main_colnames'],
-                cart_error_colnames=data_pars['cart_error_colnames'],
-                cart_corr_colnames=data_pars['cart_corr_colnames'],
-                return_table=True,
-        )
-
-
+    # Anything derived from reference tables is found once, and applied
+    # to every chunk (if preparing in chunks)
+    bounds = None
     if data_pars['apply_cart_cuts']:
-        # --------------------------------------------------
-        # --  APPLY DATA CUTS IN CARTESIAN SPACE  ----------
-        # --------------------------------------------------
         # First try and form region around a subset of reference
         # stars.
         if data_pars['cut_on_region']:
-            bounds_min, bounds_max = get_region(
+            bounds = get_region(
                     ref_table=data_pars['cut_ref_table'],
                     assoc_name=data_pars['cut_assoc_name'],
                     mg_colname=data_pars['cut_colname']
             )
         # Otherwise, use some mins and maxs from the pars file
         elif data_pars['cut_on_bounds']:
-            bounds_min = np.array(data_pars['cut_bound_min'])
-            bounds_max = np.array(data_pars['cut_bound_max'])
-        else:
-            UserWarning('If setting `apply_cart_cuts` to True, then'
-                        ' either `cut_on_region` or `cut_on_bounds` must'
-                        ' also be set.')
-
-        input_means = tabletool.build_data_dict_from_table(
-                table=data_table,
-                main_colnames=data_pars['cart_main_colnames'],
-                only_means=True,
-        )
-        cart_cut_mask = np.where(
-                np.all(input_means > bounds_min, axis=1)
-                & np.all(input_means < bounds_max, axis=1)
-        )
-        data_table = data_table[cart_cut_mask]
-
+            bounds = (np.array(data_pars['cut_bound_min']),
+                      np.array(data_pars['cut_bound_max']))
 
+    bg_star_means = None
     if data_pars['calc_overlaps']:
-        # --------------------------------------------------
-        # --  CALCULATE BACKGROUND OVERLAPS  ---------------
-        # --------------------------------------------------
         # Only accessing the main column names
         bg_star_means = tabletool.build_data_dict_from_table(
                 table=data_pars['bg_ref_table'],
                 main_colnames=data_pars['bg_main_colnames'],
                 only_means=True,
         )
-        input_data_dict = tabletool.build_data_dict_from_table(
-                table=data_table,
-                main_colnames=data_pars['cart_main_colnames'],
-                error_colnames=data_pars['cart_error_colnames'],
-                corr_colnames=data_pars['cart_corr_colnames'],
-        )
-        print("bg_star_means: ",len(bg_star_means))
-        print("input_data_dict: ", input_data_dict)
-        #TODO: A parallelised version of this exists, incorporate it?
-        #TODO: Check database for precomputed bgoverlaps
-        ln_bg_ols = expectmax.get_background_overlaps_with_covariances(
-                background_means=bg_star_means,
-                star_means=input_data_dict['means'],
-                star_covs=input_data_dict['covs'],
-        )
+        # Built once, such that every chunk shares the same KD leaves
+        bg_star_means = bgoverlap.BackgroundOverlapEngine(bg_star_means)
 
-        print("ln_bg_ols length: ", len(ln_bg_ols))
-        tabletool.insert_column(table=data_table,
-                                col_data=ln_bg_ols,
-                                col_name=data_pars['bg_col_name'],
-                                )
+    if data_pars['chunk_size'] is not None:
+        return prepare_data_in_chunks(data_pars, bounds=bounds,
+                                      bg_star_means=bg_star_means)
+
+    # Establish what column names are
+    data_table = Table.read(data_pars['input_file'])
+    data_table = prepare_table(data_table, data_pars, bounds=bounds,
+                               bg_star_means=bg_star_means)
 
     # Store output. Since this everything above is so computationally
     # expensive, if writing to the prescribed output fails, make sure
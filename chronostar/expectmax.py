@@ -49,14 +49,16 @@ except ImportError:
 from .component import SphereComponent
 from . import likelihood
 from . import compfitter
+from . import datapool
+from . import bgoverlap
 from . import tabletool
 try:
     print('Using C implementation in expectmax')
     from ._overlap import get_lnoverlaps
 except:
-    print("WARNING: Couldn't import C implementation, using slow pythonic overlap instead")
-    logging.info("WARNING: Couldn't import C implementation, using slow pythonic overlap instead")
-    from .likelihood import slow_get_lnoverlaps as get_lnoverlaps
+    print("WARNING: Couldn't import C implementation, using numpy overlap instead")
+    logging.info("WARNING: Couldn't import C implementation, using numpy overlap instead")
+    from .likelihood import numpy_get_lnoverlaps as get_lnoverlaps
 
 #from functools import partial
 
@@ -124,7 +126,9 @@ def get_kernel_densities(background_means, star_means, amp_scale=1.0):
 
 
 def get_background_overlaps_with_covariances(background_means, star_means,
-                                             star_covs):
+                                             star_covs, rtol=1e-6,
+                                             nprocesses=1, chunk_size=1000,
+                                             store_dir=None, star_ids=None):
     """
     author: Marusa Zerjal 2019 - 05 - 25
 
@@ -132,12 +136,14 @@ def get_background_overlaps_with_covariances(background_means, star_means,
     background and stars.
     Covariance matrices for the background are Identity*bandwidth.
 
-    Takes about 3 seconds per star if using whole Gaia DR2 stars with 6D
-    kinematics as reference.
+    Evaluated by a bgoverlap.BackgroundOverlapEngine, which only sums
+    the background stars that contribute to within `rtol`. Building the
+    engine for a large background set takes a while, so pass one in
+    place of `background_means` if calling this repeatedly.
 
     Parameters
     ----------
-    background_means: [nstars,6] float array_like
+    background_means: [nstars,6] float array_like -or- BackgroundOverlapEngine
         Phase-space positions of some star set that greatly envelops points
         in question. Typically contents of gaia_xyzuvw.npy, or the output of
         >> tabletool.build_data_dict_from_table(
@@ -147,6 +153,19 @@ def get_background_overlaps_with_covariances(background_means, star_means,
         Phase-space positions of stellar data that we are fitting components to
     star_covs: [npoints,6,6] float array_like
         Phase-space covariances of stellar data that we are fitting components to
+    rtol: float {1e-6}
+        Maximum relative error of each overlap from ignoring distant
+        background stars, 0 sums every background star
+    nprocesses: int {1}
+        Number of processes between which chunks of `chunk_size` stars
+        are shared
+    store_dir: string {None}
+        If given, overlaps previously calculated for these stars (with
+        the same background) are read from, and new ones added to, the
+        bgoverlap.BackgroundOverlapStore in this directory
+    star_ids: [npoints] array_like {None}
+        Identifiers of the stars, e.g. Gaia source_id, used along with
+        their means and covariances to find them in the store
 
     Returns
     -------
@@ -172,46 +191,14 @@ def get_background_overlaps_with_covariances(background_means, star_means,
     star_means[:, 5] *= -1
 
     # Background covs with bandwidth using Scott's rule
-    d = 6.0 # number of dimensions
-    nstars = background_means.shape[0]
-    bandwidth = nstars**(-1.0 / (d + 4.0))
-    background_cov = np.cov(background_means.T) * bandwidth ** 2
-    background_covs = np.array(nstars * [background_cov]) # same cov for every star
-
-    # shapes of the c_get_lnoverlaps input must be: (6, 6), (6,), (120, 6, 6), (120, 6)
-    # So I do it in a loop for every star
-    bg_lnols=[]
-    for i, (star_mean, star_cov) in enumerate(zip(star_means, star_covs)):
-        print('bgols', i)
-        #print('{} of {}'.format(i, len(star_means)))
-        #print(star_cov)
-        #print('det', np.linalg.det(star_cov))
-        #bg_lnol = get_lnoverlaps(star_cov, star_mean, background_covs,
-        #                         background_means, nstars)
-        try:
-            #print('***********', nstars, star_cov, star_mean, background_covs, background_means)
-            bg_lnol = get_lnoverlaps(star_cov, star_mean, background_covs,
-                                     background_means, nstars)
-            #print('intermediate', bg_lnol)
-            # bg_lnol = np.log(np.sum(np.exp(bg_lnol))) # sum in linear space
-            bg_lnol = logsumexp(bg_lnol) # sum in linear space
-
-        # Do we really want to make exceptions here? If the sum fails then
-        # there's something wrong with the data.
-        except:
-            # TC: Changed sign to negative (surely if it fails, we want it to
-            # have a neglible background overlap?
-            print('bg ln overlap failed, setting it to -inf')
-            bg_lnol = -np.inf
-        bg_lnols.append(bg_lnol)
-        #print(bg_lnol)
-        #print('')
-
-    # This should be parallelized
-    #bg_lnols = [np.sum(get_lnoverlaps(star_cov, star_mean, background_covs, background_means, nstars)) for star_mean, star_cov in zip(star_means, star_covs)]
-    #print(bg_lnols)
+    if not isinstance(background_means, bgoverlap.BackgroundOverlapEngine):
+        background_means = bgoverlap.BackgroundOverlapEngine(background_means)
 
-    return bg_lnols
+    return background_means.get_lnols(star_means, star_covs, rtol=rtol,
+                                      nprocesses=nprocesses,
+                                      chunk_size=chunk_size,
+                                      store_dir=store_dir,
+                                      star_ids=star_ids)
 
 
 def check_convergence(old_best_comps, new_chains, perc=40):
@@ -258,30 +245,47 @@ def check_convergence(old_best_comps, new_chains, perc=40):
     return np.all(each_converged)
 
 
-def calc_membership_probs(star_lnols):
-    """Calculate probabilities of membership for a single star from overlaps
+def calc_membership_probs(star_lnols, out=None, return_ln_memb_probs=False):
+    """Calculate probabilities of membership from overlaps
+
+    Each row of `star_lnols` is normalised by its log-sum-exp (shifted by
+    its maximum for numerical stability), for all stars at once.
 
     Parameters
     ----------
-    star_lnols : [ncomps] array
-        The log of the overlap of a star with each group
+    star_lnols : [ncomps] -or- [nstars, ncomps] array
+        The log of the overlap of a star (or each star) with each group
+    out : array {None}
+        If given, membership probabilities are written into this
+        preallocated array, of the same shape as `star_lnols`
+    return_ln_memb_probs : bool {False}
+        Also return the log of the membership probabilities
 
     Returns
     -------
-    star_memb_probs : [ncomps] array
-        The probability of membership to each group, normalised to sum to 1
+    star_memb_probs : [ncomps] -or- [nstars, ncomps] array
+        The probability of membership to each group, normalised to sum to 1.
+        Rows where this is undefined (e.g. every overlap is -inf) are nan
+    ln_star_memb_probs : [ncomps] -or- [nstars, ncomps] array [opt.]
+        The log of `star_memb_probs`
     """
-    ncomps = star_lnols.shape[0]
-    star_memb_probs = np.zeros(ncomps)
-
-    for i in range(ncomps):
-        star_memb_probs[i] = 1. / np.sum(np.exp(star_lnols - star_lnols[i]))
-
+    star_lnols = np.asarray(star_lnols, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        row_max = np.max(star_lnols, axis=-1, keepdims=True)
+        row_max[~np.isfinite(row_max)] = 0.
+        ln_norms = row_max + np.log(np.sum(np.exp(star_lnols - row_max),
+                                           axis=-1, keepdims=True))
+        ln_star_memb_probs = star_lnols - ln_norms
+    star_memb_probs = np.exp(ln_star_memb_probs, out=out)
+
+    if return_ln_memb_probs:
+        return star_memb_probs, ln_star_memb_probs
     return star_memb_probs
 
 
 def get_all_lnoverlaps(data, comps, old_memb_probs=None,
-                       inc_posterior=False, amp_prior=None):
+                       inc_posterior=False, amp_prior=None,
+                       overlap_cache=None):
     """
     Get the log overlap integrals of each star with each component
 
@@ -312,6 +316,9 @@ def get_all_lnoverlaps(data, comps, old_memb_probs=None,
     amp_prior: int {None}
         If set, forces the combined ampltude of Gaussian components to be
         at least equal to `amp_prior`
+    overlap_cache: likelihood.OverlapCache {None}
+        If given, unweighted overlaps of components already in the cache
+        are reused rather than calculated again
 
     Returns
     -------
@@ -352,12 +359,13 @@ def get_all_lnoverlaps(data, comps, old_memb_probs=None,
         if weights.sum() < amp_prior:
             weights *= amp_prior / weights.sum()
 
-    # For each component, get log overlap with each star, scaled by
-    # amplitude (weight) of each component's PDF
-    for i, comp in enumerate(comps):
-        lnols[:, i] = \
-            np.log(weights[i]) + \
-            likelihood.get_lnoverlaps(comp, data)
+    # Get log overlap of each star with every component (in one pass over
+    # the star data), scaled by amplitude (weight) of each component's PDF
+    if overlap_cache is not None:
+        raw_lnols = overlap_cache.get_lnoverlaps_multi(comps, data)
+    else:
+        raw_lnols = likelihood.get_lnoverlaps_multi(comps, data)
+    lnols[:, :ncomps] = np.log(weights) + raw_lnols
 
     # insert one time calculated background overlaps
     if using_bg:
@@ -405,7 +413,8 @@ def calc_bic(data, ncomps, lnlike, memb_probs=None, Component=SphereComponent):
 
 
 def expectation(data, comps, old_memb_probs=None,
-                inc_posterior=False, amp_prior=None):
+                inc_posterior=False, amp_prior=None, out=None,
+                return_ln_memb_probs=False, overlap_cache=None):
     """Calculate membership probabilities given fits to each group
 
     Parameters
@@ -423,6 +432,13 @@ def expectation(data, comps, old_memb_probs=None,
     amp_prior: float {None}
         If set, forces the combined ampltude of Gaussian components to be
         at least equal to `amp_prior`
+    out: [nstars, ncomps (+1)] float array {None}
+        If given, membership probabilities are written into this
+        preallocated array (which may be `old_memb_probs`)
+    return_ln_memb_probs: bool {False}
+        Also return the log of the membership probabilities
+    overlap_cache: likelihood.OverlapCache {None}
+        See get_all_lnoverlaps
 
     Returns
     -------
@@ -431,6 +447,8 @@ def expectation(data, comps, old_memb_probs=None,
         each component. It is populated by floats in the range (0.0, 1.0) such
         that each row sums to 1.0, each column sums to the expected size of
         each component, and the entire array sums to the number of stars.
+    ln_memb_probs: [nstars, ncomps] float array [opt.]
+        The log of `memb_probs`
     """
     # Tidy input and infer some values
     if not isinstance(data, dict):
@@ -449,21 +467,26 @@ def expectation(data, comps, old_memb_probs=None,
 
     # Calculate all log overlaps
     lnols = get_all_lnoverlaps(data, comps, old_memb_probs,
-                               inc_posterior=inc_posterior, amp_prior=amp_prior)
+                               inc_posterior=inc_posterior, amp_prior=amp_prior,
+                               overlap_cache=overlap_cache)
 
     # Calculate membership probabilities, tidying up 'nan's as required
-    memb_probs = np.zeros((nstars, ncomps + using_bg))
-    for i in range(nstars):
-        memb_probs[i] = calc_membership_probs(lnols[i])
-    if np.isnan(memb_probs).any():
+    memb_probs, ln_memb_probs = calc_membership_probs(
+            lnols, out=out, return_ln_memb_probs=True,
+    )
+    nan_mask = np.isnan(memb_probs)
+    if nan_mask.any():
         log_message('AT LEAST ONE MEMBERSHIP IS "NAN"', symbol='!')
-        memb_probs[np.where(np.isnan(memb_probs))] = 0.
+        memb_probs[nan_mask] = 0.
+        ln_memb_probs[nan_mask] = -np.inf
+    if return_ln_memb_probs:
+        return memb_probs, ln_memb_probs
     return memb_probs
 
 
 def get_overall_lnlikelihood(data, comps, return_memb_probs=False,
                              old_memb_probs=None,
-                             inc_posterior=False):
+                             inc_posterior=False, overlap_cache=None):
     """
     Get overall likelihood for a proposed model.
 
@@ -478,21 +501,27 @@ def get_overall_lnlikelihood(data, comps, return_memb_probs=False,
         See fit_many_comps
     return_memb_probs: bool {False}
         Along with log likelihood, return membership probabilites
+    overlap_cache: likelihood.OverlapCache {None}
+        See get_all_lnoverlaps. Share one between calls with the same
+        components, e.g. for the likelihood and the posterior. Otherwise
+        overlaps are still only calculated once within this call.
 
     Returns
     -------
     overall_lnlikelihood: float
     """
-    logging.info('here00')
+    if overlap_cache is None:
+        overlap_cache = likelihood.OverlapCache(maxsize=len(comps))
+
     memb_probs = expectation(data, comps,
                              old_memb_probs=old_memb_probs,
-                             inc_posterior=inc_posterior)
-    
-    logging.info('here0')
-    
+                             inc_posterior=inc_posterior,
+                             overlap_cache=overlap_cache)
+
     all_ln_ols = get_all_lnoverlaps(data, comps,
                                     old_memb_probs=memb_probs,
-                                    inc_posterior=inc_posterior)
+                                    inc_posterior=inc_posterior,
+                                    overlap_cache=overlap_cache)
 
     # multiplies each log overlap by the star's membership probability
     # (In linear space, takes the star's overlap to the power of its
@@ -516,6 +545,9 @@ def maximise_one_comp(data, memb_probs, i, idir, all_init_pars=None, all_init_po
                 nthreads=1, 
                 optimisation_method=None,
                 nprocess_ncomp=False,
+                vectorise_lnprob=False,
+                chain_checkpoint_every=None,
+                adaptive_burnin=False,
                 ):
 
     """
@@ -577,6 +609,16 @@ def maximise_one_comp(data, memb_probs, i, idir, all_init_pars=None, all_init_po
         many times with different initial positions. The result is the 
         one with the best likelihood. These optimisations are computed
         in parallel if nprocess_ncomp equals True.
+    vectorise_lnprob: bool {False}
+        Evaluate all emcee walkers in one batched lnprob call, see
+        compfitter.fit_comp
+    chain_checkpoint_every: int {None}
+        If set, checkpoint the emcee chain every this many steps in
+        `idir`/comp{i}/chain_checkpoint/, see compfitter.fit_comp
+    adaptive_burnin: bool {False}
+        Stop burning in once the chain's autocorrelation time and
+        Gelman-Rubin statistic say it has converged, see
+        compfitter.fit_comp
         
     Returns
     -------
@@ -606,6 +648,9 @@ def maximise_one_comp(data, memb_probs, i, idir, all_init_pars=None, all_init_po
     # Otherwise, run maximisation and sampling stage
     #~ else:
 
+    chain_checkpoint_dir = None
+    if chain_checkpoint_every:
+        chain_checkpoint_dir = gdir + 'chain_checkpoint/'
     best_comp, chain, lnprob = compfitter.fit_comp(
             data=data, memb_probs=memb_probs[:, i],
             burnin_steps=burnin_steps, plot_it=plot_it,
@@ -617,6 +662,10 @@ def maximise_one_comp(data, memb_probs, i, idir, all_init_pars=None, all_init_po
             nthreads=nthreads, 
             optimisation_method=optimisation_method,
             nprocess_ncomp=nprocess_ncomp,
+            vectorise_lnprob=vectorise_lnprob,
+            checkpoint_dir=chain_checkpoint_dir,
+            checkpoint_every=chain_checkpoint_every,
+            adaptive_burnin=adaptive_burnin,
     )
     logging.info("Finished fit")
     logging.info("Best comp pars:\n{}".format(
@@ -652,6 +701,9 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
                  ignore_stable_comps=False,
                  nthreads=1, optimisation_method=None,
                  nprocess_ncomp=False,
+                 vectorise_lnprob=False,
+                 chain_checkpoint_every=None,
+                 adaptive_burnin=False,
                  ):
     """
     Performs the 'maximisation' step of the EM algorithm
@@ -679,7 +731,9 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
     plot_it: bool {False}
         Whehter to plot lnprob chains (from burnin, etc) as we go
     pool: MPIPool object {None}
-        pool of threads to execute walker steps concurrently
+        pool of threads to execute walker steps concurrently. Best as a
+        datapool.DataPool holding `data`, see compfitter.fit_comp. Not
+        used if `nprocess_ncomp` is set.
     convergence_tol: float {0.25}
         How many standard devaitions an lnprob chain is allowed to vary
         from its mean over the course of a burnin stage and still be
@@ -706,6 +760,13 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
     nprocess_ncomp: bool {False}
         How many processes to use in the maximisation of ncomps with
         python's multiprocessing library in case Nelder-Mead is used.
+    vectorise_lnprob: bool {False}
+        Evaluate all emcee walkers in one batched lnprob call, see
+        compfitter.fit_comp
+    chain_checkpoint_every: int {None}
+        See maximise_one_comp
+    adaptive_burnin: bool {False}
+        See maximise_one_comp
         
     Returns
     -------
@@ -751,6 +812,11 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
         manager = multiprocessing.Manager()
         return_dict = manager.dict()
 
+        # A DataPool's workers belong to this process and can't be driven
+        # from the component processes, which each evaluate serially
+        if isinstance(pool, datapool.DataPool):
+            pool = None
+
         def worker(i, return_dict):
 
             best_comp, chain, lnprob, final_pos = maximise_one_comp(data,
@@ -766,6 +832,9 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
                 store_burnin_chains=store_burnin_chains,
                 nthreads=nthreads, 
                 optimisation_method=optimisation_method,
+                vectorise_lnprob=vectorise_lnprob,
+                chain_checkpoint_every=chain_checkpoint_every,
+                adaptive_burnin=adaptive_burnin,
                 )
 
             return_dict[i] = {'best_comp': best_comp, 'chain': chain, 'lnprob': lnprob, 'final_pos': final_pos}
@@ -835,6 +904,9 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
                     store_burnin_chains=store_burnin_chains,
                     nthreads=nthreads,
                     optimisation_method=optimisation_method,
+                    vectorise_lnprob=vectorise_lnprob,
+                    chain_checkpoint_every=chain_checkpoint_every,
+                    adaptive_burnin=adaptive_burnin,
                     )
 
                 new_comps.append(best_comp)
@@ -856,7 +928,7 @@ def maximisation(data, ncomps, memb_probs, burnin_steps, idir,
            all_final_pos, success_mask
 
 
-def check_stability(data, best_comps, memb_probs):
+def check_stability(data, best_comps, memb_probs, overlap_cache=None):
     """
     Checks if run has encountered problems
 
@@ -872,6 +944,8 @@ def check_stability(data, best_comps, memb_probs):
         recent run
     memb_probs: [nstars, ncomps] float array
         The membership array from the most recent run
+    overlap_cache: likelihood.OverlapCache {None}
+        See get_all_lnoverlaps
 
     Returns
     -------
@@ -887,7 +961,8 @@ def check_stability(data, best_comps, memb_probs):
     if np.min(np.sum(memb_probs[:, :ncomps], axis=0)) <= 2.:
         logging.info("ERROR: A component has less than 2 members")
         return False
-    if not np.isfinite(get_overall_lnlikelihood(data, best_comps)):
+    if not np.isfinite(get_overall_lnlikelihood(data, best_comps,
+                                                overlap_cache=overlap_cache)):
         logging.info("ERROR: Posterior is not finite")
         return False
     if not np.isfinite(memb_probs).all():
@@ -946,7 +1021,9 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
                    ignore_stable_comps=False, max_em_iterations=100,
                    record_len=30, bic_conv_tol=0.1, min_em_iterations=30,
                    nthreads=1, optimisation_method=None, 
-                   nprocess_ncomp = False,
+                   nprocess_ncomp = False, vectorise_lnprob=False,
+                   cache_data_dict=False, pack_covs=False,
+                   chain_checkpoint_every=None, adaptive_burnin=False,
                    **kwargs):
     """
 
@@ -1018,6 +1095,25 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
     nprocess_ncomp: bool {False}
         How many processes to use in the maximisation of ncomps with
         python's multiprocessing library in case Nelder-Mead is used.
+    vectorise_lnprob: bool {False}
+        Evaluate all emcee walkers in one batched lnprob call, see
+        compfitter.fit_comp
+    cache_data_dict: bool {False}
+        If set, and `data` is a path to a table, load the data dict from (or store
+        it in) a cache alongside the table, see
+        tabletool.build_data_dict_from_table
+    pack_covs: bool {False}
+        If `data` is a path to a table, store only the upper triangle of
+        each star's covariance matrix, see
+        tabletool.build_data_dict_from_table
+    chain_checkpoint_every: int {None}
+        If set, write each component's emcee chain to disk every this many
+        steps, such that a killed run resumes its fits part way, see
+        compfitter.fit_comp
+    adaptive_burnin: bool {False}
+        Burn in each component until its chain has converged by its
+        autocorrelation time and Gelman-Rubin statistic, then sampling
+        it for a number of autocorrelation times, see compfitter.fit_comp
         
 
     Return
@@ -1034,7 +1130,8 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
     # Tidying up input
     if not isinstance(data, dict):
         data = tabletool.build_data_dict_from_table(
-                data, get_background_overlaps=use_background
+                data, get_background_overlaps=use_background,
+                use_cache=cache_data_dict, pack_covs=pack_covs,
         )
     if rdir == '':                      # Ensure results directory has a
         rdir = '.'                      # trailing '/'
@@ -1052,6 +1149,10 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
     nstars = data['means'].shape[0]
     C_TOL = 0.5
 
+    # Overlaps of each iteration's components are needed by several steps
+    # (and the next expectation), so only calculate them once
+    overlap_cache = likelihood.OverlapCache(maxsize=2*ncomps)
+
     logging.info("Fitting {} groups with {} burnin steps with cap "
                  "of {} iterations".format(ncomps, burnin, max_em_iterations))
 
@@ -1163,7 +1264,8 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
             old_overall_lnlike, old_memb_probs = \
                     get_overall_lnlikelihood(data, old_comps,
                                              inc_posterior=False,
-                                             return_memb_probs=True,)
+                                             return_memb_probs=True,
+                                             overlap_cache=overlap_cache)
             ref_counts = np.sum(old_memb_probs, axis=0)
 
             logging.info('append')
@@ -1226,10 +1328,12 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
             skip_first_e_step = False
         else:
             memb_probs_new = expectation(data, old_comps, memb_probs_old,
-                                         inc_posterior=inc_posterior)
+                                         inc_posterior=inc_posterior,
+                                         overlap_cache=overlap_cache)
         logging.info("Membership distribution:\n{}".format(
             memb_probs_new.sum(axis=0)
         ))
+        logging.info("Overlap cache: {}".format(overlap_cache.get_stats()))
         np.save(idir+"membership.npy", memb_probs_new)
 
         # MAXIMISE
@@ -1248,7 +1352,10 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
                          ignore_stable_comps=ignore_stable_comps_iter,
                          nthreads=nthreads, 
                          optimisation_method=optimisation_method,
-                         nprocess_ncomp=nprocess_ncomp
+                         nprocess_ncomp=nprocess_ncomp,
+                         vectorise_lnprob=vectorise_lnprob,
+                         chain_checkpoint_every=chain_checkpoint_every,
+                         adaptive_burnin=adaptive_burnin,
                          )
 
         for i in range(ncomps):
@@ -1277,9 +1384,11 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
 
         # LOG RESULTS OF ITERATION
         overall_lnlike = get_overall_lnlikelihood(data, new_comps,
-                                                 inc_posterior=False)
+                                                 inc_posterior=False,
+                                                 overlap_cache=overlap_cache)
         overall_lnposterior = get_overall_lnlikelihood(data, new_comps,
-                                                      inc_posterior=True)
+                                                      inc_posterior=True,
+                                                      overlap_cache=overlap_cache)
         bic = calc_bic(data, ncomps, overall_lnlike,
                        memb_probs=memb_probs_new,
                        Component=Component)
@@ -1330,7 +1439,8 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
         # Check individual components stability
         if (iter_count % 5 == 0 and ignore_stable_comps):
             memb_probs_new = expectation(data, new_comps, memb_probs_new,
-                                         inc_posterior=inc_posterior)
+                                         inc_posterior=inc_posterior,
+                                         overlap_cache=overlap_cache)
             log_message('Orig ref_counts {}'.format(ref_counts))
 
             unstable_comps, ref_counts = check_comps_stability(memb_probs_new,
@@ -1344,7 +1454,8 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
 
         # Check stablity, but only affect run after sufficient iterations to
         # settle
-        temp_stable_state = check_stability(data, new_comps, memb_probs_new)
+        temp_stable_state = check_stability(data, new_comps, memb_probs_new,
+                                            overlap_cache=overlap_cache)
         logging.info('Stability: {}'.format(temp_stable_state))
         if iter_count > 10:
             stable_state = temp_stable_state
@@ -1413,10 +1524,12 @@ def fit_many_comps(data, ncomps, rdir='', pool=None, init_memb_probs=None,
     tabcomps.write(os.path.join(final_dir, 'final_comps_%d.fits'%len(final_best_comps)), overwrite=True)
 
     overall_lnlike = get_overall_lnlikelihood(
-            data, final_best_comps, inc_posterior=False
+            data, final_best_comps, inc_posterior=False,
+            overlap_cache=overlap_cache,
     )
     overall_lnposterior = get_overall_lnlikelihood(
-            data, final_best_comps, inc_posterior=True
+            data, final_best_comps, inc_posterior=True,
+            overlap_cache=overlap_cache,
     )
     bic = calc_bic(data, ncomps, overall_lnlike,
                    memb_probs=final_memb_probs, Component=Component)
@@ -28,20 +28,123 @@ given the model of M, we take the product of the model evaluated at each
 data point:
 P(D|M) = P(x_1|M) * P(x_2|M) * .. * P(x_N|M) = \prod_i^N P(x_i|M)
 """
+import os
+import weakref
 import numpy as np
 
 from chronostar.component import SphereComponent
 from chronostar.component import EllipComponent
+from chronostar.transform import LRUCache
+from chronostar.transform import unpack_covmatrices
 #~ from chronostar import component
 #~ SphereComponent = component.SphereComponent
 #~ from . import component
 USE_C_IMPLEMENTATION = True
 try:
     from ._overlap import get_lnoverlaps as c_get_lnoverlaps
+    from ._overlap import get_lnoverlaps_multi as c_get_lnoverlaps_multi
+    from ._overlap import get_lnoverlaps_packed as c_get_lnoverlaps_packed
+    from ._overlap import get_lnoverlaps_multi_packed as \
+        c_get_lnoverlaps_multi_packed
+    from ._overlap import set_num_threads as c_set_num_threads
+    from ._overlap import get_num_threads as c_get_num_threads
+    from ._overlap import set_lnoverlap_kernel as c_set_lnoverlap_kernel
+    from ._overlap import get_lnoverlap_kernel as c_get_lnoverlap_kernel
 except ImportError:
     print("C IMPLEMENTATION OF GET_OVERLAP NOT IMPORTED")
     USE_C_IMPLEMENTATION = False
 
+
+def set_num_threads(nthreads=None):
+    """
+    Set the number of threads the c implementation uses to calculate
+    overlaps
+
+    The star loops of the overlap calculations are parallelised with
+    OpenMP if the module was built with OpenMP support. If not (or if
+    the c implementation isn't available) this does nothing.
+
+    Note that when fits are already parallelised across processes (e.g.
+    a multiprocessing pool of emcee walkers) you probably want this to
+    be 1 to avoid oversubscribing the cores.
+
+    Parameters
+    ----------
+    nthreads: int {None}
+        Number of threads to use. If None (or less than 1) every available
+        processor is used. The environment variable OMP_NUM_THREADS sets
+        the initial value.
+
+    Returns
+    -------
+    nthreads: int
+        The number of threads that will actually be used
+    """
+    if USE_C_IMPLEMENTATION:
+        if nthreads is None:
+            nthreads = 0
+        c_set_num_threads(int(nthreads))
+    return get_num_threads()
+
+
+def get_num_threads():
+    """
+    Get the number of threads the c implementation uses to calculate
+    overlaps. Always 1 if OpenMP (or the c implementation) is unavailable.
+    """
+    if USE_C_IMPLEMENTATION:
+        return c_get_num_threads()
+    return 1
+
+
+# Kernels available to the c implementation for each star-component overlap
+C_OVERLAP_KERNELS = {
+    'gsl':0,        # GSL LU decomposition, the original implementation
+    'cholesky':1,   # unrolled 6x6 Cholesky factorisation, no allocation
+}
+
+
+def set_overlap_kernel(kernel):
+    """
+    Select the kernel the c implementation uses to calculate each overlap
+
+    The default is chosen at compile time ('cholesky', unless built with
+    -DOVERLAP_DEFAULT_GSL) and can be overridden at import time with the
+    environment variable CHRONOSTAR_OVERLAP_KERNEL.
+
+    Parameters
+    ----------
+    kernel: str
+        One of the keys of `C_OVERLAP_KERNELS`, 'gsl' or 'cholesky'.
+        Both give the same result to numerical precision. 'cholesky'
+        falls back to 'gsl' for any star whose combined covariance matrix
+        is not positive definite.
+    """
+    if kernel not in C_OVERLAP_KERNELS:
+        raise UserWarning('Unknown overlap kernel {}, must be one of {}'.format(
+                kernel, list(C_OVERLAP_KERNELS.keys())
+        ))
+    if USE_C_IMPLEMENTATION:
+        c_set_lnoverlap_kernel(C_OVERLAP_KERNELS[kernel])
+
+
+def get_overlap_kernel():
+    """
+    Get the name of the kernel the c implementation uses to calculate
+    each overlap, or None if the c implementation is unavailable.
+    """
+    if not USE_C_IMPLEMENTATION:
+        return None
+    kernel_ix = c_get_lnoverlap_kernel()
+    for name, ix in C_OVERLAP_KERNELS.items():
+        if ix == kernel_ix:
+            return name
+
+
+if 'CHRONOSTAR_OVERLAP_KERNEL' in os.environ:
+    set_overlap_kernel(os.environ['CHRONOSTAR_OVERLAP_KERNEL'])
+
+
 def slow_get_lnoverlaps(g_cov, g_mn, st_covs, st_mns, dummy=None):
     """
     A pythonic implementation of overlap integral calculation.
@@ -80,6 +183,204 @@ def slow_get_lnoverlaps(g_cov, g_mn, st_covs, st_mns, dummy=None):
     return np.array(lnols)
 
 
+def slow_get_lnoverlaps_multi(g_covs, g_mns, st_covs, st_mns,
+                              lnols_output):
+    """
+    A pythonic implementation of the multi-component overlap calculation.
+    Left here in case swigged _overlap doesn't work.
+
+    Parameters
+    ----------
+    g_covs: ([ncomps,6,6] float array)
+        Covariance matrices of the components
+    g_mns: ([ncomps,6] float array)
+        means of the components
+    st_covs: ([nstars, 6, 6] float array)
+        covariance matrices of the stars
+    st_mns: ([nstars, 6], float array)
+        means of the stars
+    lnols_output: ([nstars, ncomps] float array)
+        preallocated array into which log overlaps are written, matching
+        the signature of the c implementation
+    """
+    for i, (g_cov, g_mn) in enumerate(zip(g_covs, g_mns)):
+        lnols_output[:, i] = slow_get_lnoverlaps(g_cov, g_mn, st_covs, st_mns)
+
+
+def numpy_get_lnoverlaps(g_cov, g_mn, st_covs, st_mns, dummy=None):
+    """
+    A vectorised numpy implementation of overlap integral calculation.
+
+    Evaluates every star at once with a batched Cholesky factorisation of
+    the combined covariance matrices and a batched forward substitution,
+    so is usable (if not as fast as the c implementation) when swigged
+    _overlap isn't available.
+
+    Parameters
+    ----------
+    g_cov: ([6,6] float array)
+        Covariance matrix of the group
+    g_mn: ([6] float array)
+        mean of the group
+    st_covs: ([nstars, 6, 6] float array)
+        covariance matrices of the stars
+    st_mns: ([nstars, 6], float array)
+        means of the stars
+    dummy: {None}
+        a place holder parameter such that this function's signature
+        matches that of the c implementation
+
+    Returns
+    -------
+    ln_ols: ([nstars] float array)
+        an array of the logarithm of the overlaps
+    """
+    stpg_covs = np.asarray(st_covs) + g_cov
+    stmg_mns = np.asarray(st_mns) - g_mn
+    dim = stmg_mns.shape[-1]
+
+    try:
+        chols = np.linalg.cholesky(stpg_covs)
+    except np.linalg.LinAlgError:
+        # At least one combined covariance matrix isn't positive definite,
+        # so mimic the c implementation, using the absolute determinant
+        ln_dets = np.linalg.slogdet(stpg_covs)[1]
+        bmas = np.linalg.solve(stpg_covs, stmg_mns[:, :, np.newaxis])[:, :, 0]
+        mahals = np.einsum('ni,ni->n', stmg_mns, bmas)
+        return -0.5 * (dim * np.log(2*np.pi) + ln_dets + mahals)
+
+    # Solve L y = (b - a) for every star by forward substitution
+    ys = np.zeros(stmg_mns.shape)
+    for i in range(dim):
+        ys[:, i] = (stmg_mns[:, i]
+                    - np.einsum('nk,nk->n', chols[:, i, :i], ys[:, :i])) \
+                   / chols[:, i, i]
+
+    ln_dets = 2 * np.sum(np.log(np.diagonal(chols, axis1=1, axis2=2)), axis=1)
+    mahals = np.einsum('ni,ni->n', ys, ys)
+    return -0.5 * (dim * np.log(2*np.pi) + ln_dets + mahals)
+
+
+def numpy_get_lnoverlaps_multi(g_covs, g_mns, st_covs, st_mns,
+                               lnols_output):
+    """
+    A vectorised numpy implementation of the multi-component overlap
+    calculation. See `numpy_get_lnoverlaps` and `slow_get_lnoverlaps_multi`.
+    """
+    for i, (g_cov, g_mn) in enumerate(zip(g_covs, g_mns)):
+        lnols_output[:, i] = numpy_get_lnoverlaps(g_cov, g_mn,
+                                                  st_covs, st_mns)
+
+
+# Implementations of the overlap calculation, each stored as a pair of
+# functions with the signatures of the c implementation:
+#   (g_cov, g_mn, st_covs, st_mns, nstars) -> [nstars] lnols
+#   (g_covs, g_mns, st_covs, st_mns, lnols_output) -> None
+OVERLAP_BACKENDS = {
+    'numpy':(numpy_get_lnoverlaps, numpy_get_lnoverlaps_multi),
+    'python':(slow_get_lnoverlaps, slow_get_lnoverlaps_multi),
+}
+# Implementations which take the stars' covariance matrices packed (see
+# transform.pack_covmatrices), with the same signatures but `st_covs`
+# of shape [nstars, 21]. Backends missing from here are given unpacked
+# copies of the (masked) matrices instead.
+PACKED_OVERLAP_BACKENDS = {}
+if USE_C_IMPLEMENTATION:
+    OVERLAP_BACKENDS['c'] = (c_get_lnoverlaps, c_get_lnoverlaps_multi)
+    PACKED_OVERLAP_BACKENDS['c'] = (c_get_lnoverlaps_packed,
+                                    c_get_lnoverlaps_multi_packed)
+    OVERLAP_BACKEND = 'c'
+else:
+    OVERLAP_BACKEND = 'numpy'
+
+
+def register_overlap_backend(name, lnoverlaps_func, lnoverlaps_multi_func,
+                             packed_lnoverlaps_func=None,
+                             packed_lnoverlaps_multi_func=None):
+    """
+    Add an implementation of the overlap calculation to the registry
+
+    Parameters
+    ----------
+    name: str
+        Name by which the backend is selected with `set_overlap_backend`
+    lnoverlaps_func: function
+        Matches the signature of `slow_get_lnoverlaps`
+    lnoverlaps_multi_func: function
+        Matches the signature of `slow_get_lnoverlaps_multi`
+    packed_lnoverlaps_func: function {None}
+        As `lnoverlaps_func`, but taking packed star covariance matrices
+    packed_lnoverlaps_multi_func: function {None}
+        As `lnoverlaps_multi_func`, but taking packed star covariance
+        matrices. Both packed functions must be given for either to be used.
+    """
+    OVERLAP_BACKENDS[name] = (lnoverlaps_func, lnoverlaps_multi_func)
+    if packed_lnoverlaps_func is not None \
+            and packed_lnoverlaps_multi_func is not None:
+        PACKED_OVERLAP_BACKENDS[name] = (packed_lnoverlaps_func,
+                                         packed_lnoverlaps_multi_func)
+    else:
+        PACKED_OVERLAP_BACKENDS.pop(name, None)
+
+
+def set_overlap_backend(name):
+    """
+    Select which implementation `get_lnoverlaps` and `get_lnoverlaps_multi`
+    use. Defaults to 'c' if swigged _overlap is available, and 'numpy'
+    otherwise, and can be overridden at import time with the environment
+    variable CHRONOSTAR_OVERLAP_BACKEND.
+
+    Parameters
+    ----------
+    name: str
+        A key of `OVERLAP_BACKENDS`, one of 'c', 'numpy', 'python', or
+        any backend added with `register_overlap_backend`
+    """
+    global OVERLAP_BACKEND
+    if name not in OVERLAP_BACKENDS:
+        raise UserWarning('Unknown overlap backend {}, must be one of {}'.format(
+                name, list(OVERLAP_BACKENDS.keys())
+        ))
+    OVERLAP_BACKEND = name
+
+
+def get_overlap_backend():
+    """Get the name of the overlap implementation currently in use"""
+    return OVERLAP_BACKEND
+
+
+if 'CHRONOSTAR_OVERLAP_BACKEND' in os.environ:
+    set_overlap_backend(os.environ['CHRONOSTAR_OVERLAP_BACKEND'])
+
+
+def _get_star_arrays(data, star_mask=None):
+    """
+    The (masked) star means and covariance matrices of a data dict, along
+    with the pair of overlap functions of the current backend that accept
+    those covariance matrices.
+
+    The covariance matrices are left packed if the data dict holds
+    'packed_covs' and the backend can use them directly, otherwise full
+    matrices are built, of the masked stars only.
+    """
+    packed = 'covs' not in data and 'packed_covs' in data
+    covs_key = 'packed_covs' if packed else 'covs'
+    if star_mask is not None:
+        star_means = data['means'][star_mask]
+        star_covs = data[covs_key][star_mask]
+    else:
+        star_means = data['means']
+        star_covs = data[covs_key]
+
+    if not packed:
+        return star_means, star_covs, OVERLAP_BACKENDS[OVERLAP_BACKEND]
+    if OVERLAP_BACKEND in PACKED_OVERLAP_BACKENDS:
+        return (star_means, np.ascontiguousarray(star_covs),
+                PACKED_OVERLAP_BACKENDS[OVERLAP_BACKEND])
+    return (star_means, unpack_covmatrices(star_covs),
+            OVERLAP_BACKENDS[OVERLAP_BACKEND])
+
+
 def calc_alpha(dx, dv, nstars):
     """
     Assuming we have identified 100% of star mass, and that average
@@ -166,7 +467,7 @@ def lnprior(comp, memb_probs):
         return -np.inf
 
     if isinstance(comp, EllipComponent) \
-            or (comp.COMPONENT_NAME == 'EllipticalComponent'):
+            or (getattr(comp, 'COMPONENT_NAME', None) == 'EllipticalComponent'):
         pars = comp.get_pars()
         if pars[7]>pars[6]:
             return -np.inf
@@ -195,17 +496,15 @@ def get_lnoverlaps(comp, data, star_mask=None):
             the central estimates of each star in XYZUVW space
         'covs': [nstars,6,6] float array
             the covariance of each star in XYZUVW space
+        'packed_covs': [nstars,21] float array
+            alternatively to 'covs', the upper triangles of the covariance
+            matrices, see tabletool.build_data_dict_from_table
     star_mask: [len(data)] indices
         A mask that excludes stars that have negliglbe membership probablities
         (and thus have their log overlaps scaled to tiny numbers).
     """
     # Prepare star arrays
-    if star_mask is not None:
-        star_means = data['means'][star_mask]
-        star_covs = data['covs'][star_mask]
-    else:
-        star_means = data['means']
-        star_covs = data['covs']
+    star_means, star_covs, backend_funcs = _get_star_arrays(data, star_mask)
 
     star_count = len(star_means)
 
@@ -213,15 +512,171 @@ def get_lnoverlaps(comp, data, star_mask=None):
     mean_now, cov_now = comp.get_currentday_projection()
 
     # Calculate overlap integral of each star
-    if USE_C_IMPLEMENTATION:
-        #~ print(cov_now, mean_now, star_count)
-        lnols = c_get_lnoverlaps(cov_now, mean_now, star_covs, star_means,
-                                 star_count)
-    else:
-        lnols = slow_get_lnoverlaps(cov_now, mean_now, star_covs, star_means)
+    lnoverlaps_func = backend_funcs[0]
+    lnols = lnoverlaps_func(cov_now, mean_now, star_covs, star_means,
+                            star_count)
+    return lnols
+
+
+def get_lnoverlaps_multi(comps, data, star_mask=None):
+    """
+    Calculate the log overlaps of every star with every component
+
+    Equivalent to stacking `get_lnoverlaps` for each component column-wise,
+    but performs only a single pass over the star data, in one call to
+    the c implementation.
+
+    Parameters
+    ----------
+    comps: [ncomps] list of Component objects
+        The components with which to calculate overlaps
+    data: dict
+        stellar cartesian data being fitted to, stored as a dict:
+        'means': [nstars,6] float array
+            the central estimates of each star in XYZUVW space
+        'covs': [nstars,6,6] float array
+            the covariance of each star in XYZUVW space
+        'packed_covs': [nstars,21] float array
+            alternatively to 'covs', see `get_lnoverlaps`
+    star_mask: [len(data)] indices
+        A mask that excludes stars, see `get_lnoverlaps`
+
+    Returns
+    -------
+    lnols: [nstars, ncomps] float array
+        The log overlap of each star with each component
+    """
+    # Prepare star arrays
+    star_means, star_covs, backend_funcs = _get_star_arrays(data, star_mask)
+
+    star_count = len(star_means)
+    comp_count = len(comps)
+    lnols = np.zeros((star_count, comp_count))
+    if comp_count == 0 or star_count == 0:
+        return lnols
+
+    # Get current day projection of each component
+    projections = [comp.get_currentday_projection() for comp in comps]
+    means_now = np.array([mean_now for mean_now, _ in projections])
+    covs_now = np.array([cov_now for _, cov_now in projections])
+
+    # Calculate overlap integral of each star with each component
+    lnoverlaps_multi_func = backend_funcs[1]
+    lnoverlaps_multi_func(covs_now, means_now, star_covs, star_means, lnols)
     return lnols
 
 
+class OverlapCache(LRUCache):
+    """
+    A bounded, least recently used cache of the (unweighted) log overlaps
+    of every star with each component, such that the many consumers of
+    one EM iteration's components (expectation, get_overall_lnlikelihood,
+    check_stability, ...) only calculate them once.
+
+    Entries are keyed by component class, parameters and orbit tracing
+    function, and hold a column of `get_lnoverlaps_multi`. A cache holds
+    overlaps with one data set, it is cleared if used with another. Data
+    sets are told apart by their star arrays ('means' and 'covs' or
+    'packed_covs'), held by weak reference, so replacing an array (or the
+    whole data dict) is noticed. Changing an array's values in place is
+    not, so data must not be modified in place while a cache is in use
+    (or the cache must be cleared when it is).
+
+    Parameters
+    ----------
+    maxsize : int {64}
+        Maximum number of components held, the least recently used is
+        dropped beyond this. A maxsize of 0 disables the cache.
+    """
+    def __init__(self, maxsize=64):
+        super(OverlapCache, self).__init__(maxsize)
+        self._data_token = None
+
+    @staticmethod
+    def make_key(comp):
+        """
+        Key of a component's overlaps, or None if `comp` can't be
+        keyed (its orbit tracing function is unhashable)
+        """
+        trace_orbit_func = getattr(comp, 'trace_orbit_func', None)
+        try:
+            hash(trace_orbit_func)
+        except TypeError:
+            return None
+        pars = np.asarray(comp.get_pars(), dtype=np.float64)
+        return (type(comp), pars.tobytes(), trace_orbit_func)
+
+    @staticmethod
+    def _make_data_token(data):
+        """
+        Identify a data set by its star arrays: a list of (key, weak
+        reference, shape) for each of 'means', 'covs' and 'packed_covs'
+        present. Unlike an id, a weak reference can't be mistaken for a
+        new array once the old one is freed.
+        """
+        token = []
+        for key in ('means', 'covs', 'packed_covs'):
+            if key not in data:
+                continue
+            array = data[key]
+            try:
+                ref = weakref.ref(array)
+            except TypeError:
+                # Not weakly referenceable (e.g. a list), keep it alive
+                # instead, so its id can't be reused
+                ref = lambda array=array: array
+            token.append((key, ref, np.shape(array)))
+        return token
+
+    def _holds_data(self, data):
+        """True iff the cached overlaps are with the star arrays of `data`"""
+        if self._data_token is None:
+            return False
+        keys = [key for key in ('means', 'covs', 'packed_covs')
+                if key in data]
+        if keys != [key for key, _, _ in self._data_token]:
+            return False
+        return all(ref() is data[key] and np.shape(data[key]) == shape
+                   for key, ref, shape in self._data_token)
+
+    def get_lnoverlaps_multi(self, comps, data):
+        """
+        As `get_lnoverlaps_multi`, but only calculating the columns of
+        components not already in the cache (in one pass over the data)
+
+        Returns
+        -------
+        lnols: [nstars, ncomps] float array
+        """
+        if self.maxsize <= 0:
+            return get_lnoverlaps_multi(comps, data)
+        if not self._holds_data(data):
+            self.clear()
+            self._data_token = self._make_data_token(data)
+
+        keys = [self.make_key(comp) for comp in comps]
+        columns = [self.get(key) for key in keys]
+        missing = [i for i, column in enumerate(columns) if column is None]
+
+        if missing:
+            new_lnols = get_lnoverlaps_multi([comps[i] for i in missing],
+                                             data)
+            for j, i in enumerate(missing):
+                columns[i] = new_lnols[:, j].copy()
+                columns[i].flags.writeable = False
+                self._store(keys[i], columns[i])
+
+        if not columns:
+            return get_lnoverlaps_multi(comps, data)
+        return np.stack(columns, axis=1)
+
+    def clear(self):
+        """Drop all entries (and the data they belong to), and reset the
+        hit statistics"""
+        super(OverlapCache, self).clear()
+        self._data_token = None
+
+
 def lnlike(comp, data, memb_probs, memb_threshold=1e-5,
            minimum_exp_starcount=10.):
     """Computes the log-likelihood for a fit to a group.
@@ -279,6 +734,43 @@ def lnlike(comp, data, memb_probs, memb_threshold=1e-5,
     return result
 
 
+def lnlike_multi(comps, data, memb_probs, memb_threshold=1e-5,
+                 minimum_exp_starcount=10.):
+    """Computes the log-likelihood of many fits to the same group.
+
+    Equivalent to calling `lnlike` for each component, but the overlaps of
+    every component are calculated in a single call to
+    `get_lnoverlaps_multi`. Used to evaluate a batch of emcee walkers.
+
+    Parameters
+    ----------
+    comps: [ncomps] list of Component objects
+        The proposed component models
+    data: dict
+        See `lnlike`
+    memb_probs: [nstars] float array
+        See `lnlike`. Shared by every component.
+
+    Returns
+    -------
+    lnlikes: [ncomps] float array
+        the logarithm of the likelihood of each fit
+    """
+    # Boost expect star count to some minimum threshold, see `lnlike`
+    exp_starcount = np.sum(memb_probs)
+    if exp_starcount < minimum_exp_starcount:
+        memb_probs = np.copy(memb_probs)
+        memb_probs *= minimum_exp_starcount / exp_starcount
+
+    nearby_star_mask = np.where(memb_probs > memb_threshold)
+
+    # Calculate log overlaps of relevant stars with every component
+    lnols = get_lnoverlaps_multi(comps, data, star_mask=nearby_star_mask)
+
+    # Weight each stars contribution by their membership probability
+    return np.dot(memb_probs[nearby_star_mask], lnols)
+
+
 def lnprob_func(pars, data, memb_probs=None,
                 trace_orbit_func=None, optimisation_method='emcee',
                 Component=SphereComponent, **kwargs):
@@ -354,3 +846,49 @@ def lnprob_func(pars, data, memb_probs=None,
         if not np.isfinite(lp):
             return np.inf
         return - (lp + lnlike(comp, data, memb_probs, **kwargs))
+
+
+def lnprob_func_vectorised(pars, data, memb_probs=None,
+                           trace_orbit_func=None, optimisation_method='emcee',
+                           Component=SphereComponent, **kwargs):
+    """Computes the log-probability for a batch of fits to a group.
+
+    Intended for an emcee sampler built with `vectorize=True`, such that
+    every walker is evaluated at once. Walkers with a finite prior are
+    projected to the current day together (see
+    `AbstractComponent.project_many_to_now`), and have their overlaps
+    calculated in a single kernel call (see `lnlike_multi`) rather than
+    one call per walker.
+
+    Parameters
+    ----------
+    pars: [nwalkers, npars] float array
+        Parameters describing each proposed group model, see `lnprob_func`
+    data, memb_probs, trace_orbit_func, Component, kwargs
+        See `lnprob_func`
+    optimisation_method: str {'emcee'}
+        Only present so the signature matches `lnprob_func`, the batched
+        form is only used by emcee.
+
+    Returns
+    -------
+    logprobs: [nwalkers] float array
+        the logarithm of the posterior probability of each fit
+    """
+    pars = np.atleast_2d(pars)
+    if memb_probs is None:
+        memb_probs = np.ones(len(data['means']))
+
+    comps = [Component(emcee_pars=walker_pars,
+                       trace_orbit_func=trace_orbit_func)
+             for walker_pars in pars]
+    lnprobs = np.array([lnprior(comp, memb_probs) for comp in comps])
+
+    # Only evaluate the likelihood of walkers permitted by the prior
+    valid_ixs = np.where(np.isfinite(lnprobs))[0]
+    if len(valid_ixs) > 0:
+        valid_comps = [comps[i] for i in valid_ixs]
+        Component.project_many_to_now(valid_comps)
+        lnprobs[valid_ixs] += lnlike_multi(valid_comps, data, memb_probs,
+                                           **kwargs)
+    return lnprobs
@@ -38,7 +38,9 @@ from . import expectmax
 from . import readparam
 from . import tabletool
 from . import component
+from . import datapool
 from . import traceorbit
+from . import likelihood
 
 # python3 throws FileNotFoundError that is essentially the same as IOError
 try:
@@ -131,10 +133,16 @@ class NaiveFit(object):
 
         # If loading parameters from text file, can provide strings:
         #  - 'epicyclic' for epicyclic
+        #  - 'tangent' for galpy orbits with Jacobians from the variational
+        #    equations rather than finite differences
         #  - 'dummy_trace_orbit_func' for a trace orbit funciton that doens't do antyhing (for testing)
         # Alternativley, if building up parameter dictionary in a script, can
         # provide actual function.
         'trace_orbit_func':traceorbit.trace_cartesian_orbit,
+
+        # Directory of a propagator table (see propagatortable.py) used to
+        # look up galpy orbit projections rather than integrate them
+        'propagator_table': None,
         
         # MZ
         # Specify what optimisation method in the maximisation step of
@@ -148,6 +156,33 @@ class NaiveFit(object):
         
         # Optimise components in parallel in expectmax.maximise.
         'nprocess_ncomp': False,
+
+        # Evaluate all emcee walkers in a single batched lnprob call
+        # (emcee's `vectorize`), rather than one call per walker.
+        'vectorise_lnprob': False,
+
+        # Place the star data in shared memory, so that worker processes
+        # attach to it rather than each holding a copy.
+        # False | 'shm' | 'memmap'
+        'share_data': False,
+
+        # If `data_table` is a path, keep the arrays built from it in a
+        # cache alongside the table, to be reused by later runs. This
+        # writes a copy of the star data beside the table, so is opt-in
+        'cache_data_dict': False,
+
+        # Store only the upper triangle of each star's covariance matrix,
+        # which uses 40% less memory for large data sets
+        'pack_covs': False,
+
+        # Write emcee chains to disk every this many steps, such that a
+        # killed run resumes component fits from their last checkpoint
+        'chain_checkpoint_every': None,
+
+        # Burn in until the chain's autocorrelation time and Gelman-Rubin
+        # statistic show convergence, then sample for a multiple of the
+        # autocorrelation time
+        'adaptive_burnin': False,
         
         # Overwrite final results in a fits file
         'overwrite_fits': False,
@@ -182,7 +217,22 @@ class NaiveFit(object):
 
         # Data prep should already have been completed, so we simply build
         # the dictionary of arrays from the astropy table
-        self.data_dict = tabletool.build_data_dict_from_table(self.fit_pars['data_table'])
+        self.data_dict = tabletool.build_data_dict_from_table(
+                self.fit_pars['data_table'],
+                use_cache=self.fit_pars['cache_data_dict'],
+                pack_covs=self.fit_pars['pack_covs'],
+        )
+        if self.fit_pars['share_data']:
+            backend = self.fit_pars['share_data']
+            if backend is True:
+                backend = 'shm'
+            self.data_dict = datapool.SharedDataDict(self.data_dict,
+                                                     backend=backend)
+
+        # Overlaps of scored components, shared by the likelihood and
+        # posterior in `calc_score`. Star arrays of self.data_dict must
+        # be replaced rather than edited in place, see OverlapCache
+        self.overlap_cache = likelihood.OverlapCache()
 
         # The NaiveFit approach is to assume staring with 1 component
         self.ncomps = 1
@@ -229,10 +279,14 @@ class NaiveFit(object):
                               'Rememeber to leave one cpu free for master thread!')
 
         # MZ: If nthreads>1: create an MPIPool
+        # Workers of a DataPool load the data once, rather than being sent
+        # it with every walker evaluation
         if self.fit_pars['nthreads']>1:
             #self.pool = MPIPool()
-            log_message('pool = Pool(nthreads) = pool(%d)'%self.fit_pars['nthreads'])
-            self.fit_pars['pool']=Pool(self.fit_pars['nthreads'])
+            log_message('pool = DataPool(nthreads) = pool(%d)'%self.fit_pars['nthreads'])
+            self.pool = datapool.DataPool(self.data_dict,
+                                          nprocesses=self.fit_pars['nthreads'])
+            self.fit_pars['pool'] = self.pool
         else:
             self.pool = None
 
@@ -246,6 +300,17 @@ class NaiveFit(object):
         elif self.fit_pars['trace_orbit_func'] == 'epicyclic':
             log_message('trace_orbit: epicyclic')
             self.fit_pars['trace_orbit_func'] = traceorbit.trace_epicyclic_orbit
+        elif self.fit_pars['trace_orbit_func'] == 'tangent':
+            log_message('trace_orbit: tangent')
+            self.fit_pars['trace_orbit_func'] =\
+                traceorbit.trace_cartesian_orbit_tangent
+        elif self.fit_pars['propagator_table']:
+            log_message('trace_orbit: propagator table {}'.format(
+                    self.fit_pars['propagator_table']))
+            self.fit_pars['trace_orbit_func'] = traceorbit.trace_orbit_builder(
+                    traceorbit.MWPotential2014,
+                    propagator_table=self.fit_pars['propagator_table'],
+            )
         else:
             self.fit_pars['trace_orbit_func'] = traceorbit.trace_cartesian_orbit
 
@@ -483,12 +548,14 @@ class NaiveFit(object):
                                                     comps,
                                                     old_memb_probs=memb_probs,
                                                     # bg_ln_ols=bg_ln_ols,
+                                                    overlap_cache=self.overlap_cache,
                                                     )
         lnpost = expectmax.get_overall_lnlikelihood(self.data_dict,
                                                     comps,
                                                     # bg_ln_ols=bg_ln_ols,
                                                     old_memb_probs=memb_probs,
-                                                    inc_posterior=True)
+                                                    inc_posterior=True,
+                                                    overlap_cache=self.overlap_cache)
 
         bic = expectmax.calc_bic(self.data_dict, self.ncomps, lnlike,
                                       memb_probs=memb_probs,
@@ -647,4 +714,10 @@ class NaiveFit(object):
             log_message(msg='REACHED MAX COMP LIMIT', symbol='+',
                         surround=True)
 
+        # Release the worker processes
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            self.fit_pars['pool'] = None
+
         return prev_result, prev_score
@@ -1,4 +1,5 @@
 #include <stdio.h>
+#include <stdlib.h>
 
 //#ifndef DARWIN 
 //#include <malloc.h>
@@ -12,6 +13,14 @@
 #include <string.h>
 #include <math.h>
 
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+/* Below this many stars the thread start up costs outweigh the gain,
+ * so the star loops run serially */
+#define OMP_MIN_STARS 64
+
 /*
  *  A simple helper function to display the contents of a 2-D gsl matrix
  */
@@ -72,6 +81,217 @@ void print_vec(double* vec, int dim1)
   printf("\n");
 }
 
+/* Kernels used to calculate a single log overlap inside the star loops.
+ * The unrolled Cholesky kernel is the default, compile with
+ * -DOVERLAP_DEFAULT_GSL to make the GSL LU kernel the default instead.
+ * Either way the kernel can be switched at run time with
+ * `set_lnoverlap_kernel`.
+ */
+#define KERNEL_GSL      0
+#define KERNEL_CHOLESKY 1
+
+#ifdef OVERLAP_DEFAULT_GSL
+static int lnoverlap_kernel = KERNEL_GSL;
+#else
+static int lnoverlap_kernel = KERNEL_CHOLESKY;
+#endif
+
+/* Function: lnoverlap_gsl
+ * -----------------------
+ *   Calculates the log overlap of one star with one component using GSL's
+ *   LU decomposition. Works for any MAT_DIM.
+ *
+ *   The workspace `BpA`, `bma`, `v_temp` and `p1` must be allocated by the
+ *   caller (with dimension MAT_DIM) so it can be reused between stars.
+ */
+static double lnoverlap_gsl(
+  const double* gr_cov, const double* gr_mn,
+  const double* st_cov, const double* st_mn, int MAT_DIM,
+  gsl_matrix *BpA, gsl_vector *bma, gsl_vector *v_temp, gsl_permutation *p1
+  )
+{
+  int i, j, signum;
+  double d_temp, result, ln_det_BpA;
+
+  // INITIALISE STAR MATRIX
+  for (i=0; i<MAT_DIM; i++)
+    for (j=0; j<MAT_DIM; j++)
+      //performing st_cov+gr_cov as part of the initialisation
+      gsl_matrix_set(BpA, i, j,
+                     st_cov[i*MAT_DIM+j] + gr_cov[i*MAT_DIM+j]);
+
+  // INITIALISE CENTRAL ESTIMATES
+  // performing st_mn - gr_mn as part of the initialisation
+  for (i=0; i<MAT_DIM; i++)
+    gsl_vector_set(bma, i, st_mn[i] - gr_mn[i]);
+
+  // CALCULATE OVERLAPS
+  // Performed in 4 stages
+  // Calc and sum up the inner terms:
+  // 1) 6 ln(2pi)
+  // 2) ln(|C|)
+  // 3) (b-a)^T(C^-1)(b-a)
+  // Then apply -0.5 coefficient
+
+  // 1) Calc 6 ln(2pi)
+  result = 6*log(2*M_PI);
+
+  // 2) Get log determiant of C
+  gsl_linalg_LU_decomp(BpA, p1, &signum);
+  ln_det_BpA = log(fabs(gsl_linalg_LU_det(BpA, signum)));
+  result += ln_det_BpA;
+
+  // 3) Calc (b-a)^T(C^-1)(b-a)
+  gsl_vector_set_zero(v_temp);
+  gsl_linalg_LU_solve(BpA, p1, bma, v_temp); /* v_temp holds (B+A)^-1 (b-a) *
+                                              * utilises `p1` as calculated *
+                                              * above                       */
+  gsl_blas_ddot(v_temp, bma, &d_temp); //d_temp holds (b-a)^T (B+A)-1 (b-a)
+  result += d_temp;
+
+  // 4) Apply coefficient
+  result *= -0.5;
+
+  return result;
+}
+
+/* Function: lnoverlap_chol6
+ * -------------------------
+ *   Calculates the log overlap of one star with one component, for 6D
+ *   only, using a hand unrolled Cholesky factorisation C = L L^T on the
+ *   stack. No memory is allocated.
+ *
+ *   Takes C = st_cov + gr_cov packed, i.e. the 21 elements of its upper
+ *   triangle row by row, and b - a = st_mn - gr_mn, see
+ *   `lnoverlap_chol6_dense` and `lnoverlap_chol6_packed`.
+ *
+ *   ln(|C|) is twice the log of the product of L's diagonal, and
+ *   (b-a)^T (C^-1) (b-a) = y^T y where L y = (b-a) is found by forward
+ *   substitution.
+ *
+ * Returns
+ * -------
+ *  0 on success, with the log overlap stored in `lnol`, or -1 if C is not
+ *  (numerically) positive definite, in which case `lnol` is untouched and
+ *  the caller should fall back to `lnoverlap_gsl`.
+ */
+/* Element (i,j) of C, for i >= j, as stored at (j,i) in its packed form */
+#define C(i,j) (c[(j)*6 - (j)*((j)-1)/2 + (i)-(j)])
+static int lnoverlap_chol6(const double* c, const double* bma, double* lnol)
+{
+  double d;
+  double l00;
+  double l10, l11;
+  double l20, l21, l22;
+  double l30, l31, l32, l33;
+  double l40, l41, l42, l43, l44;
+  double l50, l51, l52, l53, l54, l55;
+  double inv0, inv1, inv2, inv3, inv4, inv5;
+  double y0, y1, y2, y3, y4, y5;
+
+  // FACTORISE C = L L^T, one column at a time
+  d = C(0,0);
+  if (!(d > 0.0)) return -1;
+  l00 = sqrt(d);
+  inv0 = 1.0/l00;
+  l10 = C(1,0)*inv0;
+  l20 = C(2,0)*inv0;
+  l30 = C(3,0)*inv0;
+  l40 = C(4,0)*inv0;
+  l50 = C(5,0)*inv0;
+
+  d = C(1,1) - l10*l10;
+  if (!(d > 0.0)) return -1;
+  l11 = sqrt(d);
+  inv1 = 1.0/l11;
+  l21 = (C(2,1) - l20*l10)*inv1;
+  l31 = (C(3,1) - l30*l10)*inv1;
+  l41 = (C(4,1) - l40*l10)*inv1;
+  l51 = (C(5,1) - l50*l10)*inv1;
+
+  d = C(2,2) - l20*l20 - l21*l21;
+  if (!(d > 0.0)) return -1;
+  l22 = sqrt(d);
+  inv2 = 1.0/l22;
+  l32 = (C(3,2) - l30*l20 - l31*l21)*inv2;
+  l42 = (C(4,2) - l40*l20 - l41*l21)*inv2;
+  l52 = (C(5,2) - l50*l20 - l51*l21)*inv2;
+
+  d = C(3,3) - l30*l30 - l31*l31 - l32*l32;
+  if (!(d > 0.0)) return -1;
+  l33 = sqrt(d);
+  inv3 = 1.0/l33;
+  l43 = (C(4,3) - l40*l30 - l41*l31 - l42*l32)*inv3;
+  l53 = (C(5,3) - l50*l30 - l51*l31 - l52*l32)*inv3;
+
+  d = C(4,4) - l40*l40 - l41*l41 - l42*l42 - l43*l43;
+  if (!(d > 0.0)) return -1;
+  l44 = sqrt(d);
+  inv4 = 1.0/l44;
+  l54 = (C(5,4) - l50*l40 - l51*l41 - l52*l42 - l53*l43)*inv4;
+
+  d = C(5,5) - l50*l50 - l51*l51 - l52*l52 - l53*l53 - l54*l54;
+  if (!(d > 0.0)) return -1;
+  l55 = sqrt(d);
+  inv5 = 1.0/l55;
+
+  // FORWARD SOLVE L y = (b-a)
+  y0 = (bma[0])*inv0;
+  y1 = (bma[1] - l10*y0)*inv1;
+  y2 = (bma[2] - l20*y0 - l21*y1)*inv2;
+  y3 = (bma[3] - l30*y0 - l31*y1 - l32*y2)*inv3;
+  y4 = (bma[4] - l40*y0 - l41*y1 - l42*y2 - l43*y3)*inv4;
+  y5 = (bma[5] - l50*y0 - l51*y1 - l52*y2 - l53*y3 - l54*y4)*inv5;
+
+  // COMBINE, as in `lnoverlap_gsl`
+  *lnol = -0.5 * (6*log(2*M_PI)
+                  + 2*log(l00*l11*l22*l33*l44*l55)
+                  + y0*y0 + y1*y1 + y2*y2 + y3*y3 + y4*y4 + y5*y5);
+  return 0;
+}
+#undef C
+
+/* Function: lnoverlap_chol6_dense
+ * -------------------------------
+ *   `lnoverlap_chol6` for a star and component with full covariance
+ *   matrices.
+ */
+static int lnoverlap_chol6_dense(
+  const double* gr_cov, const double* gr_mn,
+  const double* st_cov, const double* st_mn, double* lnol
+  )
+{
+  int i, j, k = 0;
+  double c[21], bma[6];
+
+  for (i=0; i<6; i++) {
+    for (j=i; j<6; j++, k++)
+      c[k] = st_cov[6*i+j] + gr_cov[6*i+j];
+    bma[i] = st_mn[i] - gr_mn[i];
+  }
+  return lnoverlap_chol6(c, bma, lnol);
+}
+
+/* Function: lnoverlap_chol6_packed
+ * --------------------------------
+ *   `lnoverlap_chol6` for a star and component with packed covariance
+ *   matrices (see `unpack_cov`), such that C is formed with 21 additions.
+ */
+static int lnoverlap_chol6_packed(
+  const double* gr_pcov, const double* gr_mn,
+  const double* st_pcov, const double* st_mn, double* lnol
+  )
+{
+  int i;
+  double c[21], bma[6];
+
+  for (i=0; i<21; i++)
+    c[i] = st_pcov[i] + gr_pcov[i];
+  for (i=0; i<6; i++)
+    bma[i] = st_mn[i] - gr_mn[i];
+  return lnoverlap_chol6(c, bma, lnol);
+}
+
 /* Function: get_lnoverlaps
  * ------------------------
  *   Calculates the log overlap (convolution) with a set of 6D Gaussians with
@@ -109,6 +329,10 @@ void print_vec(double* vec, int dim1)
  *
  *   Stark improvement on previous implementations. Doesn't require input as
  *   inverse covariance matrices. Never performs a matrix inversion.
+ *
+ *   Each overlap is calculated by the kernel set with
+ *   `set_lnoverlap_kernel`. The Cholesky kernel falls back to the GSL one
+ *   for any star where C isn't positive definite.
  */
 void get_lnoverlaps(
   double* gr_cov, int gr_dim1, int gr_dim2,
@@ -118,76 +342,431 @@ void get_lnoverlaps(
   double* lnols_output, int n
   )
 {
-  // ALLOCATE MEMORY
-  int star_count = 0;
   int MAT_DIM = gr_dim1; //Typically set to 6
-  int i, j, signum;
-  double d_temp, result, ln_det_BpA;
-  gsl_permutation *p1;
+  int use_chol = (lnoverlap_kernel == KERNEL_CHOLESKY && MAT_DIM == 6);
 
-  gsl_matrix *BpA      = gsl_matrix_alloc(MAT_DIM, MAT_DIM); //will hold (B+A)
-  gsl_vector *bma      = gsl_vector_alloc(MAT_DIM);          //will hold b - a
-  gsl_vector *v_temp   = gsl_vector_alloc(MAT_DIM);
+  // Each thread gets its own workspace, the star loop is shared between
+  // them. Without OpenMP this is a single (serial) workspace and loop.
+  #pragma omp parallel if(n >= OMP_MIN_STARS)
+  {
+    // ALLOCATE MEMORY
+    int star_count = 0;
+    double *st_cov, *st_mn;
+    double result;
+    gsl_permutation *p1;
+
+    gsl_matrix *BpA      = gsl_matrix_alloc(MAT_DIM, MAT_DIM); //will hold (B+A)
+    gsl_vector *bma      = gsl_vector_alloc(MAT_DIM);          //will hold b - a
+    gsl_vector *v_temp   = gsl_vector_alloc(MAT_DIM);
+
+    p1 = gsl_permutation_alloc(BpA->size1);
+
+    // Go through each star, calculating and storing overlap
+    #pragma omp for schedule(static)
+    for (star_count=0; star_count<n; star_count++) {
+      st_cov = st_covs + star_count*MAT_DIM*MAT_DIM;
+      st_mn  = st_mns  + star_count*MAT_DIM;
+
+      if (!use_chol ||
+          lnoverlap_chol6_dense(gr_cov, gr_mn, st_cov, st_mn, &result) != 0)
+        result = lnoverlap_gsl(gr_cov, gr_mn, st_cov, st_mn, MAT_DIM,
+                               BpA, bma, v_temp, p1);
+
+      // STORE RESULT 'lnols_output'
+      lnols_output[star_count] = result;
+    }
 
-  p1 = gsl_permutation_alloc(BpA->size1);
+    // DEALLOCATE THE MEMORY
+    gsl_matrix_free(BpA);
+    gsl_vector_free(bma);
+    gsl_vector_free(v_temp);
+    gsl_permutation_free(p1);
+  }
+}
 
-  // Go through each star, calculating and storing overlap
-  for (star_count=0; star_count<n; star_count++) {
-    // INITIALISE STAR MATRIX
-    for (i=0; i<MAT_DIM; i++)
-      for (j=0; j<MAT_DIM; j++)
-        //performing st_cov+gr_cov as part of the initialisation
-        gsl_matrix_set(
-          BpA,i,j,
-          st_covs[star_count*MAT_DIM*MAT_DIM+i*MAT_DIM+j] +
-          gr_cov[i*MAT_DIM+j]
-        );
-
-    // INITIALISE CENTRAL ESTIMATES
-    // performing st_mn - gr_mn as part of the initialisation
-    for (i=0; i<MAT_DIM; i++) {
-      gsl_vector_set(
-        bma, i,
-        st_mns[star_count*MAT_DIM + i] - gr_mn[i]
-      );
+/* Function: check_multi_dims
+ * --------------------------
+ *   Checks the array dimensions passed to `get_lnoverlaps_multi` and
+ *   `get_lnoverlaps_multi_packed` agree, such that no array is read or
+ *   written past its end. `st_cov_size` is the number of elements of each
+ *   star's covariance matrix as stored (MAT_DIM*MAT_DIM, or
+ *   MAT_DIM*(MAT_DIM+1)/2 if packed).
+ *
+ * Returns
+ * -------
+ *   1 if they agree, otherwise 0, having set a Python ValueError
+ */
+static int check_multi_dims(
+  int ncomps, int gr_dim2, int gr_dim3, int gr_mn_dim1, int gr_mn_dim2,
+  int nstars, int st_cov_size, int expected_st_cov_size,
+  int st_mn_dim1, int st_mn_dim2, int lnols_dim1, int lnols_dim2
+  )
+{
+  int MAT_DIM = gr_dim2;
+
+  if (gr_dim3 != MAT_DIM || gr_mn_dim1 != ncomps || gr_mn_dim2 != MAT_DIM) {
+    PyErr_Format(PyExc_ValueError,
+                 "Component covariance matrices must be [ncomps, %d, %d] "
+                 "and means [ncomps, %d], got [%d, %d, %d] and [%d, %d]",
+                 MAT_DIM, MAT_DIM, MAT_DIM, ncomps, gr_dim2, gr_dim3,
+                 gr_mn_dim1, gr_mn_dim2);
+    return 0;
+  }
+  if (st_cov_size != expected_st_cov_size) {
+    PyErr_Format(PyExc_ValueError,
+                 "Star covariance matrices must have %d elements each, "
+                 "got %d", expected_st_cov_size, st_cov_size);
+    return 0;
+  }
+  if (st_mn_dim1 != nstars || st_mn_dim2 != MAT_DIM) {
+    PyErr_Format(PyExc_ValueError,
+                 "Star means must be [%d, %d], got [%d, %d]",
+                 nstars, MAT_DIM, st_mn_dim1, st_mn_dim2);
+    return 0;
+  }
+  if (lnols_dim1 != nstars || lnols_dim2 != ncomps) {
+    PyErr_Format(PyExc_ValueError,
+                 "lnols_matrix must be [nstars, ncomps] = [%d, %d], "
+                 "got [%d, %d]", nstars, ncomps, lnols_dim1, lnols_dim2);
+    return 0;
+  }
+  return 1;
+}
+
+/* Function: get_lnoverlaps_multi
+ * ------------------------------
+ *   Calculates the log overlap of a set of 6D Gaussians (stars) with each
+ *   of a set of 6D Gaussians (components), filling a [nstars, ncomps]
+ *   matrix in a single pass over the star data.
+ *
+ *   In Chronostar, this is used in the expectation step, where every star
+ *   must be compared against every component. Looping over components
+ *   inside the star loop means each star's covariance matrix is read from
+ *   memory once, rather than once per component.
+ *
+ * Paramaters
+ *  name          type                  description
+ * ----------
+ *  gr_covs       (ncomps*6*6 npArray)  each component's covariance matrix
+ *  gr_mns        (ncomps*6 npArray)    each component's central estimate
+ *  st_covs       (n*6*6 npArray)       array of each star's cov matrix
+ *  st_mns:       (n*6 npArray)         array of each star's central estimate
+ *  lnols_matrix: (n*ncomps npArray)    preallocated, C-contiguous array
+ *                                      into which overlaps are written
+ *
+ * Returns
+ * -------
+ *  Nothing. The log overlap of star i with component j is stored in
+ *  lnols_matrix[i*ncomps + j]. If the arrays' dimensions don't agree,
+ *  nothing is calculated and a Python ValueError is set.
+ *
+ * Notes
+ * -----
+ *   Each element is identical to that calculated by `get_lnoverlaps`.
+ */
+void get_lnoverlaps_multi(
+  double* gr_covs, int gr_dim1, int gr_dim2, int gr_dim3,
+  double* gr_mns, int gr_mn_dim1, int gr_mn_dim2,
+  double* st_covs, int st_dim1, int st_dim2, int st_dim3,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_matrix, int lnols_dim1, int lnols_dim2
+  )
+{
+  int ncomps = gr_dim1;
+  int MAT_DIM = gr_dim2; //Typically set to 6
+  int MAT_SIZE = MAT_DIM*MAT_DIM;
+  int use_chol = (lnoverlap_kernel == KERNEL_CHOLESKY && MAT_DIM == 6);
+
+  if (!check_multi_dims(ncomps, gr_dim2, gr_dim3, gr_mn_dim1, gr_mn_dim2,
+                        st_dim1, st_dim2*st_dim3, MAT_SIZE,
+                        st_mn_dim1, st_mn_dim2, lnols_dim1, lnols_dim2))
+    return;
+
+  // Per-thread workspaces, as in `get_lnoverlaps`
+  #pragma omp parallel if(st_dim1 >= OMP_MIN_STARS)
+  {
+    // ALLOCATE MEMORY
+    int star_count, comp_count;
+    double result;
+    double *st_cov, *st_mn, *gr_cov, *gr_mn;
+    gsl_permutation *p1;
+
+    gsl_matrix *BpA      = gsl_matrix_alloc(MAT_DIM, MAT_DIM); //will hold (B+A)
+    gsl_vector *bma      = gsl_vector_alloc(MAT_DIM);          //will hold b - a
+    gsl_vector *v_temp   = gsl_vector_alloc(MAT_DIM);
+
+    p1 = gsl_permutation_alloc(BpA->size1);
+
+    // Go through each star once, calculating overlap with every component
+    #pragma omp for schedule(static)
+    for (star_count=0; star_count<st_dim1; star_count++) {
+      st_cov = st_covs + star_count*MAT_SIZE;
+      st_mn  = st_mns  + star_count*MAT_DIM;
+
+      for (comp_count=0; comp_count<ncomps; comp_count++) {
+        gr_cov = gr_covs + comp_count*MAT_SIZE;
+        gr_mn  = gr_mns  + comp_count*MAT_DIM;
+
+        if (!use_chol ||
+            lnoverlap_chol6_dense(gr_cov, gr_mn, st_cov, st_mn, &result) != 0)
+          result = lnoverlap_gsl(gr_cov, gr_mn, st_cov, st_mn, MAT_DIM,
+                                 BpA, bma, v_temp, p1);
+
+        // STORE RESULT in 'lnols_matrix'
+        lnols_matrix[star_count*lnols_dim2 + comp_count] = result;
+      }
     }
 
-    // CALCULATE OVERLAPS
-    // Performed in 4 stages
-    // Calc and sum up the inner terms:
-    // 1) 6 ln(2pi)
-    // 2) ln(|C|)
-    // 3) (b-a)^T(C^-1)(b-a)
-    // Then apply -0.5 coefficient
+    // DEALLOCATE THE MEMORY
+    gsl_matrix_free(BpA);
+    gsl_vector_free(bma);
+    gsl_vector_free(v_temp);
+    gsl_permutation_free(p1);
+  }
+}
 
-    // 1) Calc 6 ln(2pi)
-    result = 6*log(2*M_PI);
+/* Function: pack_cov
+ * ------------------
+ *   Stores the upper triangle of a MAT_DIM*MAT_DIM matrix row by row,
+ *   in MAT_DIM*(MAT_DIM+1)/2 elements.
+ */
+static void pack_cov(const double* cov, int MAT_DIM, double* packed_cov)
+{
+  int i, j, k = 0;
 
-    // 2) Get log determiant of C
-    gsl_linalg_LU_decomp(BpA, p1, &signum);
-    ln_det_BpA = log(fabs(gsl_linalg_LU_det(BpA, signum)));
-    result += ln_det_BpA;
+  for (i=0; i<MAT_DIM; i++)
+    for (j=i; j<MAT_DIM; j++, k++)
+      packed_cov[k] = cov[i*MAT_DIM+j];
+}
 
-    // 3) Calc (b-a)^T(C^-1)(b-a)
-    gsl_vector_set_zero(v_temp);
-    gsl_linalg_LU_solve(BpA, p1, bma, v_temp); /* v_temp holds (B+A)^-1 (b-a) *
-                                                * utilises `p1` as calculated *
-                                                * above                       */
-    gsl_blas_ddot(v_temp, bma, &d_temp); //d_temp holds (b-a)^T (B+A)-1 (b-a)
-    result += d_temp;
+/* Function: unpack_cov
+ * --------------------
+ *   Expands a symmetric matrix stored by `pack_cov` into the full
+ *   MAT_DIM*MAT_DIM matrix.
+ */
+static void unpack_cov(const double* packed_cov, int MAT_DIM, double* cov)
+{
+  int i, j, k = 0;
+
+  for (i=0; i<MAT_DIM; i++) {
+    for (j=i; j<MAT_DIM; j++, k++) {
+      cov[i*MAT_DIM+j] = packed_cov[k];
+      cov[j*MAT_DIM+i] = packed_cov[k];
+    }
+  }
+}
 
-    // 4) Apply coefficient
-    result *= -0.5;
+/* Function: get_lnoverlaps_packed
+ * -------------------------------
+ *   As `get_lnoverlaps`, but with the stars' covariance matrices stored
+ *   packed, i.e. only the upper triangle of each, row by row:
+ *
+ *  st_pcovs      (n*21 npArray)  array of each star's packed cov matrix
+ *
+ *   The Cholesky kernel works on the packed matrices directly, so only
+ *   21 of the 36 elements are read per star. A star's matrix is only
+ *   expanded when falling back to the GSL kernel. Results are identical
+ *   to `get_lnoverlaps`.
+ */
+void get_lnoverlaps_packed(
+  double* gr_cov, int gr_dim1, int gr_dim2,
+  double* gr_mn, int gr_mn_dim,
+  double* st_pcovs, int st_pdim1, int st_pdim2,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_output, int n
+  )
+{
+  int MAT_DIM = gr_dim1; //Typically set to 6
+  int use_chol = (lnoverlap_kernel == KERNEL_CHOLESKY && MAT_DIM == 6);
+  double gr_pcov[21];
 
-    // STORE RESULT 'lnols_output'
-    lnols_output[star_count] = result;
+  if (use_chol)
+    pack_cov(gr_cov, MAT_DIM, gr_pcov);
+
+  // Per-thread workspaces, as in `get_lnoverlaps`
+  #pragma omp parallel if(n >= OMP_MIN_STARS)
+  {
+    // ALLOCATE MEMORY
+    int star_count = 0;
+    double *st_pcov, *st_mn;
+    double result;
+    gsl_permutation *p1;
+
+    double *st_cov       = malloc(MAT_DIM*MAT_DIM*sizeof(double));
+    gsl_matrix *BpA      = gsl_matrix_alloc(MAT_DIM, MAT_DIM); //will hold (B+A)
+    gsl_vector *bma      = gsl_vector_alloc(MAT_DIM);          //will hold b - a
+    gsl_vector *v_temp   = gsl_vector_alloc(MAT_DIM);
+
+    p1 = gsl_permutation_alloc(BpA->size1);
+
+    // Go through each star, calculating and storing overlap
+    #pragma omp for schedule(static)
+    for (star_count=0; star_count<n; star_count++) {
+      st_pcov = st_pcovs + star_count*st_pdim2;
+      st_mn   = st_mns   + star_count*MAT_DIM;
+
+      if (!use_chol ||
+          lnoverlap_chol6_packed(gr_pcov, gr_mn, st_pcov, st_mn,
+                                 &result) != 0) {
+        unpack_cov(st_pcov, MAT_DIM, st_cov);
+        result = lnoverlap_gsl(gr_cov, gr_mn, st_cov, st_mn, MAT_DIM,
+                               BpA, bma, v_temp, p1);
+      }
+
+      // STORE RESULT 'lnols_output'
+      lnols_output[star_count] = result;
+    }
+
+    // DEALLOCATE THE MEMORY
+    free(st_cov);
+    gsl_matrix_free(BpA);
+    gsl_vector_free(bma);
+    gsl_vector_free(v_temp);
+    gsl_permutation_free(p1);
   }
+}
 
-  // DEALLOCATE THE MEMORY
-  gsl_matrix_free(BpA);
-  gsl_vector_free(bma);
-  gsl_vector_free(v_temp);
-  gsl_permutation_free(p1);
+/* Function: get_lnoverlaps_multi_packed
+ * -------------------------------------
+ *   As `get_lnoverlaps_multi`, but with the stars' covariance matrices
+ *   stored packed, see `get_lnoverlaps_packed`.
+ */
+void get_lnoverlaps_multi_packed(
+  double* gr_covs, int gr_dim1, int gr_dim2, int gr_dim3,
+  double* gr_mns, int gr_mn_dim1, int gr_mn_dim2,
+  double* st_pcovs, int st_pdim1, int st_pdim2,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_matrix, int lnols_dim1, int lnols_dim2
+  )
+{
+  int ncomps = gr_dim1;
+  int MAT_DIM = gr_dim2; //Typically set to 6
+  int MAT_SIZE = MAT_DIM*MAT_DIM;
+  int use_chol = (lnoverlap_kernel == KERNEL_CHOLESKY && MAT_DIM == 6);
+  int comp_ix;
+
+  if (!check_multi_dims(ncomps, gr_dim2, gr_dim3, gr_mn_dim1, gr_mn_dim2,
+                        st_pdim1, st_pdim2, MAT_DIM*(MAT_DIM+1)/2,
+                        st_mn_dim1, st_mn_dim2, lnols_dim1, lnols_dim2))
+    return;
+
+  // Pack the components' matrices once, shared by every thread
+  double *gr_pcovs = malloc(ncomps*st_pdim2*sizeof(double));
+  for (comp_ix=0; comp_ix<ncomps; comp_ix++)
+    pack_cov(gr_covs + comp_ix*MAT_SIZE, MAT_DIM,
+             gr_pcovs + comp_ix*st_pdim2);
+
+  // Per-thread workspaces, as in `get_lnoverlaps`
+  #pragma omp parallel if(st_pdim1 >= OMP_MIN_STARS)
+  {
+    // ALLOCATE MEMORY
+    int star_count, comp_count;
+    double result;
+    double *st_pcov, *st_mn, *gr_cov, *gr_mn;
+    gsl_permutation *p1;
+
+    double *st_cov       = malloc(MAT_SIZE*sizeof(double));
+    gsl_matrix *BpA      = gsl_matrix_alloc(MAT_DIM, MAT_DIM); //will hold (B+A)
+    gsl_vector *bma      = gsl_vector_alloc(MAT_DIM);          //will hold b - a
+    gsl_vector *v_temp   = gsl_vector_alloc(MAT_DIM);
+
+    p1 = gsl_permutation_alloc(BpA->size1);
+
+    // Go through each star once, calculating overlap with every component
+    #pragma omp for schedule(static)
+    for (star_count=0; star_count<st_pdim1; star_count++) {
+      st_pcov = st_pcovs + star_count*st_pdim2;
+      st_mn   = st_mns   + star_count*MAT_DIM;
+
+      for (comp_count=0; comp_count<ncomps; comp_count++) {
+        gr_cov = gr_covs + comp_count*MAT_SIZE;
+        gr_mn  = gr_mns  + comp_count*MAT_DIM;
+
+        if (!use_chol ||
+            lnoverlap_chol6_packed(gr_pcovs + comp_count*st_pdim2, gr_mn,
+                                   st_pcov, st_mn, &result) != 0) {
+          unpack_cov(st_pcov, MAT_DIM, st_cov);
+          result = lnoverlap_gsl(gr_cov, gr_mn, st_cov, st_mn, MAT_DIM,
+                                 BpA, bma, v_temp, p1);
+        }
+
+        // STORE RESULT in 'lnols_matrix'
+        lnols_matrix[star_count*lnols_dim2 + comp_count] = result;
+      }
+    }
+
+    // DEALLOCATE THE MEMORY
+    free(st_cov);
+    gsl_matrix_free(BpA);
+    gsl_vector_free(bma);
+    gsl_vector_free(v_temp);
+    gsl_permutation_free(p1);
+  }
+
+  free(gr_pcovs);
+}
+
+/* Function: set_lnoverlap_kernel
+ * ------------------------------
+ *   Selects the kernel used by `get_lnoverlaps` and `get_lnoverlaps_multi`:
+ *   0 for GSL's LU decomposition, 1 for the unrolled Cholesky
+ *   factorisation. Any other value is ignored.
+ */
+void set_lnoverlap_kernel(int kernel)
+{
+  if (kernel == KERNEL_GSL || kernel == KERNEL_CHOLESKY)
+    lnoverlap_kernel = kernel;
+}
+
+/* Function: get_lnoverlap_kernel
+ * ------------------------------
+ *   Returns the kernel currently in use, see `set_lnoverlap_kernel`.
+ */
+int get_lnoverlap_kernel(void)
+{
+  return lnoverlap_kernel;
+}
+
+/* Function: set_num_threads
+ * -------------------------
+ *   Sets the number of OpenMP threads used by the overlap star loops.
+ *   A value less than 1 uses every available processor. Does nothing
+ *   if the module was built without OpenMP.
+ */
+void set_num_threads(int nthreads)
+{
+#ifdef _OPENMP
+  if (nthreads < 1)
+    nthreads = omp_get_num_procs();
+  omp_set_num_threads(nthreads);
+#endif
+}
+
+/* Function: get_num_threads
+ * -------------------------
+ *   Returns the number of threads the overlap star loops will use,
+ *   which is always 1 if the module was built without OpenMP.
+ */
+int get_num_threads(void)
+{
+#ifdef _OPENMP
+  return omp_get_max_threads();
+#else
+  return 1;
+#endif
+}
+
+/* Function: openmp_enabled
+ * ------------------------
+ *   Returns 1 if the module was built with OpenMP, 0 otherwise.
+ */
+int openmp_enabled(void)
+{
+#ifdef _OPENMP
+  return 1;
+#else
+  return 0;
+#endif
 }
 
 /* NOTE:
@@ -14,6 +14,66 @@ void get_lnoverlaps(
   double* lnols_output, int n
   );
 
+/*
+ * Function: get_lnoverlaps_multi
+ * ------------------------------
+ * Get the log overlap between `n` 6D Gaussians (in `st_covs` and `st_mns`)
+ * with each of `ncomps` 6D Gaussians (in `gr_covs` and `gr_mns`), stored
+ * in the preallocated [n, ncomps] array `lnols_matrix`. Sets a Python
+ * ValueError if the arrays' dimensions don't agree
+ */
+void get_lnoverlaps_multi(
+  double* gr_covs, int gr_dim1, int gr_dim2, int gr_dim3,
+  double* gr_mns, int gr_mn_dim1, int gr_mn_dim2,
+  double* st_covs, int st_dim1, int st_dim2, int st_dim3,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_matrix, int lnols_dim1, int lnols_dim2
+  );
+
+/*
+ * Functions: get_lnoverlaps_packed, get_lnoverlaps_multi_packed
+ * -------------------------------------------------------------
+ * As above, but with each star's covariance matrix stored as its upper
+ * triangle only, row by row (21 elements for 6D)
+ */
+void get_lnoverlaps_packed(
+  double* gr_cov, int gr_dim1, int gr_dim2,
+  double* gr_mn, int gr_mn_dim,
+  double* st_pcovs, int st_pdim1, int st_pdim2,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_output, int n
+  );
+
+void get_lnoverlaps_multi_packed(
+  double* gr_covs, int gr_dim1, int gr_dim2, int gr_dim3,
+  double* gr_mns, int gr_mn_dim1, int gr_mn_dim2,
+  double* st_pcovs, int st_pdim1, int st_pdim2,
+  double* st_mns, int st_mn_dim1, int st_mn_dim2,
+  double* lnols_matrix, int lnols_dim1, int lnols_dim2
+  );
+
+/*
+ * Functions: set_lnoverlap_kernel, get_lnoverlap_kernel
+ * -----------------------------------------------------
+ * Select the kernel used for each star-component overlap above:
+ * 0 for GSL LU decomposition, 1 for the unrolled 6x6 Cholesky (default)
+ */
+void set_lnoverlap_kernel(int kernel);
+
+int get_lnoverlap_kernel(void);
+
+/*
+ * Functions: set_num_threads, get_num_threads, openmp_enabled
+ * -----------------------------------------------------------
+ * Control and inspect the OpenMP threading of the star loops above.
+ * Without OpenMP, the loops are serial and setting threads does nothing.
+ */
+void set_num_threads(int nthreads);
+
+int get_num_threads(void);
+
+int openmp_enabled(void);
+
 double get_overlap2(PyObject *gr_icov, PyObject *gr_mn, double gr_icov_det,
                     PyObject *st_icov, PyObject *st_mn, double st_icov_det);
 
@@ -25,14 +25,33 @@
 %apply (double* IN_ARRAY3, int DIM1, int DIM2, int DIM3) \
       {(double* npyArray3D, int npyLength1D, int npyLength2D, int npyLength3D),
        (double* st_icovs, int st_dim1, int st_dim2, int st_dim3),
-       (double* st_covs,  int st_dim1, int st_dim2, int st_dim3)}
+       (double* st_covs,  int st_dim1, int st_dim2, int st_dim3),
+       (double* gr_covs,  int gr_dim1, int gr_dim2, int gr_dim3)}
 
 %apply (double* IN_ARRAY2, int DIM1, int DIM2) \
       {(double* gr_icov, int gr_dim1, int gr_dim2),
        (double* gr_cov,  int gr_dim1, int gr_dim2),
        (double* st_icov, int st_dim1, int st_dim2),
        (double* st_cov, int st_dim1, int st_dim2),
-       (double* st_mns, int st_mn_dim1, int st_mn_dim2)}
+       (double* st_mns, int st_mn_dim1, int st_mn_dim2),
+       (double* st_pcovs, int st_pdim1, int st_pdim2),
+       (double* gr_mns, int gr_mn_dim1, int gr_mn_dim2)}
+
+/* output matrix must be preallocated by the caller as a
+ * C-contiguous float64 array of shape [nstars, ncomps] */
+%apply (double* INPLACE_ARRAY2, int DIM1, int DIM2) \
+      {(double* lnols_matrix, int lnols_dim1, int lnols_dim2)}
+
+/* the multi-component functions check their arrays' dimensions agree,
+ * setting a ValueError (and calculating nothing) if not */
+%exception get_lnoverlaps_multi {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
+%exception get_lnoverlaps_multi_packed {
+  $action
+  if (PyErr_Occurred()) SWIG_fail;
+}
 
 %apply (double* IN_ARRAY1, int DIM1) \
       {(double* gr_mn, int gr_mn_dim),
@@ -233,16 +233,31 @@ class SynthData():
         # if self.background_density is not None:
         #     self.generate_background_stars()
 
-    def project_stars(self, trace_orbit=traceorbit.trace_cartesian_orbit):
-        """Project stars from xyzuvw then to xyzuvw now based on their age"""
-        for star in self.table:
-            mean_then = self.extract_data_as_array(
-                table=star,
+    def project_stars(self, trace_orbit=traceorbit.trace_cartesian_orbit,
+                      pool=None):
+        """
+        Project stars from xyzuvw then to xyzuvw now based on their age
+
+        With the default `trace_orbit`, all stars of the same age are
+        traced together (see traceorbit.trace_many_cartesian_orbit),
+        optionally spread across `pool`. Any other trace function is
+        called star by star.
+        """
+        xyzuvw_then = self.extract_data_as_array(
                 colnames=[dim+'0' for dim in self.cart_labels],
+        ).reshape(-1, 6)
+        ages = np.array(self.table['age'])
+        if trace_orbit is traceorbit.trace_cartesian_orbit:
+            xyzuvw_now = traceorbit.trace_many_cartesian_orbit(
+                    xyzuvw_then, times=ages, single_age=True, pool=pool,
             )
-            xyzuvw_now = trace_orbit(mean_then, times=star['age'])
-            for ix, dim in enumerate(self.cart_labels):
-                star[dim+'_now'] = xyzuvw_now[ix]
+        else:
+            xyzuvw_now = np.array([
+                trace_orbit(mean_then, times=age)
+                for mean_then, age in zip(xyzuvw_then, ages)
+            ]).reshape(-1, 6)
+        for ix, dim in enumerate(self.cart_labels):
+            self.table[dim+'_now'] = xyzuvw_now[:, ix]
         # if self.background_density is not None:
         #     self.generate_background_stars()
 
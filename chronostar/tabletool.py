@@ -5,7 +5,13 @@ A bunch of functions that help handle stellar data stored as
 astropy table.
 """
 
+import hashlib
+import json
+import logging
 import numpy as np
+import os
+import shutil
+import tempfile
 from astropy.table import Table
 from astropy.units.core import UnitConversionError
 import string
@@ -98,12 +104,111 @@ def get_colnames(main_colnames=None, error_colnames=None, corr_colnames=None,
     return main_colnames, error_colnames, corr_colnames
 
 
+# Entries of a data dict stored in a cache (alongside the table indices)
+DATA_DICT_CACHE_KEYS = ('means', 'covs', 'packed_covs', 'bg_lnols')
+
+
+def _hash_file(filename, block_size=2**24):
+    """SHA1 of a file's contents, read a block at a time"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def get_data_dict_cache_dir(filename, options):
+    """
+    The directory in which the data dict built from table `filename` with
+    `options` (the column names etc. given to build_data_dict_from_table)
+    is cached. This lives alongside the table, in `filename`.datadict/
+    """
+    options_hash = hashlib.sha1(
+            json.dumps(options, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+    return os.path.join(filename + '.datadict', options_hash)
+
+
+def _load_data_dict_cache(cache_dir, filename):
+    """
+    Load a cached data dict (and table indices), if there is one for
+    the current contents of table `filename`, otherwise return None.
+
+    Arrays are memory mapped (copy on write).
+    """
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    try:
+        with open(manifest_file) as fp:
+            manifest = json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+    stat = os.stat(filename)
+    if (stat.st_size, stat.st_mtime_ns) !=\
+            (manifest['size'], manifest['mtime_ns']):
+        # Table may have been rewritten, or just copied or touched
+        if (stat.st_size != manifest['size']
+                or _hash_file(filename) != manifest['sha1']):
+            return None
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        try:
+            with open(manifest_file, 'w') as fp:
+                json.dump(manifest, fp)
+        except IOError:
+            pass
+
+    data_dict = {}
+    for key in manifest['keys']:
+        data_dict[key] = np.load(os.path.join(cache_dir, key + '.npy'),
+                                 mmap_mode='c')
+    table_ixs = np.load(os.path.join(cache_dir, 'table_ixs.npy'),
+                        mmap_mode='c')
+    logging.info('Loaded data dict of {} from cache {}'.format(filename,
+                                                               cache_dir))
+    return data_dict, (table_ixs,)
+
+
+def _save_data_dict_cache(cache_dir, filename, data_dict, table_ixs):
+    """
+    Store a data dict (and table indices) built from table `filename`
+    in `cache_dir`. Failing to (e.g. for a read only directory) is not
+    an error.
+    """
+    try:
+        cache_parent = os.path.dirname(cache_dir)
+        if not os.path.isdir(cache_parent):
+            os.makedirs(cache_parent)
+        # Build in a temporary directory then move into place, such that
+        # concurrent processes never see a partial cache
+        tmp_dir = tempfile.mkdtemp(dir=cache_parent)
+        keys = [key for key in DATA_DICT_CACHE_KEYS if key in data_dict]
+        for key in keys:
+            np.save(os.path.join(tmp_dir, key + '.npy'), data_dict[key])
+        np.save(os.path.join(tmp_dir, 'table_ixs.npy'), table_ixs[0])
+        stat = os.stat(filename)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as fp:
+            json.dump({'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns,
+                       'sha1':_hash_file(filename), 'keys':keys}, fp)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, cache_dir)
+        except OSError:
+            # Another process got there first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except (IOError, OSError) as err:
+        logging.warning('Could not cache data dict of {}: {}'.format(
+                filename, err))
+
+
 def build_data_dict_from_table(table, main_colnames=None, error_colnames=None,
                                corr_colnames=None, cartesian=True,
                                historical=False, only_means=False,
                                get_background_overlaps=True,
                                background_colname=None,
-                               return_table_ixs=False):
+                               return_table_ixs=False, use_cache=False,
+                               pack_covs=False):
     """
     Use data in tale columns to construct arrays of means and covariance
     matrices.
@@ -155,6 +260,18 @@ def build_data_dict_from_table(table, main_colnames=None, error_colnames=None,
 
         where `final_memb` is a [nstars, ncomps] array recording membership
         probabilities.
+    use_cache: boolean {False}
+        If set, and `table` is a path, the data dict is stored as .npy
+        files alongside the table (see `get_data_dict_cache_dir`) and
+        loaded from there (memory mapped) by any later call with the same
+        arguments, as long as the table's contents are unchanged.
+    pack_covs: boolean {False}
+        If set, the covariance matrices are stored as 'packed_covs', an
+        [n,21] array of the upper triangle of each (see
+        transform.pack_covmatrices), in place of 'covs'. This uses 40%
+        less memory, and is understood by likelihood.get_lnoverlaps
+        etc. Full matrices can be recovered with
+        transform.unpack_covmatrices.
 
     Returns
     -------
@@ -165,6 +282,29 @@ def build_data_dict_from_table(table, main_colnames=None, error_colnames=None,
     Comment by Marusa: it is actually a dictionary that is returned.
     """
     # Tidy up input
+    if use_cache and isinstance(table, str) and not only_means:
+        cache_dir = get_data_dict_cache_dir(
+                os.path.abspath(table),
+                [main_colnames, error_colnames, corr_colnames, cartesian,
+                 historical, get_background_overlaps, background_colname,
+                 pack_covs],
+        )
+        cached = _load_data_dict_cache(cache_dir, table)
+        if cached is None:
+            cached = build_data_dict_from_table(
+                    table, main_colnames=main_colnames,
+                    error_colnames=error_colnames,
+                    corr_colnames=corr_colnames, cartesian=cartesian,
+                    historical=historical,
+                    get_background_overlaps=get_background_overlaps,
+                    background_colname=background_colname,
+                    return_table_ixs=True, pack_covs=pack_covs,
+            )
+            _save_data_dict_cache(cache_dir, table, *cached)
+        if return_table_ixs:
+            return cached
+        return cached[0]
+
     if isinstance(table, str):
         table = Table.read(table)
     if historical:
@@ -211,41 +351,59 @@ def build_data_dict_from_table(table, main_colnames=None, error_colnames=None,
                 # Units haven't been provided. Which is allowed but discouraged
                 pass
 
-    # Initialise an array of 6x6 identity matrices
-    covs = np.array(nstars * [np.eye(6)])
-
-    # Then turn into correlation matrices by incorporating correlation columns
-    indices = np.triu_indices(6,1)      # the indices of the upper right
-                                        # triangle, excluding main diagonal
-    for ix in range(len(corr_colnames)):
-        try:
-            fst_ix = indices[0][ix]
-            snd_ix = indices[1][ix]
-            covs[:, fst_ix, snd_ix] = table[corr_colnames[ix]]
-            covs[:, snd_ix, fst_ix] = table[corr_colnames[ix]]
-        except KeyError:        # Correlations are allowed to be missing
-            pass
+    if pack_covs:
+        # Build the upper triangles directly, never holding full matrices
+        covs_key = 'packed_covs'
+        covs = np.zeros((nstars, 21))
+        corr_indices = list(zip(*np.triu_indices(6,1)))
+        for ix, (fst_ix, snd_ix) in enumerate(zip(*np.triu_indices(6))):
+            if fst_ix == snd_ix:
+                covs[:, ix] = standard_devs[:, fst_ix]**2
+                continue
+            try:
+                corr_colname = corr_colnames[corr_indices.index((fst_ix,
+                                                                 snd_ix))]
+                covs[:, ix] = table[corr_colname] * standard_devs[:, fst_ix]\
+                              * standard_devs[:, snd_ix]
+            except (IndexError, KeyError):  # Correlations are allowed to
+                pass                        # be missing
+    else:
+        covs_key = 'covs'
+        # Initialise an array of 6x6 identity matrices
+        covs = np.array(nstars * [np.eye(6)])
+
+        # Then turn into correlation matrices by incorporating correlation
+        # columns
+        indices = np.triu_indices(6,1)      # the indices of the upper right
+                                            # triangle, excluding main diagonal
+        for ix in range(len(corr_colnames)):
+            try:
+                fst_ix = indices[0][ix]
+                snd_ix = indices[1][ix]
+                covs[:, fst_ix, snd_ix] = table[corr_colnames[ix]]
+                covs[:, snd_ix, fst_ix] = table[corr_colnames[ix]]
+            except KeyError:        # Correlations are allowed to be missing
+                pass
 
-    # Now multiply through the standard deviations along both axes
-    # First along each column
-    # We use einstein notation here such that 'ijk,ij->ijk' means
-    # multiply the 'ijk'th element from covs by the 'ij'th element from
-    # standard_devs. More thoroughly: for the i'th covariance matrix,
-    # and the i'th 6D standard deviation vector, multiply the j'th row
-    # by the j'th std
-    covs = np.einsum('ijk,ij->ijk', covs, standard_devs)    # the rows
-    covs = np.einsum('ijk,ik->ijk', covs, standard_devs)    # the columsn
-    results_dict['covs'] = covs
+        # Now multiply through the standard deviations along both axes
+        # First along each column
+        # We use einstein notation here such that 'ijk,ij->ijk' means
+        # multiply the 'ijk'th element from covs by the 'ij'th element from
+        # standard_devs. More thoroughly: for the i'th covariance matrix,
+        # and the i'th 6D standard deviation vector, multiply the j'th row
+        # by the j'th std
+        covs = np.einsum('ijk,ij->ijk', covs, standard_devs)    # the rows
+        covs = np.einsum('ijk,ik->ijk', covs, standard_devs)    # the columsn
 
     # Checks for any nans in the means or covariances
     bad_mean_mask = np.any(np.isnan(means), axis=1)
-    bad_cov_mask = np.any(np.isnan(covs), axis=(1,2))
+    bad_cov_mask = np.any(np.isnan(covs.reshape(nstars, -1)), axis=1)
 
     good_row_mask = np.logical_not(np.logical_or(bad_mean_mask, bad_cov_mask))
 
     results_dict = {
         'means':means[good_row_mask],
-        'covs':covs[good_row_mask],
+        covs_key:covs[good_row_mask],
     }
 
     # Insert background overlaps
@@ -389,6 +547,43 @@ def convert_astro2cart(astr_mean, astr_cov):
     return xyzuvw_mean, xyzuvw_cov
 
 
+def convert_many_astro2cart(astr_means, astr_covs):
+    """
+    Convert the astrometry data (means and covariances) of many stars
+    into cartesian coordinates, centred on the local standard of rest
+    (Schoenrich 2010), all at once.
+
+    Equivalent to calling `convert_astro2cart` on each star, but
+    covariance matrices are transformed with the analytic Jacobian of
+    the conversion (coordinate.calc_astrometry2lsrxyzuvw_jacobian) rather
+    than with finite differences.
+
+    Parameters
+    ----------
+    astr_means: [nstars,6] float array_like
+        The central estimates of the stars' astrometry values, in the
+        order of `convert_astro2cart`
+    astr_covs: [nstars,6,6] float array_like
+        The covariance matrices of the measurements
+
+    Returns
+    -------
+    xyzuvw_means: [nstars,6] float array
+        The cartesian means (XYZUVW)
+    xyzuvw_covs: [nstars,6,6] float array
+        The cartesian covariance matrices
+    """
+    astr_means = np.array(astr_means, dtype=np.float64).reshape(-1, 6)
+    astr_covs = np.array(astr_covs, dtype=np.float64).reshape(-1, 6, 6)
+
+    xyzuvw_means = coordinate.convert_many_astrometry2lsrxyzuvw(astr_means)
+    jacs = coordinate.calc_astrometry2lsrxyzuvw_jacobian(astr_means)
+    xyzuvw_covs = np.einsum('nij,njk,nlk->nil', jacs, astr_covs, jacs,
+                            optimize=True)
+
+    return xyzuvw_means, xyzuvw_covs
+
+
 def insert_data_into_row(row, mean, cov, main_colnames=None, error_colnames=None,
                          corr_colnames=None, cartesian=True):
     """
@@ -438,6 +633,58 @@ def insert_data_into_row(row, mean, cov, main_colnames=None, error_colnames=None
             pass
 
 
+def insert_data_into_columns(table, means, covs, main_colnames=None,
+                             error_colnames=None, corr_colnames=None,
+                             cartesian=True, row_ixs=None):
+    """
+    Insert data, errors and correlations into many rows at once
+
+    The column-wise equivalent of `insert_data_into_row`.
+
+    The columns must already exist!
+
+    Parameters
+    table: astropy table
+        The table in which the data will be inserted, with required
+        columns already existing
+    means: [nrows,6] float array
+        The means of data
+    covs: [nrows,6,6] float array
+        The covariance matrices of data
+    row_ixs: [nrows] int array {None}
+        The table rows corresponding to each mean, e.g. from
+        `build_data_dict_from_table` with `return_table_ixs` set. By
+        default, every row of the table.
+    """
+    main_colnames, error_colnames, corr_colnames = get_colnames(
+            main_colnames, error_colnames, corr_colnames, cartesian=cartesian
+    )
+    if row_ixs is None:
+        row_ixs = slice(None)
+
+    # Insert mean data
+    for ix, main_colname in enumerate(main_colnames):
+        table[main_colname][row_ixs] = means[:, ix]
+
+    # Insert errors
+    standard_devs = np.sqrt(np.diagonal(covs, axis1=1, axis2=2))
+    for ix, error_colname in enumerate(error_colnames):
+        table[error_colname][row_ixs] = standard_devs[:, ix]
+
+    # Build correlation matrices by dividing through by stdevs in both axes
+    corr_matrices = covs / standard_devs[:, np.newaxis, :]\
+                    / standard_devs[:, :, np.newaxis]
+
+    # Insert correlations
+    indices = np.triu_indices(6,1)      # the indices of the upper right
+                                        # triangle, excluding main diagonal
+    for ix, corr_colname in enumerate(corr_colnames):
+        # It's fine if some correlation columns are missing
+        if corr_colname in table.colnames:
+            table[corr_colname][row_ixs] = corr_matrices[:, indices[0][ix],
+                                                         indices[1][ix]]
+
+
 def insert_column(table, col_data, col_name, filename=''):
     """
     Little helper to insert column data
@@ -476,7 +723,7 @@ def convert_table_astro2cart(table, return_table=False, write_table=False,
                              cart_main_colnames=None,
                              cart_error_colnames=None,
                              cart_corr_colnames=None,
-                             filename=''):
+                             filename='', bulk=True):
     """
     Use this function to convert astrometry data to cartesian data.
 
@@ -521,6 +768,11 @@ def convert_table_astro2cart(table, return_table=False, write_table=False,
               'parallax_pmra_corr' ... etc]
     filename: str {''}
         Save filename for storing the resulting table
+    bulk: bool {True}
+        Convert every star at once (see `convert_many_astro2cart`) and
+        write whole columns, leaving rows with missing data as nan. If
+        False, rows are converted one at a time, with finite difference
+        Jacobians.
 
     Returns
     -------
@@ -542,10 +794,11 @@ def convert_table_astro2cart(table, return_table=False, write_table=False,
                      corr_colnames=astr_corr_colnames,
                      cartesian=False)
 
-    data = build_data_dict_from_table(table,
-                                      astr_main_colnames,
-                                      astr_error_colnames,
-                                      astr_corr_colnames)
+    data, table_ixs = build_data_dict_from_table(table,
+                                                 astr_main_colnames,
+                                                 astr_error_colnames,
+                                                 astr_corr_colnames,
+                                                 return_table_ixs=True)
 
     # Establish what column names are used
     cart_main_colnames, cart_error_colnames, cart_corr_colnames = \
@@ -561,14 +814,25 @@ def convert_table_astro2cart(table, return_table=False, write_table=False,
                                   cart_error_colnames,
                                   cart_corr_colnames)
 
-    # Iteratively transform data to cartesian coordinates, storing as we go
-    for row, astr_mean, astr_cov in zip(table, data['means'], data['covs']):
-        cart_mean, cart_cov = convert_astro2cart(astr_mean, astr_cov)
-        insert_data_into_row(row, cart_mean, cart_cov,
-                             main_colnames=cart_main_colnames,
-                             error_colnames=cart_error_colnames,
-                             corr_colnames=cart_corr_colnames
-                             )
+    if bulk:
+        cart_means, cart_covs = convert_many_astro2cart(data['means'],
+                                                        data['covs'])
+        insert_data_into_columns(table, cart_means, cart_covs,
+                                 main_colnames=cart_main_colnames,
+                                 error_colnames=cart_error_colnames,
+                                 corr_colnames=cart_corr_colnames,
+                                 row_ixs=table_ixs[0])
+    else:
+        # Iteratively transform data to cartesian coordinates, storing as
+        # we go
+        for row, astr_mean, astr_cov in zip(table, data['means'],
+                                            data['covs']):
+            cart_mean, cart_cov = convert_astro2cart(astr_mean, astr_cov)
+            insert_data_into_row(row, cart_mean, cart_cov,
+                                 main_colnames=cart_main_colnames,
+                                 error_colnames=cart_error_colnames,
+                                 corr_colnames=cart_corr_colnames
+                                 )
 
     # Save data
     if filename and write_table:
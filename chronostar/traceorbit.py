@@ -5,12 +5,15 @@ A module aimed at projecting an orbit forward or backward through time.
 Operates in a co-rotating, RH cartesian coordinate system centred on the
 local standard of rest.
 """
+import functools
 import logging
 import numpy as np
 
 # from astropy.io import fits
 from galpy.orbit import Orbit
 from galpy.potential import MWPotential2014 #, MiyamotoNagaiPotential
+from galpy.potential import evaluateRforces, evaluateR2derivs,\
+    evaluatez2derivs, evaluateRzderivs
 from galpy.util import bovy_conversion
 
 mp = MWPotential2014
@@ -457,6 +460,176 @@ def trace_epicyclic_orbit(xyzuvw_start, times=None, sA=0.89, sB=1.15, sR=1.21, s
         return xyzuvw_new[-1]
     return xyzuvw_new
 
+def _epicyclic_frequencies(sA=0.89, sB=1.15, sR=1.21):
+    """
+    The Oort constants A and B, and the epicyclic and vertical
+    frequencies kappa and nu [Myr-1] used by `epicyclic_approx`
+    """
+    A = 15.3 * sA * 0.0010227121650537077  # Myr-1
+    B = -11.9 * sB * 0.0010227121650537077  # Myr-1
+    Grho = sR * 0.0889 * 0.004498502151575285  # Myr-2
+    kappa = np.sqrt(-4.0 * B * (A - B))
+    nu = np.sqrt(4.0 * np.pi * Grho + (A + B) * (A - B))
+    return A, B, kappa, nu
+
+
+def epicyclic_matrix(time, sA=0.89, sB=1.15, sR=1.21):
+    """
+    The linear map of `epicyclic_approx`, such that for curvilinear
+    coordinates (velocities in pc/Myr) `data`,
+    epicyclic_approx(data, time) == np.dot(epicyclic_matrix(time), data)
+
+    Parameters
+    ----------
+    time : float
+        Myr
+    sA, sB, sR : float
+        Scale factors, see `epicyclic_approx`
+
+    Returns
+    -------
+    matrix : [6,6] float array
+    """
+    A, B, kappa, nu = _epicyclic_frequencies(sA=sA, sB=sB, sR=sR)
+    kt = kappa*time
+    nt = nu*time
+    skt, ckt = np.sin(kt), np.cos(kt)
+    snt, cnt = np.sin(nt), np.cos(nt)
+
+    matrix = np.zeros((6,6))
+    # xi
+    matrix[0] = [1.0 - A*(1.0-ckt)/B, 0., 0.,
+                 skt/kappa, (1.0-ckt)/(2.0*B), 0.]
+    # eta
+    matrix[1] = [-2.0*A*(A-B)*(kt-skt)/(kappa*B), 1., 0.,
+                 -(1.0-ckt)/(2.0*B), (A*kt - (A-B)*skt)/(kappa*B), 0.]
+    # zeta
+    matrix[2] = [0., 0., cnt, 0., 0., snt/nu]
+    # xidot
+    matrix[3] = [-A*kappa*skt/B, 0., 0.,
+                 ckt, kappa*skt/(2.0*B), 0.]
+    # etadot
+    matrix[4] = [-2.0*A*(A-B)*(1.0-ckt)/B, 0., 0.,
+                 -kappa*skt/(2.0*B), (A-(A-B)*ckt)/B, 0.]
+    # zetadot
+    matrix[5] = [0., 0., -nu*snt, 0., 0., cnt]
+    return matrix
+
+
+def calc_cart2curvilin_jacobian(xyzuvw, ro=8., vo=220.):
+    """
+    Analytic Jacobian of `convert_cart2curvilin` evaluated at a single
+    point `xyzuvw`
+
+    Returns
+    -------
+    jac : [6,6] float array
+    """
+    X, Y, Z, U, V, W = xyzuvw
+    R0 = ro*1000.0
+    Omega0 = vo/R0
+    Ur = U - Y*Omega0
+    Vr = V + X*Omega0
+
+    R = np.sqrt(Y**2 + (R0-X)**2)
+    phi = np.arctan2(Y, R0-X)
+    s, c = np.sin(phi), np.cos(phi)
+    dphi_dX = Y/R**2
+    dphi_dY = (R0-X)/R**2
+
+    # derivatives of xidot and (etadot*R/R0) w.r.t. phi
+    dxidot_dphi = -Ur*s - Vr*c
+    q = Vr*c + Ur*s
+    dq_dphi = Ur*c - Vr*s
+
+    jac = np.zeros((6,6))
+    jac[0,:2] = [(R0-X)/R, -Y/R]
+    jac[1,:2] = [R0*dphi_dX, R0*dphi_dY]
+    jac[2,2] = 1.
+    jac[3] = [-Omega0*s + dxidot_dphi*dphi_dX,
+              -Omega0*c + dxidot_dphi*dphi_dY,
+              0., c, -s, 0.]
+    jac[4] = [R0*(R0-X)*q/R**3 + R0/R*(Omega0*c + dq_dphi*dphi_dX),
+              -R0*Y*q/R**3 + R0/R*(-Omega0*s + dq_dphi*dphi_dY),
+              0., R0/R*s, R0/R*c, 0.]
+    jac[5,5] = 1.
+    return jac
+
+
+def calc_curvilin2cart_jacobian(curvilin, ro=8., vo=220.):
+    """
+    Analytic Jacobian of `convert_curvilin2cart` evaluated at a single
+    point `curvilin`
+
+    Returns
+    -------
+    jac : [6,6] float array
+    """
+    xi, eta, zeta, xidot, etadot, zetadot = curvilin
+    R0 = ro*1000.0
+    Omega0 = vo/R0
+    R = R0 - xi
+    phi = eta/R0
+    s, c = np.sin(phi), np.cos(phi)
+
+    jac = np.zeros((6,6))
+    jac[0,:2] = [c, R*s/R0]
+    jac[1,:2] = [-s, R*c/R0]
+    jac[2,2] = 1.
+    jac[3] = [-etadot*s/R0 - Omega0*s,
+              (-xidot*s + R/R0*etadot*c)/R0 + Omega0*R*c/R0,
+              0., c, R*s/R0, 0.]
+    jac[4] = [-etadot*c/R0 - Omega0*c,
+              (-xidot*c - R/R0*etadot*s)/R0 - Omega0*R*s/R0,
+              0., -s, R*c/R0, 0.]
+    jac[5,5] = 1.
+    return jac
+
+
+def calc_epicyclic_jacobian(xyzuvw_start, times=None, sA=0.89, sB=1.15,
+                            sR=1.21, ro=8., vo=220.):
+    """
+    Project a point with `trace_epicyclic_orbit` and calculate the exact
+    Jacobian of that projection.
+
+    The epicyclic model is linear in the curvilinear frame, so the
+    Jacobian is the product of the (analytic) Jacobians of the frame
+    conversions and the epicyclic propagator matrix, avoiding the finite
+    differences of transform.calc_jacobian.
+
+    Parameters
+    ----------
+    xyzuvw_start : [6] float array
+        [pc,pc,pc,km/s,km/s,km/s]
+    times : float
+        Myr - the age to trace to
+    sA, sB, sR, ro, vo :
+        See `trace_epicyclic_orbit`
+
+    Returns
+    -------
+    xyzuvw_now : [6] float array
+        Equivalent to trace_epicyclic_orbit(xyzuvw_start, times)
+    jac : [6,6] float array
+        Jacobian of the projection, evaluated at `xyzuvw_start`
+    """
+    # Velocities are handled in pc/Myr
+    vel_scale = np.array([1., 1., 1.] + 3*[1.0227121650537077])
+    xyzuvw_start = np.array(xyzuvw_start, dtype=np.float64) * vel_scale
+
+    curvilin = convert_cart2curvilin(xyzuvw_start, ro=ro, vo=vo)
+    propagator = epicyclic_matrix(times, sA=sA, sB=sB, sR=sR)
+    new_curvilin = np.dot(propagator, curvilin)
+    xyzuvw_now = convert_curvilin2cart(new_curvilin, ro=ro, vo=vo) / vel_scale
+
+    jac = np.dot(calc_curvilin2cart_jacobian(new_curvilin, ro=ro, vo=vo),
+                 np.dot(propagator,
+                        calc_cart2curvilin_jacobian(xyzuvw_start,
+                                                    ro=ro, vo=vo)))
+    jac = jac * vel_scale / vel_scale[:,np.newaxis]
+    return xyzuvw_now, jac
+
+
 def trace_galpy_orbit(galpy_start, times=None, single_age=True,
                       potential=MWPotential2014, ro=8, vo=220.,
                       method='dopr54_c'):
@@ -593,26 +766,291 @@ def trace_cartesian_orbit(xyzuvw_start, times=None, single_age=True,
     return xyzuvw
 
 
-def trace_many_cartesian_orbit(xyzuvw_starts, times=None, single_age=True,
-                               savefile=''):
+def trace_cartesian_orbit_batch(xyzuvw_starts, times=None,
+                                potential=MWPotential2014, ro=8., vo=220.,
+                                method='dopr54_c'):
     """
-    (This function is not used by Chronostar (yet). It is currently here
-    purely for testing reasons.)
+    Project many starting points forward (or backward) by the same age,
+    integrating them all in a single (multi-orbit) galpy Orbit.
 
-    Given a star's XYZUVW relative to the LSR (at any time), project its
-    orbit forward (or backward) to each of the times listed in *times*
+    Equivalent to calling trace_cartesian_orbit with `single_age=True`
+    on each row of `xyzuvw_starts`, but the orbit setup and integration
+    overheads are only paid once.
+
+    Points may instead each have their own age (e.g. the emcee walkers of
+    a fit, see AbstractComponent.project_many_to_now). Points are then
+    integrated together with all others of the same age. galpy's
+    integrators output on one evenly spaced time grid shared by every
+    orbit, so points of different ages can't share an integration.
+
+    Parameters
+    ----------
+    xyzuvw_starts : [npoints, 6] float array
+        [pc,pc,pc,km/s,km/s,km/s]
+    times : float or [npoints] float array
+        Myr - the age to trace to. Positive --> traceforward,
+        negative --> traceback
+    potential, ro, vo, method :
+        See trace_cartesian_orbit
+
+    Returns
+    -------
+    xyzuvw_tf : [npoints, 6] array
+        [pc, pc, pc, km/s, km/s, km/s] - the final positions and velocities
+    """
+    xyzuvw_starts = np.array(xyzuvw_starts, dtype=np.float64).reshape(-1, 6)
+    if np.ndim(times) > 0:
+        ages = np.broadcast_to(np.array(times, dtype=np.float64),
+                               (len(xyzuvw_starts),))
+        xyzuvw = np.zeros(xyzuvw_starts.shape)
+        for age in np.unique(ages):
+            mask = ages == age
+            xyzuvw[mask] = trace_cartesian_orbit_batch(
+                    xyzuvw_starts[mask], age, potential=potential,
+                    ro=ro, vo=vo, method=method,
+            )
+        return xyzuvw
+
+    # replace 0 with some tiny number
+    if times == 0.:
+        times = 1e-15
+    bovy_times = convert_myr2bovytime(np.array([0., times]))
+
+    galpy_coords = convert_cart2galpycoords(xyzuvw_starts, ts=0.,
+                                            ro=ro, vo=vo).reshape(-1, 6)
+    o = Orbit(vxvv=galpy_coords, ro=ro, vo=vo)
+    o.integrate(bovy_times, potential, method=method)
+
+    # getOrbit gives [npoints, ntimes, 6], we only need the final time
+    galpy_final = o.getOrbit()[:,-1].reshape(-1, 6)
+    xyzuvw = convert_galpycoords2cart(galpy_final, bovy_times[-1],
+                                      ro=ro, vo=vo)
+    return xyzuvw.reshape(-1, 6)
+
+
+def _calc_cartesian_hessians(potential, R, z, phi):
+    """
+    Hessians of an axisymmetric galpy potential in galactocentric
+    cartesian coordinates (galpy natural units) at each of the points
+    given in cylindrical coordinates.
+
+    Returns
+    -------
+    hessians : [npoints, 3, 3] float array
+    """
+    pot_R = -evaluateRforces(potential, R, z, use_physical=False)
+    pot_RR = evaluateR2derivs(potential, R, z, use_physical=False)
+    pot_zz = evaluatez2derivs(potential, R, z, use_physical=False)
+    pot_Rz = evaluateRzderivs(potential, R, z, use_physical=False)
+    c, s = np.cos(phi), np.sin(phi)
+
+    hessians = np.empty((len(R), 3, 3))
+    hessians[:,0,0] = pot_RR*c*c + pot_R*s*s/R
+    hessians[:,1,1] = pot_RR*s*s + pot_R*c*c/R
+    hessians[:,0,1] = hessians[:,1,0] = (pot_RR - pot_R/R)*c*s
+    hessians[:,0,2] = hessians[:,2,0] = pot_Rz*c
+    hessians[:,1,2] = hessians[:,2,1] = pot_Rz*s
+    hessians[:,2,2] = pot_zz
+    return hessians
+
+
+def trace_cartesian_orbit_tangent(xyzuvw_start, times=None,
+                                  potential=MWPotential2014, ro=8., vo=220.,
+                                  method='dop853_c', max_step=0.02):
+    """
+    Project a star's XYZUVW to a single age, along with the Jacobian of
+    that projection (the state transition matrix of the orbit).
+
+    The orbit is integrated once, and the 6x6 variational equations,
+        d(Phi)/dt = [[0, I], [-H(t), 0]] Phi
+    with H the Hessian of the potential along the orbit, are propagated
+    along it. Unlike transform.calc_jacobian this needs no extra orbits,
+    and is not subject to the finite difference step size.
+
+    Can be used as a Component's `trace_orbit_func` (or
+    `trace_jacobian_func`), see AbstractComponent.
+
+    Parameters
+    ----------
+    xyzuvw_start : [6] float array
+        [pc,pc,pc,km/s,km/s,km/s]
+    times : float
+        Myr - the age to trace to. Positive --> traceforward,
+        negative --> traceback
+    potential : galpy potential {MWPotential2014}
+        Must be axisymmetric
+    ro, vo, method :
+        See trace_cartesian_orbit
+    max_step : float {0.02}
+        Maximum step (in galpy time units, ~0.7 Myr) used to propagate the
+        variational equations (with RK4). The default gives a relative
+        accuracy of ~1e-8.
+
+    Returns
+    -------
+    xyzuvw_now : [6] float array
+        [pc, pc, pc, km/s, km/s, km/s] - the projected position and velocity
+    jac : [6,6] float array
+        Jacobian of the projection, evaluated at `xyzuvw_start`
+    """
+    # replace 0 with some tiny number
+    if times == 0.:
+        times = 1e-15
+    bovy_age = convert_myr2bovytime(times)
+    nsteps = max(int(np.ceil(abs(bovy_age) / max_step)), 1)
+    # Each RK4 step also needs the orbit at its midpoint
+    bovy_times = np.linspace(0., bovy_age, 2*nsteps + 1)
+
+    galpy_coords = convert_cart2galpycoords(
+            np.array(xyzuvw_start, dtype=np.float64), ts=0., ro=ro, vo=vo,
+    )
+    o = Orbit(vxvv=galpy_coords, ro=ro, vo=vo)
+    o.integrate(bovy_times, potential, method=method)
+    galpy_orbit = o.getOrbit()
+    xyzuvw_now = convert_galpycoords2cart(galpy_orbit[-1], bovy_age,
+                                          ro=ro, vo=vo)
+
+    # Linearised equations of motion in galactocentric cartesian coords
+    hessians = _calc_cartesian_hessians(potential, galpy_orbit[:,0],
+                                        galpy_orbit[:,3], galpy_orbit[:,5])
+    lin_eqs = np.zeros((len(bovy_times), 6, 6))
+    lin_eqs[:,:3,3:] = np.identity(3)
+    lin_eqs[:,3:,:3] = -hessians
+
+    step = bovy_times[2] - bovy_times[0]
+    state_trans = np.identity(6)
+    for i in range(nsteps):
+        a_start, a_mid, a_end = lin_eqs[2*i:2*i+3]
+        k1 = np.dot(a_start, state_trans)
+        k2 = np.dot(a_mid, state_trans + 0.5*step*k1)
+        k3 = np.dot(a_mid, state_trans + 0.5*step*k2)
+        k4 = np.dot(a_end, state_trans + step*k3)
+        state_trans = state_trans + step/6.*(k1 + 2*k2 + 2*k3 + k4)
+
+    # At fixed times, the conversions between chronostar coordinates and
+    # galactocentric cartesian coordinates are affine (see
+    # convert_cart2galpycoords and convert_galpycoords2cart), the outgoing
+    # one rotating by the LSR's azimuthal travel
+    scale = np.array([-1000*ro, 1000*ro, 1000*ro, -vo, vo, vo])
+    c, s = np.cos(bovy_age), np.sin(bovy_age)
+    rotation = np.array([[ c, s, 0.],
+                         [-s, c, 0.],
+                         [0., 0., 1.]])
+    out_map = np.zeros((6,6))
+    out_map[:3,:3] = out_map[3:,3:] = rotation
+    out_map = scale[:,np.newaxis] * out_map
+
+    jac = np.dot(out_map, state_trans) / scale
+    return xyzuvw_now, jac
+
+# Flags trace_cartesian_orbit_tangent as returning (xyzuvw_now, jac), such
+# that a Component given it as `trace_orbit_func` uses it as such
+trace_cartesian_orbit_tangent.returns_jacobian = True
+
+
+def drop_jacobian(trace_jacobian_func, xyzuvw_start, times=None):
+    """
+    Use a function returning (xyzuvw_now, jac) as a plain trace function.
+    See MeanOnlyTrace for a wrapper usable as a Component's
+    `trace_orbit_func`.
+    """
+    return trace_jacobian_func(xyzuvw_start, times)[0]
+
+
+class MeanOnlyTrace(object):
+    """
+    A plain trace function, `func(xyzuvw_start, times) -> xyzuvw_now`,
+    from a function returning (xyzuvw_now, jac), e.g.
+    MeanOnlyTrace(trace_cartesian_orbit_tangent)
+
+    Wrappers of the same function compare (and hash) equal, also once
+    pickled, such that components tracing with them share cache entries
+    (e.g. in likelihood.OverlapCache).
+    """
+    def __init__(self, trace_jacobian_func):
+        self.trace_jacobian_func = trace_jacobian_func
+
+    def __call__(self, xyzuvw_start, times=None):
+        return drop_jacobian(self.trace_jacobian_func, xyzuvw_start, times)
+
+    def __eq__(self, other):
+        return isinstance(other, MeanOnlyTrace) \
+               and self.trace_jacobian_func == other.trace_jacobian_func
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((MeanOnlyTrace, self.trace_jacobian_func))
+
+
+def _trace_orbit_chunk(task, potential=MWPotential2014, ro=8., vo=220.,
+                       method='dopr54_c'):
+    """
+    Trace one chunk of stars for trace_many_cartesian_orbit, with `task`
+    being (xyzuvw_starts, times, single_age). Defined at module level so
+    it can be sent to a pool.
+    """
+    xyzuvw_starts, times, single_age = task
+    if single_age:
+        return trace_cartesian_orbit_batch(xyzuvw_starts, times,
+                                           potential=potential, ro=ro, vo=vo,
+                                           method=method)
+
+    bovy_times = convert_myr2bovytime(times)
+    galpy_coords = convert_cart2galpycoords(xyzuvw_starts, ts=0.,
+                                            ro=ro, vo=vo).reshape(-1, 6)
+    o = Orbit(vxvv=galpy_coords, ro=ro, vo=vo)
+    o.integrate(bovy_times, potential, method=method)
+
+    # getOrbit gives [nstars, ntimes, 6], flatten so each row can be
+    # converted with the time it is at
+    galpy_orbits = o.getOrbit()
+    nstars, ntimes = galpy_orbits.shape[:2]
+    xyzuvw = convert_galpycoords2cart(galpy_orbits.reshape(-1, 6),
+                                      np.tile(bovy_times, nstars),
+                                      ro=ro, vo=vo)
+    return xyzuvw.reshape(nstars, ntimes, 6)
+
+
+def trace_many_cartesian_orbit(xyzuvw_starts, times=None, single_age=True,
+                               savefile='', potential=MWPotential2014,
+                               ro=8., vo=220., method='dopr54_c',
+                               pool=None, chunk_size=10000):
+    """
+    Given many stars' XYZUVW relative to the LSR (at any time), project
+    their orbits forward (or backward) to each of the times listed in
+    *times*, or with `single_age` set, to each star's age.
 
     Positive times --> traceforward
     Negative times --> traceback
 
+    Rather than integrating each star on its own, stars are integrated
+    together as multi-orbit galpy Orbits, one per distinct age (and per
+    `chunk_size` stars). This is fastest when many stars share an age,
+    e.g. the members of a synthetic association.
+
     Parameters
     ----------
     xyzuvw_starts : [nstars, 6] array (pc,pc,pc,km/s,km/s,km/s)
-    times : [ntimes] float array
-        Myr - time of 0.0 must be present in the array. Times need not be
-        spread linearly.
-    single_age : (Boolean {False})
-        If set to true, times must be given a single non-zero float
+    times : float, [nstars] float array or [ntimes] float array
+        Myr - If `single_age` is set, the age to trace each star to,
+        either one for all stars or one per star. Otherwise the times to
+        trace all stars to, where a time of 0.0 must be present in the
+        array. Times need not be spread linearly.
+    single_age : (Boolean {True})
+        If set, times is an age (or ages) rather than an array of times
+    savefile : str {''}
+        If given, the result is also saved to this .npy file
+    potential, ro, vo, method :
+        See trace_cartesian_orbit
+    pool : {None}
+        Any object with a `map` method (e.g. multiprocessing.Pool or an
+        MPIPool) across which to spread the chunks. Note galpy already
+        integrates the orbits of a multi-orbit Orbit in parallel with
+        OpenMP, so this is mostly useful across nodes.
+    chunk_size : int {10000}
+        Maximum number of stars integrated in a single Orbit
 
     Returns
     -------
@@ -621,42 +1059,114 @@ def trace_many_cartesian_orbit(xyzuvw_starts, times=None, single_age=True,
         and velocities
         If single_age is set, output is [nstars, 6] array
     """
-    if single_age:
-        ntimes = 1
-    else:
-        times = np.array(times)
-        ntimes = times.shape[0]
-
+    xyzuvw_starts = np.array(xyzuvw_starts, dtype=np.float64).reshape(-1, 6)
     nstars = xyzuvw_starts.shape[0]
     logging.debug("Nstars: {}".format(nstars))
 
     if single_age:
+        ages = np.broadcast_to(np.array(times, dtype=np.float64), (nstars,))
+        group_times, age_ixs, age_counts = np.unique(
+                ages, return_inverse=True, return_counts=True,
+        )
+        star_ixs_by_age = np.argsort(age_ixs, kind='stable')
+        groups = np.split(star_ixs_by_age, np.cumsum(age_counts)[:-1])
         xyzuvw_to = np.zeros((nstars, 6))
     else:
-        xyzuvw_to = np.zeros((nstars, ntimes, 6))
-    for st_ix in range(nstars):
-        xyzuvw_to[st_ix] = trace_cartesian_orbit(xyzuvw_starts[st_ix], times,
-                                                 single_age=single_age)
-    #TODO: test this
+        times = np.array(times, dtype=np.float64)
+        group_times = [times]
+        groups = [np.arange(nstars)]
+        xyzuvw_to = np.zeros((nstars, len(times), 6))
+
+    tasks = []
+    task_star_ixs = []
+    for group_time, star_ixs in zip(group_times, groups):
+        for chunk_start in range(0, len(star_ixs), chunk_size):
+            chunk_ixs = star_ixs[chunk_start:chunk_start+chunk_size]
+            tasks.append((xyzuvw_starts[chunk_ixs], group_time, single_age))
+            task_star_ixs.append(chunk_ixs)
+    logging.debug("Tracing {} chunks".format(len(tasks)))
+
+    trace_chunk = functools.partial(_trace_orbit_chunk, potential=potential,
+                                    ro=ro, vo=vo, method=method)
+    if pool is None:
+        results = map(trace_chunk, tasks)
+    else:
+        results = pool.map(trace_chunk, tasks)
+    for chunk_ixs, xyzuvw in zip(task_star_ixs, results):
+        xyzuvw_to[chunk_ixs] = xyzuvw
+
     if savefile:
         np.save(savefile, xyzuvw_to)
     return xyzuvw_to
 
 
-def trace_orbit_builder(potential):
+def trace_orbit_builder(potential, propagator_table=None):
     """
     Build a replica of trace_cartesian_orbit but with custom
     potential. e.g. MiyamotoNagaiPotential
     With parameters (from website):
     MiyamotoNagaiPotential(a=0.5,b=0.0375,amp=1.,normalize=1.)
+
+    If a `propagator_table` (a propagatortable.PropagatorTable, or the
+    directory one was saved to) is given, single age projections within
+    the table are looked up rather than integrated, as are the Jacobians
+    used by Component. The table must have been built with `potential`.
+
+    Component finds the returned function's batched version (or, with a
+    table, its Jacobian function) as its `batch_func` (`jacobian_func`)
+    attribute, see BATCHED_TRACE_FUNCS and JACOBIAN_FUNCS.
     """
+    if propagator_table is not None:
+        from .propagatortable import PropagatorTable
+        if not isinstance(propagator_table, PropagatorTable):
+            propagator_table = PropagatorTable(propagator_table)
+
     def f_(xyzuvw_start, times=None, single_age=True):
+        if propagator_table is not None and single_age:
+            result = propagator_table.lookup(xyzuvw_start, times)
+            if result is not None:
+                return result[0]
         return trace_cartesian_orbit(xyzuvw_start=xyzuvw_start, times=times,
                                      single_age=single_age,
                                      potential=potential)
+
+    def batch_f_(xyzuvw_starts, times=None):
+        return trace_cartesian_orbit_batch(xyzuvw_starts, times=times,
+                                           potential=potential)
+
+    def jac_f_(xyzuvw_start, times=None):
+        result = propagator_table.lookup(xyzuvw_start, times)
+        if result is None:
+            result = trace_cartesian_orbit_tangent(xyzuvw_start, times=times,
+                                                   potential=potential)
+        return result
+
+    if propagator_table is not None:
+        f_.jacobian_func = jac_f_
+    else:
+        f_.batch_func = batch_f_
     return f_
 
 
+# Versions of trace functions that project many points to a single age in
+# one call (signature `batch_func(xyzuvw_starts, times)`), used by
+# Component to get the current day mean and Jacobian from a single
+# integration. Trace functions without an entry (or a `batch_func`
+# attribute, as set by trace_orbit_builder) are called point by point.
+BATCHED_TRACE_FUNCS = {
+    trace_cartesian_orbit: trace_cartesian_orbit_batch,
+}
+
+# Functions that, for a trace function, project a single point to a single
+# age and also return the exact Jacobian of that projection (signature
+# `jac_func(xyzuvw_start, times) -> (xyzuvw_now, jac)`). Preferred by
+# Component over any numerical Jacobian. Built trace functions instead
+# carry theirs as a `jacobian_func` attribute.
+JACOBIAN_FUNCS = {
+    trace_epicyclic_orbit: calc_epicyclic_jacobian,
+}
+
+
 # def generateTracebackFile(star_pars_now, times, savefile=''):
 #     """
 #     Take XYZUVW of the stars at the current time and trace back for
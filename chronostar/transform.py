@@ -7,6 +7,7 @@ cartesian covariance matrices. Also to project cartesian Gaussian distributions
 forward (or backward) through the Galactic potential.
 """
 
+from collections import OrderedDict
 import numpy as np
 
 
@@ -91,7 +92,8 @@ def calc_jacobian(trans_func, loc, dim=6, h=1e-3, args=None):
         OPTIMISATION TARGET
     The application of `trans_func` is the bottleneck of Chronostar
     (at least when `trans_func` is traceorbit.trace_cartesian_orbit).
-    Since this is a loop, there is scope for parallelisation.
+    Where a batched version of `trans_func` exists, use
+    `calc_jacobian_batch` instead.
     """
     jac = np.zeros((dim, dim))
     for i in range(dim):
@@ -99,6 +101,106 @@ def calc_jacobian(trans_func, loc, dim=6, h=1e-3, args=None):
     return jac
 
 
+def calc_jacobian_batch(batch_trans_func, loc, dim=6, h=1e-3, args=None):
+    """
+    Calculate the Jacobian of a coordinate transformation about `loc`,
+    along with the transformation of `loc` itself, from a single call to
+    a batched transformation function.
+
+    Gives the same central difference Jacobian as `calc_jacobian`, but all
+    2*`dim` offset points (and `loc`) are transformed together. For orbit
+    tracing this means one multi-orbit integration rather than 2*`dim`
+    separate ones.
+
+    Parameters
+    ----------
+    batch_trans_func : function
+        Transformation function that takes an [npoints, dim] array of
+        points in the initial coordinate frame to an [npoints, dim] array
+        in the final coordinate frame,
+        e.g. traceorbit.trace_cartesian_orbit_batch
+    loc : [dim] float array
+        The position (in the initial coordinte frame) around which we are
+        calculating the jacobian
+    dim : int {6}
+        The dimensionality of the coordinate frames
+    h : float {1e-3}
+        The size of the increment, smaller values maybe run into numerical
+        issues
+    args : tuple {None}
+        Extra arguments required by `batch_trans_func`
+
+    Returns
+    -------
+    loc_trans : [dim] float array
+        `loc` transformed into the final coordinate frame
+    jac : [dim,dim] float array
+        A jacobian matrix
+    """
+    if args is None:
+        args = ()
+    offsets = h * np.identity(dim)
+    # Row 0 is loc, rows 1 to dim are incremented, the rest decremented
+    points = np.vstack((loc, loc + offsets, loc - offsets))
+    trans_points = batch_trans_func(points, *args)
+
+    loc_trans = trans_points[0]
+    jac = (trans_points[1:dim+1] - trans_points[dim+1:]).T / (2*h)
+    return loc_trans, jac
+
+
+def calc_jacobians_batch(batch_trans_func, locs, dim=6, h=1e-3, args=None):
+    """
+    Calculate the Jacobians of a coordinate transformation about many
+    locations, from a single call to a batched transformation function.
+
+    As `calc_jacobian_batch`, but the 2*`dim`+1 points of every location
+    are transformed together, e.g. the means of all emcee walkers in one
+    multi-orbit integration.
+
+    Parameters
+    ----------
+    batch_trans_func : function
+        See `calc_jacobian_batch`. Any extra arguments are given per
+        point, e.g. traceorbit.trace_cartesian_orbit_batch with an array
+        of ages
+    locs : [nlocs, dim] float array
+        The positions (in the initial coordinate frame) around which we
+        are calculating the jacobians
+    dim, h :
+        See `calc_jacobian_batch`
+    args : tuple of [nlocs] arrays {None}
+        Extra arguments of each location (e.g. its age), passed on for
+        all of its points
+
+    Returns
+    -------
+    locs_trans : [nlocs, dim] float array
+        `locs` transformed into the final coordinate frame
+    jacs : [nlocs, dim, dim] float array
+        A jacobian matrix about each location
+    """
+    if args is None:
+        args = ()
+    locs = np.asarray(locs, dtype=np.float64).reshape(-1, dim)
+    nlocs = len(locs)
+    npoints = 2*dim + 1
+    offsets = h * np.identity(dim)
+    # As in calc_jacobian_batch, for each location in turn
+    points = np.concatenate((locs[:,np.newaxis],
+                             locs[:,np.newaxis] + offsets,
+                             locs[:,np.newaxis] - offsets), axis=1)
+    point_args = [np.repeat(np.asarray(arg, dtype=np.float64), npoints)
+                  for arg in args]
+    trans_points = batch_trans_func(points.reshape(-1, dim), *point_args)
+    trans_points = np.asarray(trans_points).reshape(nlocs, npoints, dim)
+
+    locs_trans = trans_points[:,0]
+    jacs = np.swapaxes(trans_points[:,1:dim+1] - trans_points[:,dim+1:],
+                       1, 2) / (2*h)
+    return locs_trans, jacs
+
+
 def transform_covmatrix(cov, trans_func, loc, dim=6, h=1e-3, args=None):
     """
     Transforming a covariance matrix from one coordinate frame to another
@@ -132,3 +234,184 @@ def transform_covmatrix(cov, trans_func, loc, dim=6, h=1e-3, args=None):
     jac = calc_jacobian(trans_func, loc, dim=dim, h=h, args=args)
     return np.dot(jac, np.dot(cov, jac.T))
 
+
+def get_packed_dim(npacked):
+    """
+    The dimension of the (square) covariance matrices stored in packed
+    form with `npacked` elements each, e.g. 6 for 21
+    """
+    dim = int(round((np.sqrt(8*npacked + 1) - 1) / 2))
+    if dim * (dim + 1) // 2 != npacked:
+        raise UserWarning('{} is not the size of a packed symmetric '
+                          'matrix'.format(npacked))
+    return dim
+
+
+def pack_covmatrices(covs):
+    """
+    Store symmetric covariance matrices by their upper triangle only.
+
+    The elements are kept in row major order, i.e. for 6D:
+    [C00, C01, ... C05, C11, C12, ... C15, C22, ... C55], such that
+    row i of a matrix starts at packed index i*dim - i*(i-1)/2
+
+    Parameters
+    ----------
+    covs : [..., dim, dim] float array
+        Symmetric covariance matrices
+
+    Returns
+    -------
+    packed_covs : [..., dim*(dim+1)/2] float array
+        e.g. [nstars, 21] for [nstars, 6, 6] covariance matrices
+    """
+    covs = np.asarray(covs)
+    upper_ixs = np.triu_indices(covs.shape[-1])
+    return np.ascontiguousarray(covs[..., upper_ixs[0], upper_ixs[1]])
+
+
+def unpack_covmatrices(packed_covs):
+    """
+    Rebuild full covariance matrices from those stored with
+    `pack_covmatrices`
+
+    Parameters
+    ----------
+    packed_covs : [..., dim*(dim+1)/2] float array
+
+    Returns
+    -------
+    covs : [..., dim, dim] float array
+    """
+    packed_covs = np.asarray(packed_covs)
+    dim = get_packed_dim(packed_covs.shape[-1])
+    upper_ixs = np.triu_indices(dim)
+    covs = np.empty(packed_covs.shape[:-1] + (dim, dim),
+                    dtype=packed_covs.dtype)
+    covs[..., upper_ixs[0], upper_ixs[1]] = packed_covs
+    covs[..., upper_ixs[1], upper_ixs[0]] = packed_covs
+    return covs
+
+
+
+class LRUCache(object):
+    """
+    A bounded, least recently used cache, with hit statistics. Subclasses
+    define how keys are built and what is stored.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries held, the least recently used entry is
+        dropped beyond this. A maxsize of 0 disables the cache.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the value stored under `key`, or None. A key of None
+        (something that can't be cached) is always a miss.
+        """
+        if self.maxsize <= 0:
+            return None
+        if key is None or key not in self._entries:
+            self.misses += 1
+            return None
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def _store(self, key, value):
+        """Store `value` under `key`, dropping the least recently used"""
+        if key is None or self.maxsize <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries and reset the hit statistics"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups that were hits, nan if none made yet"""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return np.nan
+        return self.hits / lookups
+
+    def get_stats(self):
+        """
+        Returns
+        -------
+        stats : dict
+            'hits', 'misses', 'hit_rate', 'size' and 'maxsize'
+        """
+        return {'hits':self.hits, 'misses':self.misses,
+                'hit_rate':self.hit_rate, 'size':len(self._entries),
+                'maxsize':self.maxsize}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class JacobianCache(LRUCache):
+    """
+    A bounded, least recently used cache of projected locations and their
+    Jacobians, e.g. (mean_now, jac) for a Component's (mean, age).
+
+    When only a covariance matrix changes between evaluations (e.g. emcee
+    walkers that differ only in dX and dV) the expensive transformation
+    can be skipped, and only J C J^T recomputed.
+
+    Parameters
+    ----------
+    maxsize : int {1024}
+        Maximum number of entries held, the least recently used entry is
+        dropped beyond this. A maxsize of 0 disables the cache.
+    decimals : int {None}
+        If set, locations and extra arguments are rounded to this many
+        decimal places when building keys, such that nearby points share
+        an entry. By default keys are exact.
+    """
+    def __init__(self, maxsize=1024, decimals=None):
+        super(JacobianCache, self).__init__(maxsize)
+        self.decimals = decimals
+
+    def make_key(self, trans_func, loc, *args):
+        """
+        Build a key from a transformation function, the location it is
+        evaluated about and any extra (float) arguments. Returns None if
+        `trans_func` is unhashable, in which case nothing is cached.
+        """
+        try:
+            hash(trans_func)
+        except TypeError:
+            return None
+        loc = np.asarray(loc, dtype=np.float64)
+        args = np.array(args, dtype=np.float64)
+        if self.decimals is not None:
+            # adding 0. turns any -0. into 0.
+            loc = np.round(loc, self.decimals) + 0.
+            args = np.round(args, self.decimals) + 0.
+        return (trans_func, loc.tobytes(), args.tobytes())
+
+    def put(self, key, loc_trans, jac):
+        """
+        Store a copy of (loc_trans, jac) under `key`
+        """
+        if key is None or self.maxsize <= 0:
+            return
+        value = (np.array(loc_trans), np.array(jac))
+        for array in value:
+            array.flags.writeable = False
+        self._store(key, value)
@@ -16,6 +16,12 @@ star_means: [npoints,6] float array_like
 star_covs: [npoints,6,6] float array_like
     Phase-space covariances of stellar data that we are fitting components to
 Output is a file with ln_bg_ols. Same order as input datafile.
+If the path to a BackgroundOverlapStore directory is given as a command
+line argument (as `bg_ols_store_dir` in datatool's parameter files), e.g.
+    > mpirun -np 4 python bg_ols_multiprocessing.py path/to/bg_ols_store
+overlaps already in the store (e.g. from a previous run on an
+overlapping region) are not calculated again, and new ones are added
+to it.
 No return.
 bg_lnols: [nstars] float array_like
     Background log overlaps of stars with background probability density
@@ -51,20 +57,27 @@ else:
 import sys
 sys.path.insert(0, '..')
 from chronostar import tabletool
+from chronostar import bgoverlap
 try:
     print('Using C implementation')
     #from _overlap import get_lnoverlaps
     from chronostar._overlap import get_lnoverlaps
 except:
-    print("WARNING: Couldn't import C implementation, using slow pythonic overlap instead")
-    logging.info("WARNING: Couldn't import C implementation, using slow pythonic overlap instead")
-    from chronostar.likelihood import slow_get_lnoverlaps as get_lnoverlaps
+    print("WARNING: Couldn't import C implementation, using numpy overlap instead")
+    logging.info("WARNING: Couldn't import C implementation, using numpy overlap instead")
+    from chronostar.likelihood import numpy_get_lnoverlaps as get_lnoverlaps
 def log_message(msg, symbol='.', surround=False):
     """Little formatting helper"""
     res = '{}{:^40}{}'.format(5*symbol, msg, 5*symbol)
     if surround:
         res = '\n{}\n{}\n{}'.format(50*symbol, res, 50*symbol)
     logging.info(res)
+if len(sys.argv) > 2:
+    raise UserWarning('Incorrect usage. The only (optional) command line '
+                      'argument is a background overlap store directory. '
+                      'e.g.\n'
+                      '   > python bg_ols_multiprocessing.py path/to/store')
+store_dir = sys.argv[1] if len(sys.argv) == 2 else None
 comm = MPI.COMM_WORLD
 size=comm.Get_size()
 rank=comm.Get_rank()
@@ -98,6 +111,25 @@ if rank == 0:
     bandwidth = nstars**(-1.0 / (d + 4.0))
     background_cov = np.cov(background_means.T) * bandwidth ** 2
     background_covs = np.array(nstars * [background_cov]) # same cov for every star
+    # Only calculate overlaps of stars not already in the store (these
+    # are exact, i.e. rtol=0)
+    all_bg_ln_ols = np.zeros(len(star_means))
+    missing = np.arange(len(star_means))
+    if store_dir is not None:
+        store = bgoverlap.BackgroundOverlapStore(
+            store_dir,
+            bgoverlap.get_reference_key(background_means, bandwidth),
+        )
+        star_ids = None
+        if 'source_id' in data_table.colnames:
+            star_ids = data_table['source_id']
+        star_keys = bgoverlap.get_star_keys(star_means, star_covs, star_ids)
+        all_bg_ln_ols, found = store.lookup(star_keys, rtol=0.)
+        missing = np.where(~found)[0]
+        print('{} of {} overlaps found in store'.format(np.sum(found),
+                                                        len(found)))
+    star_means = star_means[missing]
+    star_covs = star_covs[missing]
     # SPLIT DATA into multiple processes
     indices_chunks = np.array_split(range(len(star_means)), size)
     star_means = [star_means[i] for i in indices_chunks]
@@ -137,7 +169,10 @@ for star_cov, star_mean in zip(star_covs, star_means):
 bg_ln_ols_result = comm.gather(bg_ln_ols, root=0)
 if rank == 0:
     bg_ln_ols_result = list(itertools.chain.from_iterable(bg_ln_ols_result))
-    np.savetxt('bgols_multiprocessing.dat', bg_ln_ols_result)
+    if store_dir is not None:
+        store.insert(star_keys[missing], bg_ln_ols_result, rtol=0.)
+    all_bg_ln_ols[missing] = bg_ln_ols_result
+    np.savetxt('bgols_multiprocessing.dat', all_bg_ln_ols)
     time_end = time.time()
     print(rank, 'done', time_end - time_start)
     #print('master collected: ', bg_ln_ols_result)
\ No newline at end of file
@@ -14,6 +14,7 @@ from mpi4py import MPI
 import sys
 sys.path.insert(0, '..')
 from chronostar import readparam
+from chronostar import datapool
 
 USE_C_IMPLEMENTATION = True
 try:
@@ -52,20 +53,27 @@ if rank==0:
     #~ star_means = [star_means_all[i] for i in indices_chunks]
     #~ star_covs = [star_covs_all[i] for i in indices_chunks]
     
-    star_covs = star_covs_all
-    star_means = star_means_all
+    # Place star data in shared memory so broadcasting only sends the
+    # names of the arrays. Ranks spread over several nodes need
+    # 'memmap' (and a shared filesystem), given as an optional 3rd arg
+    share_backend = sys.argv[3] if len(sys.argv) > 3 else 'shm'
+    star_data = datapool.SharedDataDict(
+            {'means':np.asarray(star_means_all),
+             'covs':np.asarray(star_covs_all)},
+            backend=share_backend,
+    )
 
 else:
     cov_now = None
     mean_now = None
-    star_covs = None
-    star_means = None
+    star_data = None
 
 # BROADCAST CONSTANTS
 cov_now = comm.bcast(cov_now, root=0)
 mean_now = comm.bcast(mean_now, root=0)
-star_means = comm.bcast(star_means, root=0)
-star_covs = comm.bcast(star_covs, root=0)
+star_data = comm.bcast(star_data, root=0)
+star_means = star_data['means']
+star_covs = star_data['covs']
 
 # SCATTER DATA
 #~ star_covs = comm.scatter(star_covs, root=0)
@@ -92,4 +100,8 @@ if rank == 0:
 
     # WRITE a file
     np.savetxt(filename_result, result)
+
+# Every rank has finished with the star data once results are gathered
+comm.Barrier()
+star_data.release()
     
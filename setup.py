@@ -45,11 +45,54 @@ try:
 except AttributeError:
     numpy_include = numpy.get_numpy_include()
 
+def has_openmp_support():
+    """
+    Check whether the C compiler can build and link an OpenMP program.
+
+    Set the environment variable CHRONOSTAR_NO_OPENMP to skip the check
+    and build the serial version of the overlap extension.
+    """
+    if os.environ.get("CHRONOSTAR_NO_OPENMP"):
+        return False
+
+    import shutil
+    import tempfile
+    from distutils.ccompiler import new_compiler
+    from distutils.sysconfig import customize_compiler
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmp_dir, "test_openmp.c")
+        with open(src, "w") as fp:
+            fp.write("#include <omp.h>\n"
+                     "int main(void) { return omp_get_max_threads() < 1; }\n")
+        compiler = new_compiler()
+        customize_compiler(compiler)
+        objs = compiler.compile([src], output_dir=tmp_dir,
+                                extra_postargs=["-fopenmp"])
+        compiler.link_executable(objs, os.path.join(tmp_dir, "test_openmp"),
+                                 extra_postargs=["-fopenmp"])
+    except Exception:
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return True
+
+# The overlap star loop is parallelised with OpenMP where the compiler
+# supports it, otherwise the pragmas are ignored and it runs serially
+if has_openmp_support():
+    openmp_args = ["-fopenmp"]
+else:
+    print("OpenMP not available, building serial overlap extension")
+    openmp_args = []
+
 # &TC added extra directory
 _overlap = Extension("chronostar/_overlap",
                     ["chronostar/overlap/overlap.i", "chronostar/overlap/overlap.c"],
                     include_dirs = [numpy_include],
                     libraries = ['gsl', 'gslcblas'], 
+                    extra_compile_args = openmp_args,
+                    extra_link_args = openmp_args,
 #https://stackoverflow.com/questions/44380459/is-openmp-available-in-high-sierra-llvm
 #... but no obvious compile errors. 
 #                   extra_compile_args = ["-Xclang -fopenmp -lomp"],
@@ -0,0 +1,111 @@
+"""
+Check the BackgroundOverlapEngine against a brute force sum over every
+background star, and the BackgroundOverlapStore of its results
+"""
+import numpy as np
+import os
+import shutil
+from scipy.special import logsumexp
+
+import sys
+sys.path.insert(0,'..')
+from chronostar import bgoverlap
+from chronostar import likelihood
+
+
+def brute_force_lnols(engine, background_means, star_means, star_covs):
+    bg_covs = np.tile(engine.background_cov, (len(background_means), 1, 1))
+    return np.array([
+        logsumexp(likelihood.numpy_get_lnoverlaps(star_cov, star_mean,
+                                                  bg_covs, background_means))
+        for star_mean, star_cov in zip(star_means, star_covs)
+    ])
+
+
+def test_get_lnols():
+    """
+    Checks overlaps with and without the leaf bounds match the brute
+    force sum, also when shared between processes, and that invalid
+    stars give -inf
+    """
+    np.random.seed(0)
+    nbgstars = 3000
+    nstars = 30
+    background_means = np.random.randn(nbgstars, 6) \
+                       * np.array([100., 100., 50., 10., 10., 5.])
+    star_means = np.random.randn(nstars, 6) \
+                 * np.array([200., 200., 100., 20., 20., 10.])
+    star_covs = np.array([np.diag(np.random.rand(6) * 10.)
+                          for _ in range(nstars)])
+
+    engine = bgoverlap.BackgroundOverlapEngine(background_means, leafsize=64)
+    assert len(engine.leaf_lo) > 1
+    brute_lnols = brute_force_lnols(engine, background_means, star_means,
+                                    star_covs)
+
+    exact_lnols = engine.get_lnols(star_means, star_covs, rtol=0)
+    assert np.allclose(exact_lnols, brute_lnols, rtol=0, atol=1e-10)
+
+    rtol = 1e-6
+    fast_lnols = engine.get_lnols(star_means, star_covs, rtol=rtol)
+    assert np.all(fast_lnols <= brute_lnols + 1e-10)
+    assert np.all(brute_lnols - fast_lnols < 2*rtol)
+
+    pooled_lnols = engine.get_lnols(star_means, star_covs, rtol=rtol,
+                                    nprocesses=2, chunk_size=7)
+    assert np.all(pooled_lnols == fast_lnols)
+
+    bad_cov = -np.identity(6) * 1e3
+    assert engine.get_star_lnol(star_means[0], bad_cov) == -np.inf
+    assert engine.get_star_lnol(star_means[0] * np.nan, star_covs[0]) \
+           == -np.inf
+
+
+def test_store():
+    """
+    Checks overlaps are reused from the store, only for the same stars,
+    background and a rtol no larger, and that new ones are added
+    """
+    np.random.seed(1)
+    store_dir = 'temp_data/bg_ols_store'
+    if os.path.isdir(store_dir):
+        shutil.rmtree(store_dir)
+
+    background_means = np.random.randn(500, 6) * 10.
+    star_means = np.random.randn(20, 6) * 10.
+    star_covs = np.tile(np.identity(6), (20, 1, 1))
+    star_ids = np.arange(20)
+    engine = bgoverlap.BackgroundOverlapEngine(background_means)
+    expected_lnols = engine.get_lnols(star_means, star_covs, rtol=1e-6)
+
+    stored_lnols = engine.get_lnols(star_means[:10], star_covs[:10],
+                                    store_dir=store_dir, star_ids=star_ids[:10])
+    assert np.all(stored_lnols == expected_lnols[:10])
+    store = bgoverlap.BackgroundOverlapStore(store_dir, engine.ref_key)
+    assert len(store.load()[0]) == 10
+
+    # Fudge stored values, to see which are reused
+    keys, lnols, rtols = store.load()
+    shutil.rmtree(store.shard_dir)
+    store.insert(keys, lnols + 1., rtol=1e-6)
+
+    stored_lnols = engine.get_lnols(star_means, star_covs,
+                                    store_dir=store_dir, star_ids=star_ids)
+    assert np.all(stored_lnols[:10] == expected_lnols[:10] + 1.)
+    assert np.all(stored_lnols[10:] == expected_lnols[10:])
+    assert len(store.load()[0]) == 20
+
+    # Different ids, a tighter rtol or another background aren't found
+    new_lnols = engine.get_lnols(star_means[:10], star_covs[:10],
+                                 store_dir=store_dir, star_ids=star_ids[:10]+1)
+    assert np.all(new_lnols == expected_lnols[:10])
+    new_lnols = engine.get_lnols(star_means[:10], star_covs[:10], rtol=0,
+                                 store_dir=store_dir, star_ids=star_ids[:10])
+    assert np.allclose(new_lnols, expected_lnols[:10], atol=1e-5)
+    other_engine = bgoverlap.BackgroundOverlapEngine(background_means * 2.)
+    assert other_engine.ref_key != engine.ref_key
+    assert not np.any(bgoverlap.BackgroundOverlapStore(
+            store_dir, other_engine.ref_key
+    ).lookup(bgoverlap.get_star_keys(star_means, star_covs, star_ids))[1])
+
+    shutil.rmtree(store_dir)
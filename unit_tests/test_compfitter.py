@@ -0,0 +1,225 @@
+"""
+Check fit_comp's checkpointed emcee chains match an uninterrupted fit,
+also when the fit is killed part way and resumed
+"""
+import os
+import shutil
+import numpy as np
+
+import sys
+sys.path.insert(0,'..')
+from chronostar import compfitter
+from chronostar.component import SphereComponent
+from chronostar.naivefit import dummy_trace_orbit_func
+
+
+class KilledFit(Exception):
+    pass
+
+
+def run_fit(save_dir, seed=0, **kwargs):
+    np.random.seed(0)
+    nstars = 30
+    data = {'means':np.random.randn(nstars, 6) * 5.,
+            'covs':np.tile(np.identity(6), (nstars, 1, 1))}
+    # Sets walkers' initial positions, and the sampler's random state
+    np.random.seed(seed)
+    init_pars = np.hstack((np.zeros(6), np.log(5.), np.log(2.), 1.))
+    fit_kwargs = {'burnin_steps':25, 'sampling_steps':23, 'max_iter':1}
+    fit_kwargs.update(kwargs)
+    return compfitter.fit_comp(
+            data=data, init_pars=init_pars, Component=SphereComponent,
+            trace_orbit_func=dummy_trace_orbit_func, save_dir=save_dir,
+            plot_dir=save_dir, **fit_kwargs
+    )
+
+
+def test_chain_checkpoint():
+    save_dir = 'temp_data/chain_checkpoint_test/'
+    checkpoint_dir = save_dir + 'chain_checkpoint/'
+    if os.path.isdir(save_dir):
+        shutil.rmtree(save_dir)
+    os.makedirs(save_dir)
+
+    _, expected_chain, expected_lnprob = run_fit(save_dir)
+    expected_chain = np.array(expected_chain)
+    expected_lnprob = np.array(expected_lnprob)
+
+    _, chain, lnprob = run_fit(save_dir, checkpoint_dir=checkpoint_dir,
+                               checkpoint_every=10)
+    assert np.all(chain == expected_chain)
+    assert np.all(lnprob == expected_lnprob)
+    assert np.all(np.load(save_dir + 'final_chain.npy') == expected_chain)
+    assert not os.path.isdir(checkpoint_dir)
+
+    # Kill the fit in its fourth segment (i.e. part way through sampling),
+    # then resume it, with a different global random state
+    orig_run_mcmc_segment = compfitter.run_mcmc_segment
+    nsegments = [0]
+    def killed_run_mcmc_segment(*args, **kwargs):
+        nsegments[0] += 1
+        if nsegments[0] == 4:
+            raise KilledFit()
+        return orig_run_mcmc_segment(*args, **kwargs)
+
+    compfitter.run_mcmc_segment = killed_run_mcmc_segment
+    try:
+        run_fit(save_dir, checkpoint_dir=checkpoint_dir, checkpoint_every=10)
+        assert False, 'Fit should have been killed'
+    except KilledFit:
+        pass
+    finally:
+        compfitter.run_mcmc_segment = orig_run_mcmc_segment
+    assert os.path.isdir(checkpoint_dir)
+
+    _, chain, lnprob = run_fit(save_dir, seed=1,
+                               checkpoint_dir=checkpoint_dir,
+                               checkpoint_every=10)
+    assert np.all(chain == expected_chain)
+    assert np.all(lnprob == expected_lnprob)
+
+    shutil.rmtree(save_dir)
+
+
+def test_convergence_statistics():
+    """
+    Checks the autocorrelation time of AR(1) processes, whose exact
+    value is (1 + phi) / (1 - phi), and that the Gelman-Rubin statistic
+    tells walkers exploring the same distribution from those that don't
+    """
+    np.random.seed(0)
+    nwalkers, nsteps = 20, 20000
+    phis = np.array([0., 0.5, 0.9])
+    chain = np.zeros((nwalkers, nsteps, len(phis)))
+    noise = np.random.randn(nwalkers, nsteps, len(phis))
+    for step in range(1, nsteps):
+        chain[:, step] = phis * chain[:, step-1] + noise[:, step]
+    expected_tau = (1 + phis) / (1 - phis)
+    assert np.allclose(compfitter.calc_autocorr_time(chain), expected_tau,
+                       rtol=0.1)
+
+    assert np.all(compfitter.calc_gelman_rubin(chain) < 1.01)
+    chain[:nwalkers//2] += 3.
+    assert np.all(compfitter.calc_gelman_rubin(chain) > 1.1)
+
+    # A parameter that never moves has no finite autocorrelation time
+    chain[:, :, 0] = 1.
+    assert compfitter.calc_autocorr_time(chain)[0] == np.inf
+
+
+def test_adaptive_burnin():
+    """
+    Checks an adaptive burnin stops once converged, well before
+    `burnin_steps`, then samples for `sampling_tau_factor` autocorrelation
+    times, and that it resumes from a checkpoint
+    """
+    save_dir = 'temp_data/adaptive_burnin_test/'
+    if os.path.isdir(save_dir):
+        shutil.rmtree(save_dir)
+    os.makedirs(save_dir)
+
+    # Start all walkers at ages below 1, clear of dummy_trace_orbit_func's
+    # penalty, such that none get lost
+    rs = np.random.RandomState(0)
+    init_pos = np.hstack((np.zeros(6), np.log(5.), np.log(2.), 0.5)) \
+               + rs.randn(18, 9) * np.hstack((np.ones(6), 0.1, 0.1, 0.1))
+    adaptive_kwargs = {'adaptive_burnin':True, 'monitor_every':20,
+                       'tau_factor':2., 'rhat_tol':2., 'burnin_steps':500,
+                       'sampling_steps':None, 'init_pos':init_pos,
+                       'store_burnin_chains':True}
+    _, chain, lnprob = run_fit(save_dir, **adaptive_kwargs)
+    burnin_chain = np.load(save_dir + 'burnin_chain.npy')
+    nburnin = burnin_chain.shape[1]
+    assert nburnin % 20 == 0
+    assert nburnin < 500
+    tau = np.max(compfitter.calc_autocorr_time(burnin_chain))
+    assert nburnin >= 2. * tau
+    assert chain.shape[1] == int(np.ceil(10. * tau))
+    assert lnprob.shape == chain.shape[:2]
+
+    _, checkpointed_chain, _ = run_fit(
+            save_dir, checkpoint_every=7,
+            checkpoint_dir=save_dir + 'chain_checkpoint/', **adaptive_kwargs
+    )
+    assert np.all(checkpointed_chain == chain)
+
+    shutil.rmtree(save_dir)
+
+
+def test_adaptive_burnin_shifts_walkers():
+    """
+    Checks that, as with fixed burnins, an unconverged adaptive burnin
+    shifts poor walkers every `burnin_steps`, rescuing one lost on
+    dummy_trace_orbit_func's penalty (at ages over 1), and is then checked
+    from there on
+    """
+    save_dir = 'temp_data/adaptive_burnin_shift_test/'
+    if os.path.isdir(save_dir):
+        shutil.rmtree(save_dir)
+    os.makedirs(save_dir)
+
+    _, chain, lnprob = run_fit(
+            save_dir, adaptive_burnin=True, monitor_every=20, tau_factor=2.,
+            rhat_tol=2., burnin_steps=100, max_iter=10, sampling_steps=None,
+            store_burnin_chains=True,
+    )
+    burnin_lnprob = np.load(save_dir + 'burnin_lnprob.npy')
+    nburnin = burnin_lnprob.shape[1]
+    assert 100 < nburnin < 1000
+    assert np.min(burnin_lnprob[:, 99]) < -1e5
+    assert np.min(lnprob) > -1e4
+    # Only the burnin since walkers were last shifted sets the sample length
+    window = np.load(save_dir + 'burnin_chain.npy')[:, (nburnin-1)//100*100:]
+    tau = np.max(compfitter.calc_autocorr_time(window))
+    assert chain.shape[1] == int(np.ceil(10. * tau))
+
+    shutil.rmtree(save_dir)
+
+
+def test_chain_checkpoint_inputs():
+    """
+    Checks a checkpoint is only resumed by a fit with the same inputs,
+    checkpointed every as many steps
+    """
+    checkpoint_dir = 'temp_data/chain_checkpoint_inputs_test/'
+    np.random.seed(0)
+    data = {'means':np.random.randn(10, 6),
+            'covs':np.tile(np.identity(6), (10, 1, 1))}
+    memb_probs = np.ones(10)
+    fit_pars = {'nwalkers':18, 'burnin_steps':25,
+                'trace_orbit_func':dummy_trace_orbit_func,
+                'Component':SphereComponent}
+    inputs_key = compfitter.ChainCheckpoint.get_inputs_key(
+            data, memb_probs, **fit_pars
+    )
+    assert inputs_key == compfitter.ChainCheckpoint.get_inputs_key(
+            {'means':data['means'].copy(), 'covs':data['covs'].copy()},
+            memb_probs.copy(), **fit_pars
+    )
+
+    other_data = {'means':data['means'] + 1., 'covs':data['covs']}
+    assert inputs_key != compfitter.ChainCheckpoint.get_inputs_key(
+            other_data, memb_probs, **fit_pars
+    )
+    assert inputs_key != compfitter.ChainCheckpoint.get_inputs_key(
+            data, memb_probs, init_pos=np.zeros((18, 9)), **fit_pars
+    )
+    other_pars = dict(fit_pars, trace_orbit_func=None)
+    assert inputs_key != compfitter.ChainCheckpoint.get_inputs_key(
+            data, memb_probs, **other_pars
+    )
+    other_pars = dict(fit_pars, adaptive_burnin=True)
+    assert inputs_key != compfitter.ChainCheckpoint.get_inputs_key(
+            data, memb_probs, **other_pars
+    )
+
+    checkpoint = compfitter.ChainCheckpoint(checkpoint_dir, every=10)
+    checkpoint.save_state(stage='burnin00', cnt=0, nsteps_done=10,
+                          pos=None, lnprob=None, random_state=None,
+                          inputs_key=inputs_key)
+    assert checkpoint.load_state(inputs_key)['every'] == 10
+    assert checkpoint.load_state('other inputs') is None
+    other_checkpoint = compfitter.ChainCheckpoint(checkpoint_dir, every=7)
+    assert other_checkpoint.load_state(inputs_key) is None
+
+    checkpoint.remove()
@@ -222,3 +222,94 @@ def test_get_best_from_chain():
 
 if __name__=='__main__':
     test_simple_projection()
+
+
+def test_projection_cache():
+    """
+    Check components differing only in spread reuse a cached projection,
+    that the result is unchanged by the cache, and that the cache is
+    bounded
+    """
+    from chronostar import component
+    from chronostar import transform
+
+    component.PROJECTION_CACHE.clear()
+    for dx in [DX, 2*DX]:
+        sphere_comp = SphereComponent(pars=np.hstack((MEAN, [dx, DV, AGE])))
+        cov_now = transform.transform_covmatrix(
+                sphere_comp.get_covmatrix(), sphere_comp.trace_orbit_func,
+                MEAN, args=(AGE,),
+        )
+        assert np.allclose(cov_now, sphere_comp.get_covmatrix_now())
+        assert np.allclose(sphere_comp.trace_orbit_func(MEAN, AGE),
+                           sphere_comp.get_mean_now())
+    stats = component.PROJECTION_CACHE.get_stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+    small_cache = transform.JacobianCache(maxsize=2)
+    keys = [small_cache.make_key(len, np.ones(6)*i, AGE) for i in range(3)]
+    for key in keys:
+        small_cache.put(key, np.zeros(6), np.identity(6))
+    assert len(small_cache) == 2
+    assert small_cache.get(keys[0]) is None
+    assert small_cache.get(keys[2]) is not None
+
+
+def test_project_many_to_now():
+    """
+    Check projecting many components (e.g. emcee walkers) together
+    matches projecting each one by one
+    """
+    from chronostar import component
+
+    all_pars = [np.hstack((MEAN + i, [DX + i, DV, AGE + 5.*i]))
+                for i in range(4)]
+    # Sharing a mean and age with the first, so found in the cache
+    all_pars.append(np.hstack((MEAN, [2*DX, DV, AGE])))
+
+    component.PROJECTION_CACHE.clear()
+    single_comps = [SphereComponent(pars=pars) for pars in all_pars]
+    expected = [comp.get_currentday_projection() for comp in single_comps]
+
+    component.PROJECTION_CACHE.clear()
+    batch_comps = [SphereComponent(pars=pars) for pars in all_pars]
+    batch_comps[0].get_covmatrix_now()
+    SphereComponent.project_many_to_now(batch_comps)
+    for comp, (mean_now, covmatrix_now) in zip(batch_comps, expected):
+        assert np.allclose(comp.get_mean_now(), mean_now)
+        assert np.allclose(comp.get_covmatrix_now(), covmatrix_now)
+
+
+def test_trace_jacobian_func():
+    """
+    Check a component given a "trace with Jacobian" function projects as
+    one using the default trace function does
+    """
+    from chronostar import traceorbit
+
+    default_comp = SphereComponent(pars=SPHERE_PARS)
+    for kwargs in [
+        {'trace_orbit_func':traceorbit.trace_cartesian_orbit_tangent},
+        {'trace_jacobian_func':traceorbit.trace_cartesian_orbit_tangent},
+    ]:
+        tangent_comp = SphereComponent(pars=SPHERE_PARS, **kwargs)
+        assert np.allclose(default_comp.get_mean_now(),
+                           tangent_comp.get_mean_now(), atol=1e-5)
+        assert np.allclose(default_comp.get_covmatrix_now(),
+                           tangent_comp.get_covmatrix_now(), rtol=1e-5)
+        # Plain traces are still available
+        assert np.allclose(tangent_comp.trace_orbit_func(MEAN, AGE),
+                           default_comp.get_mean_now(), atol=1e-5)
+
+    # Identical components trace with equal functions, so share cache keys
+    import pickle
+    from chronostar.likelihood import OverlapCache
+    comp_a, comp_b = [
+        SphereComponent(pars=SPHERE_PARS,
+                        trace_orbit_func=traceorbit.trace_cartesian_orbit_tangent)
+        for _ in range(2)
+    ]
+    assert comp_a.trace_orbit_func == comp_b.trace_orbit_func
+    assert OverlapCache.make_key(comp_a) == OverlapCache.make_key(comp_b)
+    assert pickle.loads(pickle.dumps(comp_a.trace_orbit_func)) \
+           == comp_a.trace_orbit_func
@@ -267,3 +267,27 @@ def test_internalConsistency():
 
     assert np.isclose(direct_ra, indirect_ra)
     assert np.isclose(direct_dec, indirect_dec)
+
+
+def test_convertMany():
+    """
+    Check converting many stars at once matches converting each star in
+    turn, and that converting there and back recovers the input
+    """
+    star_astros = np.array([
+        [86.82, -51.067, 51.44, 4.65, 83.1, 20],        # beta Pic
+        [165.466, -34.705, 18.62, -66.19, -13.9, 13.4], # TW Hya
+        [82.187, -65.45, 65.93, 33.16, 150.83, 32.4],   # AB Dor
+        [100.94, -71.977, 17.17, 6.17, 61.15, 20.7],    # HIP 32235
+        [0., 90., 1e15, 0., 0., 0.],                    # near the sun
+    ])
+    xyzuvws = cc.convert_many_astrometry2lsrxyzuvw(star_astros)
+    assert xyzuvws.shape == star_astros.shape
+    for star_astro, xyzuvw in zip(star_astros, xyzuvws):
+        assert np.allclose(cc.convert_astrometry2lsrxyzuvw(star_astro),
+                           xyzuvw)
+
+    astros = cc.convert_many_lsrxyzuvw2astrometry(xyzuvws[:-1])
+    assert np.allclose(astros, star_astros[:-1])
+    for xyzuvw, astro in zip(xyzuvws, astros):
+        assert np.allclose(cc.convert_lsrxyzuvw2astrometry(xyzuvw), astro)
@@ -0,0 +1,111 @@
+"""
+Check the DataPool's workers evaluate lnprob on the data they hold, and
+that a SharedDataDict is seen identically by every process
+"""
+from functools import partial
+import os
+import pickle
+import numpy as np
+
+import sys
+sys.path.insert(0,'..')
+from chronostar import datapool
+from chronostar import likelihood
+from chronostar.naivefit import dummy_trace_orbit_func
+
+
+def test_pooled_lnprob_func():
+    """
+    Checks lnprob evaluated by the pool workers matches serial lnprob,
+    including after membership probabilities have been updated
+    """
+    nstars = 50
+    star_means = np.random.randn(nstars, 6) * 5.
+    star_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    dummy_data = {'means':star_means, 'covs':star_covs}
+
+    walker_pars = [
+        np.hstack((np.zeros(6), np.log(3.), np.log(2.), 1e-10)),
+        np.hstack((np.ones(6), np.log(10.), np.log(1.), 1e-10)),
+    ]
+    lnprob_kwargs = {'trace_orbit_func':dummy_trace_orbit_func,
+                     'optimisation_method':'emcee',
+                     'Component':likelihood.SphereComponent}
+    pooled_lnprob_func = partial(datapool.pooled_lnprob_func,
+                                 **lnprob_kwargs)
+
+    with datapool.DataPool(dummy_data, nprocesses=2) as pool:
+        assert pool.holds(dummy_data)
+        assert not pool.holds(dict(dummy_data))
+
+        for memb_probs in [np.ones(nstars), np.random.rand(nstars)]:
+            pool.set_memb_probs(memb_probs)
+            pooled_lnprobs = pool.map(pooled_lnprob_func, walker_pars)
+            serial_lnprobs = [
+                likelihood.lnprob_func(pars, dummy_data, memb_probs,
+                                       **lnprob_kwargs)
+                for pars in walker_pars
+            ]
+            assert np.allclose(pooled_lnprobs, serial_lnprobs)
+
+        try:
+            pool.set_memb_probs(np.ones(nstars + 1))
+            assert False, 'Should have rejected mismatched memb_probs'
+        except UserWarning:
+            pass
+
+
+def test_sharedDataDict():
+    """
+    Checks a SharedDataDict matches the data it was built from, also when
+    unpickled (i.e. attached to) elsewhere or held by DataPool workers,
+    and that its memory is freed on release
+    """
+    nstars = 20
+    star_means = np.random.randn(nstars, 6) * 5.
+    star_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    dummy_data = {'means':star_means, 'covs':star_covs,
+                  'bg_lnols':np.random.randn(nstars), 'nstars':nstars}
+    pars = np.hstack((np.zeros(6), np.log(3.), np.log(2.), 1e-10))
+    lnprob_kwargs = {'trace_orbit_func':dummy_trace_orbit_func,
+                     'optimisation_method':'emcee',
+                     'Component':likelihood.SphereComponent}
+    memb_probs = np.random.rand(nstars)
+    serial_lnprob = likelihood.lnprob_func(pars, dummy_data, memb_probs,
+                                           **lnprob_kwargs)
+
+    for backend in ['shm', 'memmap']:
+        shared_data = datapool.SharedDataDict(dummy_data, backend=backend)
+        attached_data = pickle.loads(pickle.dumps(shared_data))
+
+        for data in [shared_data, attached_data]:
+            assert isinstance(data, dict)
+            assert data['nstars'] == nstars
+            for key in ['means', 'covs', 'bg_lnols']:
+                assert np.all(data[key] == dummy_data[key])
+                assert not data[key].flags.writeable
+            try:
+                data['means'] = star_means
+                assert False, 'SharedDataDict should be read only'
+            except TypeError:
+                pass
+
+        # Only the names of the arrays should be pickled
+        assert len(pickle.dumps(shared_data)) < star_covs.nbytes
+
+        with datapool.DataPool(shared_data, nprocesses=2,
+                               memb_probs=memb_probs) as pool:
+            pooled_lnprob_func = partial(datapool.pooled_lnprob_func,
+                                         **lnprob_kwargs)
+            assert np.allclose(pool.map(pooled_lnprob_func, [pars]),
+                               serial_lnprob)
+
+        names = shared_data.get_names()
+        del data
+        attached_data.release()
+        shared_data.release()
+        for name in names.values():
+            if backend == 'shm':
+                assert not os.path.exists(os.path.join('/dev/shm', name))
+            else:
+                assert not os.path.exists(name)
@@ -7,6 +7,7 @@ from astropy.table import Table
 import numpy as np
 import os.path
 import pytest
+import shutil
 import sys
 sys.path.insert(0, '..')
 
@@ -93,6 +94,64 @@ def test_cut_on_bounds():
         assert np.max(result[col]) <= DMAX
 
 
+def test_prepare_in_chunks():
+    """
+    Checks preparing data in chunks (with cuts that leave some chunks
+    empty) gives the same table as preparing it all at once, also when
+    resuming from checkpoints
+    """
+    DMIN = -10.
+    DMAX = 50.
+    data_pars = {
+        'input_file':'sample_data/sample_table_astro_only.fits',
+        'convert_astrometry':True,
+        'output_file':'temp_data/astro_only_output.fits',
+        'overwrite_datafile':True,
+        'apply_cart_cuts':True,
+        'cut_on_bounds':True,
+        'cut_bound_min':[DMIN,DMIN,DMIN,DMIN,DMIN,DMIN],
+        'cut_bound_max':[DMAX,DMAX,DMAX,DMAX,DMAX,DMAX],
+        'return_data_table':True,
+    }
+    result = datatool.prepare_data(data_pars)
+
+    checkpoint_dir = 'temp_data/chunks'
+    chunk_pars = dict(data_pars)
+    chunk_pars.update({
+        'output_file':'temp_data/astro_only_chunked_output.fits',
+        'chunk_size':3,
+        'checkpoint_dir':checkpoint_dir,
+        'keep_checkpoints':True,
+    })
+    chunk_result = datatool.prepare_data(chunk_pars)
+
+    # Losing a chunk (or the output) should only redo that chunk
+    chunk_filenames = sorted(os.listdir(checkpoint_dir))
+    os.remove(os.path.join(checkpoint_dir, chunk_filenames[0]))
+    chunk_pars['keep_checkpoints'] = False
+    resumed_result = datatool.prepare_data(chunk_pars)
+    assert not os.path.exists(checkpoint_dir)
+
+    for table in [chunk_result, resumed_result]:
+        assert table.colnames == result.colnames
+        assert len(table) == len(result)
+        for col in 'XYZUVW':
+            assert np.allclose(table[col], result[col])
+            assert table[col].unit == result[col].unit
+
+    # Checkpoints are only reused with the same parameters
+    chunk_pars['keep_checkpoints'] = True
+    datatool.prepare_data(chunk_pars)
+    chunk_pars['cut_bound_max'] = [DMAX+1,DMAX,DMAX,DMAX,DMAX,DMAX]
+    try:
+        datatool.prepare_data(chunk_pars)
+        assert False, 'Should have refused mismatched checkpoints'
+    except UserWarning:
+        pass
+    finally:
+        shutil.rmtree(checkpoint_dir)
+
+
 @pytest.mark.skipif(not os.path.isfile('../data/gaia_cartesian_full_6d_table.fits'),
                     reason='No provided background data reference file. Ask Tim'
                            'for "gaia_cartesian_full_6d_table.fits"')
@@ -13,7 +13,9 @@ sys.path.insert(0,'..')
 from chronostar import likelihood
 from chronostar.component import SphereComponent, EllipComponent
 from chronostar import tabletool
+from chronostar import transform
 from chronostar.synthdata import SynthData
+from chronostar.naivefit import dummy_trace_orbit_func
 
 
 def astropyCalcAlpha(dx,dv,nstars):
@@ -132,6 +134,155 @@ def test_get_lnoverlaps():
     assert np.allclose(ln_overlaps, sorted(ln_overlaps)[::-1])
 
 
+def test_num_threads():
+    """
+    Checks overlaps are unchanged by the number of threads used by the
+    c implementation
+    """
+    nstars = 200
+    star_means = np.random.randn(nstars, 6) * 5.
+    star_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    dummy_data = {'means':star_means, 'covs':star_covs}
+    comp = SphereComponent(pars=np.hstack((np.zeros(6), 3., 2., 1e-10)))
+
+    orig_nthreads = likelihood.get_num_threads()
+    try:
+        assert likelihood.set_num_threads(1) == 1
+        serial_lnols = likelihood.get_lnoverlaps(comp, dummy_data)
+        nthreads = likelihood.set_num_threads(2)
+        assert nthreads in (1, 2)
+        parallel_lnols = likelihood.get_lnoverlaps(comp, dummy_data)
+    finally:
+        likelihood.set_num_threads(orig_nthreads)
+
+    assert np.allclose(serial_lnols, parallel_lnols)
+
+
+def test_overlap_backends():
+    """
+    Checks every registered overlap backend agrees, for both single and
+    multiple component overlaps
+    """
+    nstars = 50
+    rand_mats = np.random.randn(nstars, 6, 6)
+    star_covs = np.einsum('nij,nkj->nik', rand_mats, rand_mats)
+    star_covs += 0.1 * np.identity(6)
+    star_means = 3 * np.random.randn(nstars, 6)
+    dummy_data = {'means':star_means, 'covs':star_covs}
+    comps = [
+        SphereComponent(pars=np.hstack((np.zeros(6), 3., 2., 1e-10))),
+        SphereComponent(pars=np.hstack((np.ones(6), 10., 1., 1e-10))),
+    ]
+
+    orig_backend = likelihood.get_overlap_backend()
+    results = {}
+    try:
+        for backend in likelihood.OVERLAP_BACKENDS:
+            likelihood.set_overlap_backend(backend)
+            results[backend] = (
+                likelihood.get_lnoverlaps(comps[0], dummy_data),
+                likelihood.get_lnoverlaps_multi(comps, dummy_data),
+            )
+    finally:
+        likelihood.set_overlap_backend(orig_backend)
+
+    ref_lnols, ref_multi_lnols = results['python']
+    assert np.allclose(ref_lnols, ref_multi_lnols[:, 0])
+    for lnols, multi_lnols in results.values():
+        assert np.allclose(ref_lnols, lnols)
+        assert np.allclose(ref_multi_lnols, multi_lnols)
+
+
+def test_packed_covs():
+    """
+    Checks overlaps with stars whose covariance matrices are packed
+    match those with full matrices, for every backend, whether or not it
+    uses the packed matrices directly
+    """
+    nstars = 100
+    rand_mats = np.random.randn(nstars, 6, 6)
+    star_covs = np.einsum('nij,nkj->nik', rand_mats, rand_mats)
+    star_covs += 0.1 * np.identity(6)
+    star_means = 3 * np.random.randn(nstars, 6)
+    dummy_data = {'means':star_means, 'covs':star_covs}
+    packed_data = {'means':star_means,
+                   'packed_covs':transform.pack_covmatrices(star_covs)}
+    assert packed_data['packed_covs'].shape == (nstars, 21)
+    assert np.all(transform.unpack_covmatrices(packed_data['packed_covs'])
+                  == star_covs)
+
+    comps = [
+        SphereComponent(pars=np.hstack((np.zeros(6), 3., 2., 1e-10))),
+        SphereComponent(pars=np.hstack((np.ones(6), 10., 1., 1e-10))),
+    ]
+    star_mask = np.where(np.arange(nstars) % 3 > 0)
+
+    orig_backend = likelihood.get_overlap_backend()
+    try:
+        for backend in likelihood.OVERLAP_BACKENDS:
+            likelihood.set_overlap_backend(backend)
+            for mask in [None, star_mask]:
+                assert np.allclose(
+                    likelihood.get_lnoverlaps(comps[0], packed_data, mask),
+                    likelihood.get_lnoverlaps(comps[0], dummy_data, mask),
+                )
+                assert np.allclose(
+                    likelihood.get_lnoverlaps_multi(comps, packed_data, mask),
+                    likelihood.get_lnoverlaps_multi(comps, dummy_data, mask),
+                )
+    finally:
+        likelihood.set_overlap_backend(orig_backend)
+
+
+def test_overlapCache():
+    """
+    Checks the cache returns the same overlaps as get_lnoverlaps_multi,
+    only calculating those of components it hasn't seen
+    """
+    nstars = 50
+    star_means = 3 * np.random.randn(nstars, 6)
+    star_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    dummy_data = {'means':star_means, 'covs':star_covs}
+    comps = [
+        SphereComponent(pars=np.hstack((np.zeros(6), 3., 2., 1e-10))),
+        SphereComponent(pars=np.hstack((np.ones(6), 10., 1., 1e-10))),
+        SphereComponent(pars=np.hstack((-np.ones(6), 5., 1., 1e-10))),
+    ]
+    expected_lnols = likelihood.get_lnoverlaps_multi(comps, dummy_data)
+
+    overlap_cache = likelihood.OverlapCache(maxsize=2)
+    assert np.all(overlap_cache.get_lnoverlaps_multi(comps[:2], dummy_data)
+                  == expected_lnols[:, :2])
+    assert overlap_cache.get_stats()['misses'] == 2
+
+    # An equal component (but a different object) is a hit
+    same_comp = SphereComponent(pars=comps[1].get_pars())
+    assert np.all(overlap_cache.get_lnoverlaps_multi(
+            [same_comp, comps[2]], dummy_data) == expected_lnols[:, 1:])
+    assert overlap_cache.hits == 1
+    assert overlap_cache.misses == 3
+    assert len(overlap_cache) == 2
+
+    # comps[0] was dropped as least recently used
+    overlap_cache.get_lnoverlaps_multi(comps[:1], dummy_data)
+    assert overlap_cache.misses == 4
+
+    # Different data clears the cache
+    other_data = {'means':star_means + 1., 'covs':star_covs}
+    assert np.all(overlap_cache.get_lnoverlaps_multi(comps, other_data)
+                  == likelihood.get_lnoverlaps_multi(comps, other_data))
+    assert overlap_cache.hits == 0
+
+    # As does replacing an array of the same data dict, but a new dict of
+    # the same arrays doesn't
+    other_data['means'] = star_means
+    assert np.all(overlap_cache.get_lnoverlaps_multi(comps, other_data)
+                  == expected_lnols)
+    assert overlap_cache.misses == 3
+    overlap_cache.get_lnoverlaps_multi(comps[1:], dict(other_data))
+    assert overlap_cache.hits == 2
+
+
 def test_lnprob_func():
     """
     Generates two components. Generates a synthetic data set based on the
@@ -184,3 +335,35 @@ def test_lnprob_func():
     # Check that the different realisations only differ by 20%
     assert np.isclose(lnprob_comp1_data1, lnprob_comp2_data2, rtol=2e-1)
     assert np.isclose(lnprob_comp1_data2, lnprob_comp2_data1, rtol=2e-1)
+
+
+def test_lnprob_func_vectorised():
+    """
+    Checks the batched lnprob matches the scalar lnprob for each walker,
+    including a walker rejected by the prior
+    """
+    nstars = 50
+    star_means = np.random.randn(nstars, 6) * 5.
+    star_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    dummy_data = {'means':star_means, 'covs':star_covs}
+    memb_probs = np.random.rand(nstars)
+
+    walker_pars = np.array([
+        np.hstack((np.zeros(6), np.log(3.), np.log(2.), 1e-10)),
+        np.hstack((np.ones(6), np.log(10.), np.log(1.), 1e-10)),
+        np.hstack((np.ones(6), np.log(10.), np.log(1.), -5.)),  # bad age
+    ])
+
+    batch_lnprobs = likelihood.lnprob_func_vectorised(
+            walker_pars, dummy_data, memb_probs,
+            trace_orbit_func=dummy_trace_orbit_func,
+    )
+    scalar_lnprobs = [
+        likelihood.lnprob_func(pars, dummy_data, memb_probs,
+                               trace_orbit_func=dummy_trace_orbit_func)
+        for pars in walker_pars
+    ]
+
+    assert batch_lnprobs.shape == (len(walker_pars),)
+    assert np.allclose(batch_lnprobs[:2], scalar_lnprobs[:2])
+    assert batch_lnprobs[2] == -np.inf == scalar_lnprobs[2]
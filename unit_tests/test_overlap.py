@@ -183,3 +183,115 @@ def test_swigImplementation():
     assert np.isfinite(p_lnos).all()
     assert np.isfinite(c_lnos).all()
 
+
+
+def test_multiComponentImplementation():
+    """
+    Compares the swigged multi-component c implementation against
+    calling the single component implementation once per component
+    """
+    from chronostar._overlap import get_lnoverlaps_multi as c_lno_multi
+    from chronostar import likelihood
+
+    comp_means = [np.zeros(6), np.ones(6), -5 * np.ones(6)]
+    comp_dxs = [2., 5., 10.]
+    comp_dvs = [2., 1., 3.]
+    comps = [SphereComponent(pars=np.hstack((mean, dx, dv, 1e-10)))
+             for mean, dx, dv in zip(comp_means, comp_dxs, comp_dvs)]
+    ncomps = len(comps)
+
+    nstars = 100
+    synth_data = SynthData(pars=comps[0].get_pars(), starcounts=nstars)
+    synth_data.synthesise_everything()
+    tabletool.convert_table_astro2cart(synth_data.table)
+    star_data = tabletool.build_data_dict_from_table(synth_data.table)
+
+    covs = np.array([c.get_covmatrix() for c in comps])
+    means = np.array([c.get_mean() for c in comps])
+    c_lnos = np.zeros((nstars, ncomps))
+    c_lno_multi(covs, means, star_data['covs'], star_data['means'], c_lnos)
+
+    for i, comp in enumerate(comps):
+        single_lnos = c_lno(comp.get_covmatrix(), comp.get_mean(),
+                            star_data['covs'], star_data['means'], nstars)
+        assert np.allclose(single_lnos, c_lnos[:, i])
+
+    assert np.allclose(c_lnos,
+                       likelihood.get_lnoverlaps_multi(comps, star_data))
+    assert np.isfinite(c_lnos).all()
+
+
+def test_choleskyKernel():
+    """
+    Compares the unrolled cholesky kernel against the GSL LU kernel,
+    including the fallback for matrices that aren't positive definite
+    """
+    from chronostar import likelihood
+
+    nstars = 100
+    gr_cov = np.diag([4., 4., 4., 1., 1., 1.])
+    gr_mn = np.ones(6)
+    rand_mats = np.random.randn(nstars, 6, 6)
+    st_covs = np.einsum('nij,nkj->nik', rand_mats, rand_mats)
+    st_covs += 0.1 * np.identity(6)
+    # Final star's combined covariance matrix is not positive definite
+    st_covs[-1] = -10 * np.identity(6)
+    st_mns = 3 * np.random.randn(nstars, 6)
+
+    orig_kernel = likelihood.get_overlap_kernel()
+    try:
+        likelihood.set_overlap_kernel('gsl')
+        gsl_lnos = c_lno(gr_cov, gr_mn, st_covs, st_mns, nstars)
+        likelihood.set_overlap_kernel('cholesky')
+        chol_lnos = c_lno(gr_cov, gr_mn, st_covs, st_mns, nstars)
+    finally:
+        likelihood.set_overlap_kernel(orig_kernel)
+
+    assert np.allclose(gsl_lnos, chol_lnos)
+    assert np.allclose(p_lno(gr_cov, gr_mn, st_covs[:-1], st_mns[:-1]),
+                       chol_lnos[:-1])
+
+
+def test_multiComponentDimensionChecks():
+    """
+    Checks the multi-component c implementations refuse arrays whose
+    dimensions don't agree, rather than reading or writing past their end
+    """
+    from chronostar._overlap import get_lnoverlaps_multi as c_lno_multi
+    from chronostar._overlap import get_lnoverlaps_multi_packed \
+        as c_lno_multi_packed
+    from chronostar.transform import pack_covmatrices
+
+    nstars, ncomps = 10, 3
+    gr_covs = np.tile(np.identity(6), (ncomps, 1, 1))
+    gr_mns = np.zeros((ncomps, 6))
+    st_covs = np.tile(np.identity(6), (nstars, 1, 1))
+    st_pcovs = pack_covmatrices(st_covs)
+    st_mns = np.ones((nstars, 6))
+
+    bad_calls = [
+        # lnols_matrix has too few rows, or too few columns
+        (c_lno_multi, gr_covs, gr_mns, st_covs, st_mns, (nstars-1, ncomps)),
+        (c_lno_multi, gr_covs, gr_mns, st_covs, st_mns, (nstars, ncomps-1)),
+        # fewer star means than covariance matrices
+        (c_lno_multi, gr_covs, gr_mns, st_covs, st_mns[:-1], (nstars, ncomps)),
+        (c_lno_multi_packed, gr_covs, gr_mns, st_pcovs, st_mns,
+         (nstars+1, ncomps)),
+        (c_lno_multi_packed, gr_covs, gr_mns, st_pcovs, st_mns,
+         (nstars, ncomps+1)),
+        # packed matrices of the wrong size
+        (c_lno_multi_packed, gr_covs, gr_mns, st_pcovs[:, :20], st_mns,
+         (nstars, ncomps)),
+    ]
+    for func, covs, mns, star_covs, star_mns, lnols_shape in bad_calls:
+        lnols = np.zeros(lnols_shape)
+        try:
+            func(covs, mns, np.ascontiguousarray(star_covs), star_mns, lnols)
+            assert False, 'Should have refused mismatched dimensions'
+        except ValueError:
+            pass
+        assert np.all(lnols == 0.)
+
+    lnols = np.zeros((nstars, ncomps))
+    c_lno_multi_packed(gr_covs, gr_mns, st_pcovs, st_mns, lnols)
+    assert np.isfinite(lnols).all()
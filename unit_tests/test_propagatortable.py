@@ -0,0 +1,67 @@
+"""
+Check a propagator table reproduces galpy projections within its box
+"""
+import numpy as np
+import shutil
+import tempfile
+
+import sys
+sys.path.insert(0,'..')
+from chronostar import propagatortable
+from chronostar import traceorbit
+from chronostar.component import SphereComponent
+
+
+def test_propagatorTable():
+    """
+    Builds a small table and checks lookups, and trace functions built with
+    it, match galpy within the table's error bounds, with points outside
+    the table falling back to galpy
+    """
+    savedir = tempfile.mkdtemp()
+    try:
+        table = propagatortable.build_propagator_table(
+                savedir, pos_halfwidth=20., vel_halfwidth=2.,
+                pos_spacing=10., vel_spacing=1., max_age=10.,
+                age_spacing=1., nvalidate=10,
+        )
+        error_bounds = table.get_error_bounds()
+        assert error_bounds['pos'] < 0.1
+        assert error_bounds['vel'] < 0.01
+        assert error_bounds['jac'] < 1e-2
+
+        xyzuvw_start = np.array([5., 50., -5., 0.5, -0.5, 0.2])
+        age = 7.3
+        xyzuvw_now, jac = traceorbit.trace_cartesian_orbit_tangent(
+                xyzuvw_start, age,
+        )
+        table_xyzuvw_now, table_jac = table.lookup(xyzuvw_start, age)
+        assert np.allclose(xyzuvw_now, table_xyzuvw_now, atol=0.1)
+        assert np.allclose(jac, table_jac, atol=1e-2*np.max(np.abs(jac)))
+
+        # Outside the table
+        assert table.lookup(xyzuvw_start, 11.) is None
+        assert table.lookup(xyzuvw_start, -1.) is None
+        assert table.lookup(10*xyzuvw_start, age) is None
+
+        # Table lookups through trace_orbit_builder, also from disk
+        table_trace_func = traceorbit.trace_orbit_builder(
+                traceorbit.MWPotential2014, propagator_table=savedir,
+        )
+        assert np.allclose(table_trace_func(xyzuvw_start, age),
+                           table_xyzuvw_now)
+        assert np.allclose(table_trace_func(10*xyzuvw_start, age),
+                           traceorbit.trace_cartesian_orbit(10*xyzuvw_start,
+                                                            age))
+
+        pars = np.hstack((xyzuvw_start, [5., 1., age]))
+        table_comp = SphereComponent(pars=pars,
+                                     trace_orbit_func=table_trace_func)
+        comp = SphereComponent(pars=pars)
+        assert np.allclose(table_comp.get_mean_now(), comp.get_mean_now(),
+                           atol=0.1)
+        covmatrix_now = comp.get_covmatrix_now()
+        assert np.allclose(table_comp.get_covmatrix_now(), covmatrix_now,
+                           atol=2e-2*np.max(np.abs(covmatrix_now)))
+    finally:
+        shutil.rmtree(savedir)
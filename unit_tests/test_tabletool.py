@@ -448,6 +448,50 @@ def test_convertSynthTableToCart():
                            synth_data.table[dim])
 
 
+def test_convertTableBulk():
+    """
+    Checks converting every star at once, with analytic Jacobians,
+    matches converting row by row, and that rows with missing astrometry
+    are skipped without misaligning the rest
+    """
+    PARS = np.array([
+        [0., 0., 0., 0., 0., 0., 10., 5., 20.],
+    ])
+    synth_data = SynthData(pars=PARS, starcounts=[30],
+                           Components=SphereComponent)
+    synth_data.synthesise_everything()
+    synth_data.table['radial_velocity'][3] = np.nan
+
+    row_table = Table(synth_data.table, copy=True)
+    tabletool.convert_table_astro2cart(row_table, bulk=False)
+    tabletool.convert_table_astro2cart(synth_data.table)
+
+    row_data, row_ixs = tabletool.build_data_dict_from_table(
+            row_table, return_table_ixs=True,
+    )
+    bulk_data, bulk_ixs = tabletool.build_data_dict_from_table(
+            synth_data.table, return_table_ixs=True,
+    )
+    assert 3 not in bulk_ixs[0]
+    # The row by row conversion misplaces stars after the missing one,
+    # so only compare the rows before it
+    good_ixs = bulk_ixs[0][bulk_ixs[0] < 3]
+    assert np.allclose(bulk_data['means'][good_ixs],
+                       row_data['means'][good_ixs])
+    assert np.allclose(bulk_data['covs'][good_ixs],
+                       row_data['covs'][good_ixs], rtol=1e-3)
+
+    # Every remaining star should match its own conversion
+    astr_data = tabletool.build_data_dict_from_table(synth_data.table,
+                                                     cartesian=False)
+    for astr_mean, astr_cov, cart_mean, cart_cov in zip(
+            astr_data['means'], astr_data['covs'],
+            bulk_data['means'], bulk_data['covs']):
+        row_mean, row_cov = tabletool.convert_astro2cart(astr_mean, astr_cov)
+        assert np.allclose(row_mean, cart_mean)
+        assert np.allclose(row_cov, cart_cov, rtol=1e-3)
+
+
 def test_convertAstrTableToCart():
     """
     Using a historical table, confirm that cartesian conversion yields
@@ -570,6 +614,89 @@ def test_build_data_from_incomplete_table():
     assert len(star_pars['covs']) == np.sum(np.logical_not(nan_mask))
 
 
+def test_dataDictCache():
+    """
+    Check a data dict cached alongside its table is reused, including
+    after the table is touched, but not once the table's contents change
+    """
+    import os
+    import shutil
+    import tempfile
+
+    NSTARS = 10
+    means = np.random.rand(NSTARS,6)
+    covs = np.array(NSTARS*[np.eye(6)])
+
+    dummy_table = Table()
+    dummy_table['names'] = np.arange(NSTARS)
+    tabletool.append_cart_cols_to_table(dummy_table)
+    for row, mean, cov in zip(dummy_table, means, covs):
+        tabletool.insert_data_into_row(row, mean, cov)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'dummy_table.fits')
+        dummy_table.write(filename)
+        orig_dict, orig_ixs = tabletool.build_data_dict_from_table(
+                filename, get_background_overlaps=False,
+                return_table_ixs=True,
+        )
+
+        first_dict = tabletool.build_data_dict_from_table(
+                filename, get_background_overlaps=False, use_cache=True,
+        )
+        cached_dict, cached_ixs = tabletool.build_data_dict_from_table(
+                filename, get_background_overlaps=False, use_cache=True,
+                return_table_ixs=True,
+        )
+        for data_dict in [first_dict, cached_dict]:
+            for key in ['means', 'covs']:
+                assert np.all(data_dict[key] == orig_dict[key])
+        assert np.all(cached_ixs[0] == orig_ixs[0])
+        assert isinstance(cached_dict['covs'], np.memmap)
+        assert not isinstance(first_dict['covs'], np.memmap)
+
+        # Only a change of timestamp, cache still valid
+        os.utime(filename, (0, 0))
+        touched_dict = tabletool.build_data_dict_from_table(
+                filename, get_background_overlaps=False, use_cache=True,
+        )
+        assert isinstance(touched_dict['covs'], np.memmap)
+
+        # Different contents, cache must be rebuilt
+        dummy_table['X'] += 1.
+        dummy_table.write(filename, overwrite=True)
+        new_dict = tabletool.build_data_dict_from_table(
+                filename, get_background_overlaps=False, use_cache=True,
+        )
+        assert not isinstance(new_dict['covs'], np.memmap)
+        assert np.allclose(new_dict['means'][:,0], orig_dict['means'][:,0] + 1.)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_build_packed_data_dict():
+    """
+    Check packed covariance matrices built from a table match the full
+    matrices, including for rows that are skipped
+    """
+    table = Table.read(CURR_FILE_NAME)
+    table['X_error'][1] = np.nan
+    data_dict, table_ixs = tabletool.build_data_dict_from_table(
+            table, return_table_ixs=True,
+    )
+    packed_dict, packed_ixs = tabletool.build_data_dict_from_table(
+            table, return_table_ixs=True, pack_covs=True,
+    )
+    assert 'covs' not in packed_dict
+    assert np.all(packed_ixs[0] == table_ixs[0])
+    assert np.all(packed_dict['means'] == data_dict['means'])
+    assert np.allclose(
+            transform.unpack_covmatrices(packed_dict['packed_covs']),
+            data_dict['covs'],
+    )
+
+
 if __name__ == '__main__':
     pass
 
@@ -514,3 +514,122 @@ def test_different_potential():
 
 if __name__ == '__main__':
     test_different_potential()
+
+def test_batchTrace():
+    """Check tracing many points in a single integration matches tracing
+    each point individually, for any potential"""
+    xyzuvws = np.array([
+        [0., 0., 25., 0., 0., 0.],
+        [10., 0., -50., 0., 0., 0.],
+        [10., 0., -50., 0., 0., -5.],
+        [0., 0., 0., 10., 25., 30.,],
+    ])
+    miya_pot = MiyamotoNagaiPotential(a=0.5, b=0.0375, amp=1., normalize=1.)
+    miya_trace_cartesian_orbit = torb.trace_orbit_builder(miya_pot)
+    # Built functions carry their batched version, rather than registering it
+    assert miya_trace_cartesian_orbit not in torb.BATCHED_TRACE_FUNCS
+    for trace_func, batch_trace_func in [
+        (torb.trace_cartesian_orbit, torb.trace_cartesian_orbit_batch),
+        (miya_trace_cartesian_orbit, miya_trace_cartesian_orbit.batch_func),
+    ]:
+        for age in [0., 30., -30.]:
+            batch_xyzuvws = batch_trace_func(xyzuvws, times=age)
+            assert batch_xyzuvws.shape == xyzuvws.shape
+            for xyzuvw_start, batch_xyzuvw in zip(xyzuvws, batch_xyzuvws):
+                assert np.allclose(trace_func(xyzuvw_start, times=age),
+                                   batch_xyzuvw)
+
+        # Each point with its own age, including traceback
+        ages = np.array([30., 0., 12.5, -30.])
+        batch_xyzuvws = batch_trace_func(xyzuvws, times=ages)
+        for xyzuvw_start, age, batch_xyzuvw in zip(xyzuvws, ages,
+                                                   batch_xyzuvws):
+            assert np.allclose(trace_func(xyzuvw_start, times=age),
+                               batch_xyzuvw)
+
+def test_manyTrace():
+    """Check tracing many stars, each with its own age, grouped into
+    multi-orbit integrations (also across a pool) matches tracing each
+    star individually"""
+    from multiprocessing import Pool
+    xyzuvws = np.array([
+        [0., 0., 25., 0., 0., 0.],
+        [10., 0., -50., 0., 0., 0.],
+        [10., 0., -50., 0., 0., -5.],
+        [0., 0., 0., 10., 25., 30.,],
+        [-20., 5., 10., -3., 2., 1.,],
+    ])
+    ages = np.array([30., 0., 30., -30., 30.])
+    expected = np.array([torb.trace_cartesian_orbit(xyzuvw, times=age)
+                         for xyzuvw, age in zip(xyzuvws, ages)])
+    assert np.allclose(torb.trace_many_cartesian_orbit(xyzuvws, ages),
+                       expected)
+    assert np.allclose(torb.trace_many_cartesian_orbit(xyzuvws, ages,
+                                                       chunk_size=2),
+                       expected)
+    pool = Pool(2)
+    try:
+        assert np.allclose(
+                torb.trace_many_cartesian_orbit(xyzuvws, ages, pool=pool,
+                                                chunk_size=2),
+                expected)
+    finally:
+        pool.close()
+        pool.join()
+
+    times = np.linspace(0., 30., 4)
+    many_orbits = torb.trace_many_cartesian_orbit(xyzuvws, times,
+                                                  single_age=False)
+    assert many_orbits.shape == (len(xyzuvws), len(times), 6)
+    for xyzuvw, many_orbit in zip(xyzuvws, many_orbits):
+        assert np.allclose(torb.trace_cartesian_orbit(xyzuvw, times,
+                                                      single_age=False),
+                           many_orbit)
+
+def test_epicyclicJacobian():
+    """Check the analytic Jacobian of the epicyclic projection matches
+    a finite difference one, and the projected point matches
+    trace_epicyclic_orbit"""
+    import chronostar.transform as tf
+
+    xyzuvws = np.array([
+        [0., 0., 25., 0., 0., 0.],
+        [10., -20., 5., 1., -2., 0.5],
+        [-50., 80., -30., 5., 3., -2.],
+    ])
+    assert torb.JACOBIAN_FUNCS[torb.trace_epicyclic_orbit] is \
+           torb.calc_epicyclic_jacobian
+    for age in [0., 25., -40.]:
+        for xyzuvw_start in xyzuvws:
+            xyzuvw_now, jac = torb.calc_epicyclic_jacobian(xyzuvw_start,
+                                                           times=age)
+            assert np.allclose(xyzuvw_now,
+                               torb.trace_epicyclic_orbit(xyzuvw_start,
+                                                          times=age))
+            num_jac = tf.calc_jacobian(torb.trace_epicyclic_orbit,
+                                       xyzuvw_start, args=(age,), h=1e-4)
+            assert np.allclose(jac, num_jac, atol=1e-6)
+
+def test_tangentTrace():
+    """Check the Jacobian from the variational equations matches the
+    finite difference one, and the projected point matches
+    trace_cartesian_orbit"""
+    import chronostar.transform as tf
+
+    xyzuvws = np.array([
+        [0., 0., 25., 0., 0., 0.],
+        [10., -20., 5., 1., -2., 0.5],
+        [-50., 80., -30., 5., 3., -2.],
+    ])
+    for age in [0., 25., -40.]:
+        for xyzuvw_start in xyzuvws:
+            xyzuvw_now, jac = torb.trace_cartesian_orbit_tangent(
+                    xyzuvw_start, times=age,
+            )
+            assert np.allclose(xyzuvw_now,
+                               torb.trace_cartesian_orbit(xyzuvw_start,
+                                                          times=age),
+                               atol=1e-5)
+            num_jac = tf.calc_jacobian(torb.trace_cartesian_orbit,
+                                       xyzuvw_start, args=(age,))
+            assert np.allclose(jac, num_jac, atol=1e-5)
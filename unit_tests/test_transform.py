@@ -71,3 +71,15 @@ def test_polar():
 
     assert np.allclose(estimated_mean, cart_mean, rtol=1e-1)
     assert np.allclose(estimated_cov, cart_cov, rtol=1e-1)
+
+def test_jacobian_batch():
+    """Check the batched jacobian matches the point by point one, and
+    returns the transformed location"""
+    pol_mean = np.array([np.sqrt(10 ** 2 + 10 ** 2), 14 * np.pi / 6.])
+
+    jac = tf.calc_jacobian(convertPolarToCartesian, pol_mean, dim=2)
+    cart_mean, batch_jac = tf.calc_jacobian_batch(convertManyPolarToCartesian,
+                                                  pol_mean, dim=2)
+
+    assert np.allclose(cart_mean, convertPolarToCartesian(pol_mean))
+    assert np.allclose(jac, batch_jac)
@@ -58,6 +58,20 @@ def test_calcMembershipProbs():
     assert np.allclose([.25, .25, .5],
                        em.calc_membership_probs(np.log(star_ols)))
 
+    # many stars at once, including overlaps too small to exponentiate
+    # and a star with no overlap with anything
+    lnols = np.array([np.log([10, 10, 20]),
+                      [-2000., -2000. + np.log(3), -np.inf],
+                      [-np.inf, -np.inf, -np.inf]])
+    out = np.zeros(lnols.shape)
+    memb_probs, ln_memb_probs = em.calc_membership_probs(
+            lnols, out=out, return_ln_memb_probs=True,
+    )
+    assert memb_probs is out
+    assert np.allclose([[.25, .25, .5], [.25, .75, 0.]], memb_probs[:2])
+    assert np.all(np.isnan(memb_probs[2]))
+    assert np.allclose(np.exp(ln_memb_probs[:2]), memb_probs[:2])
+
 
 def test_expectation():
     """
@@ -93,6 +107,32 @@ def test_expectation():
 
     assert np.allclose(true_memb_probs, fitted_memb_probs, atol=1e-10)
 
+
+def test_incremental_expectation():
+    """
+    Checks that with an overlap cache, expectation only calculates the
+    overlaps of components that changed, while amplitudes (from the old
+    memberships) are still updated
+    """
+    nstars = 60
+    data = {'means':np.random.randn(nstars, 6) * 20.,
+            'covs':np.tile(np.identity(6), (nstars, 1, 1)),
+            'bg_lnols':np.full(nstars, -30.)}
+    comps = [SphereComponent(np.hstack((i * 10. * np.ones(6), 5., 2., 1e-5)))
+             for i in range(3)]
+    overlap_cache = chronostar.likelihood.OverlapCache(maxsize=6)
+
+    memb_probs = em.expectation(data, comps, overlap_cache=overlap_cache)
+    assert overlap_cache.misses == 3
+
+    # Refit one component only, as when ignoring stable components
+    comps[1] = SphereComponent(np.hstack((-10. * np.ones(6), 5., 2., 1e-5)))
+    new_memb_probs = em.expectation(data, comps, memb_probs,
+                                    overlap_cache=overlap_cache)
+    assert overlap_cache.misses == 4
+    assert overlap_cache.hits == 2
+    assert np.allclose(new_memb_probs, em.expectation(data, comps, memb_probs))
+
 '''
 @pytest.mark.skip
 def test_fit_many_comps_gradient_descent_with_multiprocessing():